@@ -70,6 +70,11 @@ def unregister():
 	km = wm.keyconfigs.active.keymaps['3D View']
 	kmi = km.keymap_items.remove(km.keymap_items['view3d.map_start'])
 	bpy.utils.unregister_module(__name__)
+	#release sqlite connections to cache databases and stop background fetch engines
+	GeoPackage.flushAccessed()
+	GeoPackage.closeAll()
+	MapService.asyncFetcher.stop()
+	MapService.workers.stop()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,215 @@
+# -*- coding:utf-8 -*-
+
+#  ***** GPL LICENSE BLOCK *****
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#  All rights reserved.
+#  ***** GPL LICENSE BLOCK *****
+
+'''
+Some benchmarks of the basemaps engine
+Run them from Blender python console, for example :
+	from basemaps import benchmarks
+	benchmarks.benchGetTiles()
+'''
+
+import os
+import io
+import time
+import tempfile
+import sqlite3
+import threading
+import queue
+import urllib.request
+import http.server
+import socketserver
+
+from PIL import Image
+
+from .servicesDefs import GRIDS, SOURCES
+from .mapviewer import GeoPackage, TileMatrix, MapService, HTTPConnectionPool, GeoImage, ReprojContext, reprojImg
+
+
+def legacyGetTiles(gpkg, tiles):
+	'''Previous implementation of GeoPackage.getTiles (IN x IN x IN query)'''
+	n = len(tiles)
+	xs, ys, zs = zip(*tiles)
+	lst = list(xs) + list(ys) + list(zs)
+	query = "SELECT tile_column, tile_row, zoom_level, tile_data FROM gpkg_tiles WHERE tile_column IN (" + ','.join('?'*n) + ") AND tile_row IN (" + ','.join('?'*n) + ") AND zoom_level IN (" + ','.join('?'*n) + ")"
+	with gpkg.pool.connect() as db:
+		return db.execute(query, lst).fetchall()
+
+
+def benchGetTiles(sizes=[(4,3), (8,6), (16,12), (32,24), (64,48)], zoom=12, tileBytes=15000):
+	'''
+	Compare rows read by the legacy cartesian query and by the exact keys lookup
+	Two request shapes are tested for each viewport size (in tiles) :
+		- full : every tiles of the viewport (cartesian product of cols and rows)
+		- ring : only the tiles at the viewport border (as requested by a pan or a prefetch)
+	'''
+	folder = tempfile.mkdtemp()
+	tm = TileMatrix(GRIDS['WM'])
+	gpkg = GeoPackage(os.path.join(folder, 'bench.gpkg'), tm)
+
+	#seed the cache with the largest viewport
+	w, h = max(sizes)
+	data = os.urandom(tileBytes)
+	gpkg.putTiles([(x, y, zoom, data) for x in range(w) for y in range(h)])
+
+	print('shape  viewport  requested  legacy rows  legacy ms  exact rows  exact ms')
+	for w, h in sizes:
+		full = [(x, y, zoom) for x in range(w) for y in range(h)]
+		ring = [(x, y, z) for x, y, z in full if x in (0, w-1) or y in (0, h-1)]
+		for shape, tiles in [('full', full), ('ring', ring)]:
+			t0 = time.perf_counter()
+			try:
+				legacy = len(legacyGetTiles(gpkg, tiles))
+			except sqlite3.OperationalError as e: #too many SQL variables
+				legacy = str(e)
+			t1 = time.perf_counter()
+			exact = len(gpkg.getTiles(tiles))
+			t2 = time.perf_counter()
+			print('{:5}  {:>8}  {:>9}  {:>11}  {:>9.1f}  {:>10}  {:>8.1f}'.format(shape, str(w)+'x'+str(h), len(tiles), legacy, (t1-t0)*1000, exact, (t2-t1)*1000))
+
+	gpkg.pool.close()
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+	'''A http server handling each request in a new thread (http.server.ThreadingHTTPServer requires Python 3.7)'''
+	daemon_threads = True
+
+
+class TileServer():
+	'''
+	A local stand-in tile server that return the same png tile for any url
+	after a fake latency, it also count the tcp connections opened by clients
+	'''
+
+	def __init__(self, latency=0.005):
+		b = io.BytesIO()
+		Image.new('RGB', (256, 256), 'lightblue').save(b, format='PNG')
+		tile = b.getvalue()
+		server = self
+
+		class Handler(http.server.BaseHTTPRequestHandler):
+			protocol_version = 'HTTP/1.1' #enable keep-alive
+			disable_nagle_algorithm = True
+			def setup(self):
+				server.nbConnections += 1
+				http.server.BaseHTTPRequestHandler.setup(self)
+			def do_GET(self):
+				time.sleep(latency)
+				self.send_response(200)
+				self.send_header('Content-Type', 'image/png')
+				self.send_header('Content-Length', str(len(tile)))
+				self.end_headers()
+				self.wfile.write(tile)
+			def log_message(self, *args):
+				pass
+
+		self.nbConnections = 0
+		self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+		self.url = 'http://127.0.0.1:' + str(self.httpd.server_port)
+		threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+	def shutdown(self):
+		self.httpd.shutdown()
+		self.httpd.server_close()
+
+
+def benchDownload(nbTiles=500, nbThread=10, latency=0.005):
+	'''
+	Compare tiles fetch throughput against a local stand-in tile server
+		- urlopen : a new connection for each tile (previous MapService.downloadTile behavior)
+		- pool : MapService.downloadTile through the keep-alive connection pool
+	'''
+	server = TileServer(latency)
+	SOURCES['_BENCH'] = {
+		"name" : 'Bench', "description" : 'Local stand-in tile server',
+		"service": 'TMS', "grid": 'WM', "quadTree": False,
+		"layers" : {"MAP" : {"urlKey" : '', "name" : 'Map', "description" : '', "format" : 'png', "zmin" : 0, "zmax" : 22}},
+		"urlTemplate": server.url + "/{Z}/{X}/{Y}.png",
+		"referer": server.url
+	}
+	srv = MapService('_BENCH', tempfile.mkdtemp() + os.sep)
+	srv.httpPool = HTTPConnectionPool(nbThread, nbThread)
+
+	def urlopen(laykey, col, row, zoom):
+		req = urllib.request.Request(srv.buildUrl(laykey, col, row, zoom), None, srv.headers)
+		with urllib.request.urlopen(req, timeout=3) as handle:
+			return handle.read()
+
+	def run(download):
+		jobs = queue.Queue()
+		for i in range(nbTiles):
+			jobs.put((i % 64, i // 64, 12))
+		def worker():
+			while True:
+				try:
+					col, row, zoom = jobs.get_nowait()
+				except queue.Empty:
+					return
+				assert download('MAP', col, row, zoom) is not None
+		threads = [threading.Thread(target=worker) for i in range(nbThread)]
+		t0 = time.perf_counter()
+		for t in threads:
+			t.start()
+		for t in threads:
+			t.join()
+		return time.perf_counter() - t0
+
+	print('mode     tiles  threads  seconds  tiles/s  connections')
+	try:
+		for mode, download in [('urlopen', urlopen), ('pool', srv.downloadTile)]:
+			server.nbConnections = 0
+			t = run(download)
+			print('{:7}  {:>5}  {:>7}  {:>7.2f}  {:>7.0f}  {:>11}'.format(mode, nbTiles, nbThread, t, nbTiles/t, server.nbConnections))
+	finally:
+		srv.httpPool.close()
+		del SOURCES['_BENCH']
+		server.shutdown()
+
+
+def benchWarp(size=4096, crs1=3857, crs2=4326, repeat=3):
+	'''
+	Compare the reprojection time of a size x size mosaic
+		- legacy : single threaded gdal.ReprojectImage, no memory limit and 0.25 px error threshold
+		- warp : gdal.Warp with current ReprojContext settings (multithreading, threshold, memory limit)
+	'''
+	#a random rgba mosaic centered on Europe with a zoom 12 like resolution
+	img = Image.frombytes('RGBA', (size, size), os.urandom(size*size*4))
+	res = 38.2185
+	geoimg = GeoImage(img, (-size/2*res, 5000000+size/2*res), res)
+
+	settings = [
+		('legacy', {'USE_WARP':False, 'MULTITHREAD':False, 'THRESHOLD':0.25, 'MEM_LIMIT':0}),
+		('warp', {'USE_WARP':True, 'MULTITHREAD':ReprojContext.MULTITHREAD, 'THRESHOLD':ReprojContext.THRESHOLD, 'MEM_LIMIT':ReprojContext.MEM_LIMIT})
+	]
+	backup = {k:getattr(ReprojContext, k) for k in settings[0][1]}
+
+	print('mode    size  threads  threshold  memory  seconds')
+	try:
+		for mode, attrs in settings:
+			for k, v in attrs.items():
+				setattr(ReprojContext, k, v)
+			reprojImg(crs1, crs2, geoimg) #warm up (spatial refs and datasets)
+			t0 = time.perf_counter()
+			for i in range(repeat):
+				reprojImg(crs1, crs2, geoimg)
+			t = (time.perf_counter() - t0) / repeat
+			threads = 'all' if attrs['MULTITHREAD'] else '1'
+			print('{:6}  {:>4}  {:>7}  {:>9}  {:>6}  {:>7.2f}'.format(mode, size, threads, attrs['THRESHOLD'], attrs['MEM_LIMIT'] or 'auto', t))
+	finally:
+		for k, v in backup.items():
+			setattr(ReprojContext, k, v)
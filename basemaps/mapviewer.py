@@ -24,16 +24,30 @@ import io
 import threading
 import queue
 import datetime
+import time
 import sqlite3
 import urllib.request
+import urllib.parse
+import http.client
+import gzip
+import zlib
 import imghdr
+import hashlib
+import heapq
+import itertools
 import json
+import asyncio
+import ssl
+import email.parser
+from collections import OrderedDict
+from contextlib import contextmanager
 
 #bpy imports
 import bpy
 from bpy.types import Operator, Panel, AddonPreferences
 from bpy.props import StringProperty, IntProperty, FloatProperty, BoolProperty, EnumProperty, FloatVectorProperty
 from bpy_extras.view3d_utils import region_2d_to_location_3d, region_2d_to_vector_3d
+from mathutils import Vector
 import addon_utils
 import blf, bgl
 
@@ -53,7 +67,7 @@ from .servicesDefs import GRIDS, SOURCES
 #geoscene imports
 from geoscene.geoscn import GeoScene, SK
 from geoscene.addon import georefManagerLayout, PredefCRS
-from geoscene.proj import reprojPt, reprojBbox, dd2meters, CRS
+from geoscene.proj import reprojPt, reprojBbox, dd2meters, meters2dd, CRS, GRS80
 
 #OSM Nominatim API module
 #https://github.com/damianbraun/nominatim
@@ -67,6 +81,68 @@ RESAMP_ALG = 'BL' #NN:Nearest Neighboor, BL:Bilinear, CB:Cubic, CBS:Cubic Spline
 
 ########################
 
+class GpkgConnectionPool():
+	'''
+	A bounded pool of persistent sqlite connections to one geopackage file
+	Connections are opened lazily, configured once (WAL journaling and tuning pragmas)
+	and then shared by all threads and GeoPackage instances pointing to the same file
+	'''
+
+	def __init__(self, path, size, pragmas, timeout, functions=()):
+		self.path = path
+		self.size = size
+		self.pragmas = pragmas
+		self.timeout = timeout
+		self.functions = functions #(name, nbArgs, func) sql functions registered on each connection
+		self.idle = queue.LifoQueue()
+		self.connections = []
+		self.lock = threading.Lock()
+
+	def open(self):
+		#isolation_level None means autocommit, write transactions are explicitly opened with BEGIN IMMEDIATE
+		#so that concurrent writers wait on the busy timeout instead of failing with "database is locked"
+		db = sqlite3.connect(self.path, timeout=self.timeout, detect_types=sqlite3.PARSE_DECLTYPES, isolation_level=None, check_same_thread=False)
+		for k, v in self.pragmas:
+			db.execute('PRAGMA ' + k + ' = ' + str(v))
+		for name, nbArgs, func in self.functions:
+			db.create_function(name, nbArgs, func)
+		return db
+
+	def acquire(self):
+		try:
+			return self.idle.get_nowait()
+		except queue.Empty:
+			pass
+		with self.lock:
+			if len(self.connections) < self.size:
+				db = self.open()
+				self.connections.append(db)
+				return db
+		#pool exhausted, wait for a connection to be released
+		return self.idle.get()
+
+	def release(self, db):
+		if db.in_transaction:
+			db.rollback()
+		self.idle.put(db)
+
+	@contextmanager
+	def connect(self):
+		'''Context manager that checkout a connection and give it back to the pool on exit'''
+		db = self.acquire()
+		try:
+			yield db
+		finally:
+			self.release(db)
+
+	def close(self):
+		with self.lock:
+			for db in self.connections:
+				db.close()
+			self.connections = []
+			self.idle = queue.LifoQueue()
+
+
 #http://www.geopackage.org/spec/#tiles
 #https://github.com/GitHubRGI/geopackage-python/blob/master/Packaging/tiles2gpkg_parallel.py
 #https://github.com/Esri/raster2gpkg/blob/master/raster2gpkg.py
@@ -77,12 +153,47 @@ RESAMP_ALG = 'BL' #NN:Nearest Neighboor, BL:Bilinear, CB:Cubic, CBS:Cubic Spline
 
 class GeoPackage():
 
-	MAX_DAYS = 90
+	MAX_DAYS = 90 #age of stale tiles, they are still served but revalidated against the map service
+
+	#Columns added to gpkg_tiles after the first release, existing databases are upgraded on opening
+	TILES_COLUMNS = [
+		('etag', 'TEXT'), #http validators of the tile
+		('http_last_modified', 'TEXT'),
+		('last_access', 'TIMESTAMP') #last time the tile was read (updated at most once a day), NULL if never read
+	]
+
+	#Sqlite tuning, shared by all connections of the pool
+	POOL_SIZE = 8 #max number of opened connections per database file
+	BUSY_TIMEOUT = 30 #seconds to wait for a lock held by another thread or process
+	SYNCHRONOUS = 'NORMAL' #OFF, NORMAL or FULL (NORMAL is safe in WAL mode)
+	CACHE_SIZE = -16000 #page cache per connection, negative value is in KiB
+	MMAP_SIZE = 268435456 #bytes of the database file memory mapped for reads (0 to disable)
 
-	def __init__(self, path, tm):
+	#Connection pools, one per database file
+	pools = {}
+	poolsLock = threading.Lock()
+
+	#New databases store identical tiles data only once, gpkg_tiles is then a view (see createTilesTable)
+	DEDUP = False
+
+	#Approximate size in bytes of a tile row besides its data (attributes and index entries), see iterLRU
+	ROW_SIZE = 64
+
+	#Max number of free pages released to the file system by a background compaction (see compact)
+	COMPACT_PAGES = 4096
+
+	#Tiles read since last flush, by database file (see markAccessed)
+	accessed = {}
+	accessedLock = threading.Lock()
+
+	def __init__(self, path, tm=None):
+		'''tm can be None to open an existing database for maintenance tasks only'''
 		self.dbPath = path
 		self.name = os.path.splitext(os.path.basename(path))[0]
 
+		if tm is None:
+			return
+
 		#Get props from TileMatrix object
 		self.auth, self.code = tm.CRS.split(':')
 		self.code = int(self.code)
@@ -100,213 +211,606 @@ class GeoPackage():
 
 			self.insertTileMatrixSet()
 
+		self.upgrade()
+
+	@property
+	def pool(self):
+		'''Return the connection pool of this database, build it if not exists'''
+		key = os.path.realpath(self.dbPath)
+		with self.poolsLock:
+			pool = self.pools.get(key)
+			if pool is None:
+				pragmas = [
+					('auto_vacuum', 'INCREMENTAL'), #only applied to new databases, must be set before journal mode
+					('journal_mode', 'WAL'),
+					('synchronous', self.SYNCHRONOUS),
+					('cache_size', self.CACHE_SIZE),
+					('mmap_size', self.MMAP_SIZE),
+					('temp_store', 'MEMORY')
+				]
+				functions = [('tile_hash', 1, self.tileHash)]
+				pool = GpkgConnectionPool(self.dbPath, self.POOL_SIZE, pragmas, self.BUSY_TIMEOUT, functions)
+				self.pools[key] = pool
+			return pool
+
+	@staticmethod
+	def tileHash(data):
+		'''Content hash of tile data, used as key of deduplicated blobs'''
+		return hashlib.sha1(data).digest()
+
+	@classmethod
+	def closeAll(cls):
+		'''Close all pooled connections (geopackage files can then be moved or deleted)'''
+		with cls.poolsLock:
+			for pool in cls.pools.values():
+				pool.close()
+			cls.pools = {}
+
+	@contextmanager
+	def transaction(self):
+		'''
+		Context manager that yield a pooled connection inside a write transaction
+		All statements executed within the block are committed at once, or rollbacked on error
+		'''
+		with self.pool.connect() as db:
+			db.execute('BEGIN IMMEDIATE')
+			try:
+				yield db
+			except:
+				db.execute('ROLLBACK')
+				raise
+			else:
+				db.execute('COMMIT')
+
 
 	def isGPKG(self):
 		if not os.path.exists(self.dbPath):
 			return False
-		db = sqlite3.connect(self.dbPath)
+		with self.pool.connect() as db:
 
-		#check application id
-		app_id = db.execute("PRAGMA application_id").fetchone()
-		if not app_id[0] == 1196437808:
-			db.close()
-			return False
-		#quick check of table schema
-		try:
-			db.execute('SELECT table_name FROM gpkg_contents LIMIT 1')
-			db.execute('SELECT srs_name FROM gpkg_spatial_ref_sys LIMIT 1')
-			db.execute('SELECT table_name FROM gpkg_tile_matrix_set LIMIT 1')
-			db.execute('SELECT table_name FROM gpkg_tile_matrix LIMIT 1')
-			db.execute('SELECT zoom_level, tile_column, tile_row, tile_data FROM gpkg_tiles LIMIT 1')
-		except:
-			db.close()
-			return False
-		else:
-			db.close()
-			return True
+			#check application id
+			app_id = db.execute("PRAGMA application_id").fetchone()
+			if not app_id[0] == 1196437808:
+				return False
+			#quick check of table schema
+			try:
+				db.execute('SELECT table_name FROM gpkg_contents LIMIT 1')
+				db.execute('SELECT srs_name FROM gpkg_spatial_ref_sys LIMIT 1')
+				db.execute('SELECT table_name FROM gpkg_tile_matrix_set LIMIT 1')
+				db.execute('SELECT table_name FROM gpkg_tile_matrix LIMIT 1')
+				db.execute('SELECT zoom_level, tile_column, tile_row, tile_data FROM gpkg_tiles LIMIT 1')
+			except:
+				return False
+			else:
+				return True
 
 
 	def create(self):
 		"""Create default geopackage schema on the database."""
-		db = sqlite3.connect(self.dbPath) #this attempt will create a new file if not exist
-		cursor = db.cursor()
+		with self.transaction() as db: #this attempt will create a new file if not exist
+			cursor = db.cursor()
+
+			# Add GeoPackage version 1.0 ("GP10" in ASCII) to the Sqlite header
+			cursor.execute("PRAGMA application_id = 1196437808;")
+
+			cursor.execute("""
+				CREATE TABLE gpkg_contents (
+					table_name TEXT NOT NULL PRIMARY KEY,
+					data_type TEXT NOT NULL,
+					identifier TEXT UNIQUE,
+					description TEXT DEFAULT '',
+					last_change DATETIME NOT NULL DEFAULT
+					(strftime('%Y-%m-%dT%H:%M:%fZ','now')),
+					min_x DOUBLE,
+					min_y DOUBLE,
+					max_x DOUBLE,
+					max_y DOUBLE,
+					srs_id INTEGER,
+					CONSTRAINT fk_gc_r_srs_id FOREIGN KEY (srs_id)
+						REFERENCES gpkg_spatial_ref_sys(srs_id));
+			""")
+
+			cursor.execute("""
+				CREATE TABLE gpkg_spatial_ref_sys (
+					srs_name TEXT NOT NULL,
+					srs_id INTEGER NOT NULL PRIMARY KEY,
+					organization TEXT NOT NULL,
+					organization_coordsys_id INTEGER NOT NULL,
+					definition TEXT NOT NULL,
+					description TEXT);
+			""")
+
+			cursor.execute("""
+				CREATE TABLE gpkg_tile_matrix_set (
+					table_name TEXT NOT NULL PRIMARY KEY,
+					srs_id INTEGER NOT NULL,
+					min_x DOUBLE NOT NULL,
+					min_y DOUBLE NOT NULL,
+					max_x DOUBLE NOT NULL,
+					max_y DOUBLE NOT NULL,
+					CONSTRAINT fk_gtms_table_name FOREIGN KEY (table_name)
+						REFERENCES gpkg_contents(table_name),
+					CONSTRAINT fk_gtms_srs FOREIGN KEY (srs_id)
+						REFERENCES gpkg_spatial_ref_sys(srs_id));
+			""")
+
+			cursor.execute("""
+				CREATE TABLE gpkg_tile_matrix (
+					table_name TEXT NOT NULL,
+					zoom_level INTEGER NOT NULL,
+					matrix_width INTEGER NOT NULL,
+					matrix_height INTEGER NOT NULL,
+					tile_width INTEGER NOT NULL,
+					tile_height INTEGER NOT NULL,
+					pixel_x_size DOUBLE NOT NULL,
+					pixel_y_size DOUBLE NOT NULL,
+					CONSTRAINT pk_ttm PRIMARY KEY (table_name, zoom_level),
+					CONSTRAINT fk_ttm_table_name FOREIGN KEY (table_name)
+						REFERENCES gpkg_contents(table_name));
+			""")
+
+			self.createTilesTable(cursor, self.DEDUP)
+
+
+	def createTilesTable(self, cursor, dedup=False):
+		'''
+		Create gpkg_tiles table, or if dedup the deduplicated layout :
+		tiles data are stored once in gpkg_tiles_blobs, keyed by their content hash, and referenced
+		by gpkg_tiles_index rows. gpkg_tiles is then a view joining both tables, with triggers
+		that route inserts, updates and deletes, so it can still be used as a regular tiles table.
+		Note writing to a deduplicated database requires the tile_hash sql function (see pool)
+		'''
+		if not dedup:
+			cursor.execute("""
+				CREATE TABLE gpkg_tiles (
+					id INTEGER PRIMARY KEY AUTOINCREMENT,
+					zoom_level INTEGER NOT NULL,
+					tile_column INTEGER NOT NULL,
+					tile_row INTEGER NOT NULL,
+					tile_data BLOB NOT NULL,
+					last_modified TIMESTAMP DEFAULT (datetime('now','localtime')),
+					etag TEXT,
+					http_last_modified TEXT,
+					last_access TIMESTAMP,
+					UNIQUE (zoom_level, tile_column, tile_row));
+			""")
+			return
+
+		cursor.execute("""
+			CREATE TABLE gpkg_tiles_blobs (
+				id INTEGER PRIMARY KEY AUTOINCREMENT,
+				hash BLOB NOT NULL UNIQUE,
+				tile_data BLOB NOT NULL);
+		""")
 
-		# Add GeoPackage version 1.0 ("GP10" in ASCII) to the Sqlite header
-		cursor.execute("PRAGMA application_id = 1196437808;")
+		cursor.execute("""
+			CREATE TABLE gpkg_tiles_index (
+				id INTEGER PRIMARY KEY AUTOINCREMENT,
+				zoom_level INTEGER NOT NULL,
+				tile_column INTEGER NOT NULL,
+				tile_row INTEGER NOT NULL,
+				blob_id INTEGER NOT NULL REFERENCES gpkg_tiles_blobs(id),
+				last_modified TIMESTAMP DEFAULT (datetime('now','localtime')),
+				etag TEXT,
+				http_last_modified TEXT,
+				last_access TIMESTAMP,
+				UNIQUE (zoom_level, tile_column, tile_row));
+		""")
+		cursor.execute("CREATE INDEX gpkg_tiles_index_blob ON gpkg_tiles_index (blob_id);")
 
 		cursor.execute("""
-			CREATE TABLE gpkg_contents (
-				table_name TEXT NOT NULL PRIMARY KEY,
-				data_type TEXT NOT NULL,
-				identifier TEXT UNIQUE,
-				description TEXT DEFAULT '',
-				last_change DATETIME NOT NULL DEFAULT
-				(strftime('%Y-%m-%dT%H:%M:%fZ','now')),
-				min_x DOUBLE,
-				min_y DOUBLE,
-				max_x DOUBLE,
-				max_y DOUBLE,
-				srs_id INTEGER,
-				CONSTRAINT fk_gc_r_srs_id FOREIGN KEY (srs_id)
-					REFERENCES gpkg_spatial_ref_sys(srs_id));
+			CREATE VIEW gpkg_tiles AS
+				SELECT t.id AS id, t.zoom_level AS zoom_level, t.tile_column AS tile_column, t.tile_row AS tile_row,
+				b.tile_data AS tile_data, t.last_modified AS last_modified, t.etag AS etag,
+				t.http_last_modified AS http_last_modified, t.last_access AS last_access
+				FROM gpkg_tiles_index AS t JOIN gpkg_tiles_blobs AS b ON b.id = t.blob_id;
 		""")
 
+		#insert (or replace) : drop previous tile, store the blob if it's a new content, then reference it
 		cursor.execute("""
-			CREATE TABLE gpkg_spatial_ref_sys (
-				srs_name TEXT NOT NULL,
-				srs_id INTEGER NOT NULL PRIMARY KEY,
-				organization TEXT NOT NULL,
-				organization_coordsys_id INTEGER NOT NULL,
-				definition TEXT NOT NULL,
-				description TEXT);
+			CREATE TRIGGER gpkg_tiles_insert INSTEAD OF INSERT ON gpkg_tiles
+			BEGIN
+				DELETE FROM gpkg_tiles_index
+					WHERE zoom_level = NEW.zoom_level AND tile_column = NEW.tile_column AND tile_row = NEW.tile_row;
+				INSERT INTO gpkg_tiles_blobs (hash, tile_data)
+					SELECT tile_hash(NEW.tile_data), NEW.tile_data
+					WHERE NOT EXISTS (SELECT 1 FROM gpkg_tiles_blobs WHERE hash = tile_hash(NEW.tile_data));
+				INSERT INTO gpkg_tiles_index (zoom_level, tile_column, tile_row, blob_id, last_modified, etag, http_last_modified, last_access)
+					VALUES (NEW.zoom_level, NEW.tile_column, NEW.tile_row,
+					(SELECT id FROM gpkg_tiles_blobs WHERE hash = tile_hash(NEW.tile_data)),
+					COALESCE(NEW.last_modified, datetime('now','localtime')), NEW.etag, NEW.http_last_modified, NEW.last_access);
+			END;
 		""")
 
+		#only tiles attributes can be updated, tiles data are replaced through insert
 		cursor.execute("""
-			CREATE TABLE gpkg_tile_matrix_set (
-				table_name TEXT NOT NULL PRIMARY KEY,
-				srs_id INTEGER NOT NULL,
-				min_x DOUBLE NOT NULL,
-				min_y DOUBLE NOT NULL,
-				max_x DOUBLE NOT NULL,
-				max_y DOUBLE NOT NULL,
-				CONSTRAINT fk_gtms_table_name FOREIGN KEY (table_name)
-					REFERENCES gpkg_contents(table_name),
-				CONSTRAINT fk_gtms_srs FOREIGN KEY (srs_id)
-					REFERENCES gpkg_spatial_ref_sys(srs_id));
+			CREATE TRIGGER gpkg_tiles_update INSTEAD OF UPDATE ON gpkg_tiles
+			BEGIN
+				UPDATE gpkg_tiles_index SET last_modified = NEW.last_modified, etag = NEW.etag,
+					http_last_modified = NEW.http_last_modified, last_access = NEW.last_access
+					WHERE id = OLD.id;
+			END;
 		""")
 
 		cursor.execute("""
-			CREATE TABLE gpkg_tile_matrix (
-				table_name TEXT NOT NULL,
-				zoom_level INTEGER NOT NULL,
-				matrix_width INTEGER NOT NULL,
-				matrix_height INTEGER NOT NULL,
-				tile_width INTEGER NOT NULL,
-				tile_height INTEGER NOT NULL,
-				pixel_x_size DOUBLE NOT NULL,
-				pixel_y_size DOUBLE NOT NULL,
-				CONSTRAINT pk_ttm PRIMARY KEY (table_name, zoom_level),
-				CONSTRAINT fk_ttm_table_name FOREIGN KEY (table_name)
-					REFERENCES gpkg_contents(table_name));
+			CREATE TRIGGER gpkg_tiles_delete INSTEAD OF DELETE ON gpkg_tiles
+			BEGIN
+				DELETE FROM gpkg_tiles_index WHERE id = OLD.id;
+			END;
 		""")
 
+		#drop blobs no longer referenced
 		cursor.execute("""
-			CREATE TABLE gpkg_tiles (
-				id INTEGER PRIMARY KEY AUTOINCREMENT,
-				zoom_level INTEGER NOT NULL,
-				tile_column INTEGER NOT NULL,
-				tile_row INTEGER NOT NULL,
-				tile_data BLOB NOT NULL,
-				last_modified TIMESTAMP DEFAULT (datetime('now','localtime')),
-				UNIQUE (zoom_level, tile_column, tile_row));
+			CREATE TRIGGER gpkg_tiles_index_delete AFTER DELETE ON gpkg_tiles_index
+			BEGIN
+				DELETE FROM gpkg_tiles_blobs WHERE id = OLD.blob_id
+					AND NOT EXISTS (SELECT 1 FROM gpkg_tiles_index WHERE blob_id = OLD.blob_id);
+			END;
 		""")
 
-		db.close()
+	@property
+	def isDedup(self):
+		'''Flag if the database use the deduplicated layout'''
+		with self.pool.connect() as db:
+			row = db.execute("SELECT type FROM sqlite_master WHERE name = 'gpkg_tiles'").fetchone()
+		return row is not None and row[0] == 'view'
+
+	def dedup(self):
+		'''Convert an existing database to the deduplicated layout, it can take a while for big caches'''
+		if self.isDedup:
+			return
+		columns = 'zoom_level, tile_column, tile_row, tile_data, last_modified, etag, http_last_modified, last_access'
+		with self.transaction() as db:
+			db.execute('ALTER TABLE gpkg_tiles RENAME TO gpkg_tiles_old')
+			self.createTilesTable(db.cursor(), dedup=True)
+			db.execute('INSERT INTO gpkg_tiles (' + columns + ') SELECT ' + columns + ' FROM gpkg_tiles_old')
+			db.execute('DROP TABLE gpkg_tiles_old')
+		self.compact()
+
+	def dedupStats(self):
+		'''Return (tiles data size, stored blobs size) in bytes, their ratio is the deduplication factor'''
+		if not self.isDedup:
+			with self.pool.connect() as db:
+				size = db.execute('SELECT SUM(length(tile_data)) FROM gpkg_tiles').fetchone()[0] or 0
+			return size, size
+		query = """SELECT SUM(length(b.tile_data) * r.n), SUM(length(b.tile_data))
+			FROM (SELECT blob_id, COUNT(*) AS n FROM gpkg_tiles_index GROUP BY blob_id) AS r
+			JOIN gpkg_tiles_blobs AS b ON b.id = r.blob_id"""
+		with self.pool.connect() as db:
+			size, stored = db.execute(query).fetchone()
+		return size or 0, stored or 0
+
+
+	def upgrade(self):
+		'''Add missing TILES_COLUMNS and tables to a database created by a previous version'''
+		def missing(db):
+			columns = [row[1] for row in db.execute('PRAGMA table_info(gpkg_tiles)')]
+			return [(name, decl) for name, decl in self.TILES_COLUMNS if name not in columns]
+		with self.pool.connect() as db:
+			#tiles the map service doesn't have (negative cache)
+			db.execute("""CREATE TABLE IF NOT EXISTS gpkg_tiles_missing (
+						zoom_level INTEGER NOT NULL,
+						tile_column INTEGER NOT NULL,
+						tile_row INTEGER NOT NULL,
+						last_modified TIMESTAMP DEFAULT (datetime('now','localtime')),
+						PRIMARY KEY (zoom_level, tile_column, tile_row)) WITHOUT ROWID""")
+			if not missing(db):
+				return
+		with self.transaction() as db:
+			#check again now the database is locked, another process may have upgraded it
+			for name, decl in missing(db):
+				db.execute('ALTER TABLE gpkg_tiles ADD COLUMN ' + name + ' ' + decl)
 
 
 	def insertMetadata(self):
-		db = sqlite3.connect(self.dbPath)
 		query = """INSERT INTO gpkg_contents (
 					table_name, data_type,
 					identifier, description,
 					min_x, min_y, max_x, max_y,
 					srs_id)
 				VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);"""
-		db.execute(query, ("gpkg_tiles", "tiles", self.name, "Created with BlenderGIS", self.xmin, self.ymin, self.xmax, self.ymax, self.code))
-		db.commit()
-		db.close()
+		with self.transaction() as db:
+			db.execute(query, ("gpkg_tiles", "tiles", self.name, "Created with BlenderGIS", self.xmin, self.ymin, self.xmax, self.ymax, self.code))
 
 
 	def insertCRS(self, code, name, auth='EPSG', wkt=''):
-		db = sqlite3.connect(self.dbPath)
-		db.execute(""" INSERT INTO gpkg_spatial_ref_sys (
-					srs_id,
-					organization,
-					organization_coordsys_id,
-					srs_name,
-					definition)
-				VALUES (?, ?, ?, ?, ?)
-			""", (code, auth, code, name, wkt))
-		db.commit()
-		db.close()
+		with self.transaction() as db:
+			db.execute(""" INSERT INTO gpkg_spatial_ref_sys (
+						srs_id,
+						organization,
+						organization_coordsys_id,
+						srs_name,
+						definition)
+					VALUES (?, ?, ?, ?, ?)
+				""", (code, auth, code, name, wkt))
 
 
 	def insertTileMatrixSet(self):
-		db = sqlite3.connect(self.dbPath)
-
-		#Tile matrix set
-		query = """INSERT OR REPLACE INTO gpkg_tile_matrix_set (
-					table_name, srs_id,
-					min_x, min_y, max_x, max_y)
-				VALUES (?, ?, ?, ?, ?, ?);"""
-		db.execute(query, ('gpkg_tiles', self.code, self.xmin, self.ymin, self.xmax, self.ymax))
-
+		with self.transaction() as db:
 
-		#Tile matrix of each levels
-		for level, res in enumerate(self.resolutions):
+			#Tile matrix set
+			query = """INSERT OR REPLACE INTO gpkg_tile_matrix_set (
+						table_name, srs_id,
+						min_x, min_y, max_x, max_y)
+					VALUES (?, ?, ?, ?, ?, ?);"""
+			db.execute(query, ('gpkg_tiles', self.code, self.xmin, self.ymin, self.xmax, self.ymax))
 
-			w = math.ceil( (self.xmax - self.xmin) / (self.tileSize * res) )
-			h = math.ceil( (self.ymax - self.ymin) / (self.tileSize * res) )
 
-			query = """INSERT OR REPLACE INTO gpkg_tile_matrix (
-						table_name, zoom_level,
-						matrix_width, matrix_height,
-						tile_width, tile_height,
-						pixel_x_size, pixel_y_size)
-					VALUES (?, ?, ?, ?, ?, ?, ?, ?);"""
-			db.execute(query, ('gpkg_tiles', level, w, h, self.tileSize, self.tileSize, res, res))
+			#Tile matrix of each levels
+			for level, res in enumerate(self.resolutions):
 
+				w = math.ceil( (self.xmax - self.xmin) / (self.tileSize * res) )
+				h = math.ceil( (self.ymax - self.ymin) / (self.tileSize * res) )
 
-		db.commit()
-		db.close()
+				query = """INSERT OR REPLACE INTO gpkg_tile_matrix (
+							table_name, zoom_level,
+							matrix_width, matrix_height,
+							tile_width, tile_height,
+							pixel_x_size, pixel_y_size)
+						VALUES (?, ?, ?, ?, ?, ?, ?, ?);"""
+				db.execute(query, ('gpkg_tiles', level, w, h, self.tileSize, self.tileSize, res, res))
 
 
-	def getTile(self, x, y, z):
-		#connect with detect_types parameter for automatically convert date to Python object
-		db = sqlite3.connect(self.dbPath, detect_types=sqlite3.PARSE_DECLTYPES)
-		query = 'SELECT tile_data, last_modified FROM gpkg_tiles WHERE zoom_level=? AND tile_column=? AND tile_row=?'
-		result = db.execute(query, (z, x, y)).fetchone()
-		db.close()
+	def getTile(self, x, y, z, stale=None):
+		'''
+		Return tile data, stale tiles are also returned (see isStale)
+		If a stale list is given, (x,y,z,etag,lastModified) is appended to it if the tile is stale
+		'''
+		query = 'SELECT tile_data, last_modified, etag, http_last_modified FROM gpkg_tiles WHERE zoom_level=? AND tile_column=? AND tile_row=?'
+		with self.pool.connect() as db:
+			result = db.execute(query, (z, x, y)).fetchone()
 		if result is None:
 			return None
-		timeDelta = datetime.datetime.now() - result[1]
-		if timeDelta.days > self.MAX_DAYS:
-			return None
-		return result[0]
+		data, date, etag, lastModified = result
+		if stale is not None and self.isStale(date):
+			stale.append( (x, y, z, etag, lastModified) )
+		return data
 
-	def putTile(self, x, y, z, data):
-		db = sqlite3.connect(self.dbPath)
-		query = """INSERT OR REPLACE INTO gpkg_tiles
-		(tile_column, tile_row, zoom_level, tile_data) VALUES (?,?,?,?)"""
-		db.execute(query, (x, y, z, data))
-		db.commit()
-		db.close()
+	def putTile(self, x, y, z, data, etag=None, lastModified=None):
+		self.putTiles([(x, y, z, data, etag, lastModified)])
+
+	@property
+	def staleDate(self):
+		'''Tiles modified before this date are stale'''
+		date = datetime.datetime.now() - datetime.timedelta(days=self.MAX_DAYS)
+		return date.strftime('%Y-%m-%d %H:%M:%S') #same format as sqlite datetime function
+
+	def isStale(self, date, staleDate=None):
+		'''Check if a tile last modified at this date (as stored in last_modified column) is older than MAX_DAYS'''
+		if staleDate is None:
+			staleDate = self.staleDate
+		#the column is read as a datetime or a string depending on its declared type, both give the sqlite datetime format
+		return date is not None and str(date) < staleDate
+
+	def touchTiles(self, tiles):
+		"""tiles = list of (x,y,z) tuple
+		mark tiles as fresh without rewriting their data (tiles confirmed unchanged by the map service)"""
+		query = """UPDATE gpkg_tiles SET last_modified = datetime('now','localtime')
+		WHERE zoom_level=? AND tile_column=? AND tile_row=?"""
+		with self.transaction() as db:
+			db.executemany(query, [(z, x, y) for x, y, z in tiles])
 
 
-	def getTiles(self, tiles):
+	def markAccessed(self, tiles):
 		"""tiles = list of (x,y,z) tuple
-		return list of (x,y,z,data) tuple"""
-		n = len(tiles)
-		xs, ys, zs = zip(*tiles)
-		lst = list(xs) + list(ys) + list(zs)
+		record a read of these tiles, last_access column is written later in background by flushAccessed"""
+		key = os.path.realpath(self.dbPath)
+		with self.accessedLock:
+			gpkg, keys = self.accessed.setdefault(key, (self, set()))
+			keys.update(tiles)
+
+	@classmethod
+	def flushAccessed(cls):
+		'''Write last_access of recorded tiles in their databases'''
+		with cls.accessedLock:
+			accessed, cls.accessed = cls.accessed, {}
+		#the date is enough to sort tiles, so a tile is rewritten at most once a day
+		query = """UPDATE gpkg_tiles SET last_access = datetime('now','localtime')
+		WHERE zoom_level=? AND tile_column=? AND tile_row=?
+		AND (last_access IS NULL OR last_access < date('now','localtime'))"""
+		for gpkg, keys in accessed.values():
+			with gpkg.transaction() as db:
+				db.executemany(query, [(z, x, y) for x, y, z in keys])
 
-		db = sqlite3.connect(self.dbPath, detect_types=sqlite3.PARSE_DECLTYPES)
-		query = "SELECT tile_column, tile_row, zoom_level, tile_data FROM gpkg_tiles WHERE tile_column IN (" + ','.join('?'*n) + ") AND tile_row IN (" + ','.join('?'*n) + ") AND zoom_level IN (" + ','.join('?'*n) + ")"
+	@property
+	def size(self):
+		'''Size of the database pages in use, that's the file size once compacted and checkpointed'''
+		with self.pool.connect() as db:
+			pageCount = db.execute('PRAGMA page_count').fetchone()[0]
+			freeCount = db.execute('PRAGMA freelist_count').fetchone()[0]
+			pageSize = db.execute('PRAGMA page_size').fetchone()[0]
+		return (pageCount - freeCount) * pageSize
+
+	def iterLRU(self):
+		'''
+		Generator that yield (date, zoom, id, bytes) of the stored tiles from the least to the most recently used,
+		bytes is an estimation of the database size released by deleting this tile once the previous ones are deleted
+		Among tiles last read the same day, highest zoom levels come first (smallest area to download again)
+		On a deduplicated database the data of a blob is only counted with the last tile referencing it, since that's when it's released.
+		Each tile also counts ROW_SIZE bytes for its row, so that deleting tiles whose blob is still shared is not seen as free
+		and a database mostly made of shared blobs is not entirely evicted
+		'''
+		order = " ORDER BY date(COALESCE(t.last_access, t.last_modified)), t.zoom_level DESC"
+		columns = "SELECT date(COALESCE(t.last_access, t.last_modified)), t.zoom_level, t.id, "
+		dedup = self.isDedup
+		with self.pool.connect() as db:
+			if dedup:
+				refs = dict(db.execute('SELECT blob_id, COUNT(*) FROM gpkg_tiles_index GROUP BY blob_id').fetchall())
+				query = columns + """t.blob_id, length(b.tile_data) FROM gpkg_tiles_index AS t
+				JOIN gpkg_tiles_blobs AS b ON b.id = t.blob_id""" + order
+			else:
+				query = columns + "NULL, length(t.tile_data) FROM gpkg_tiles AS t" + order
+			cursor = db.execute(query)
+			try:
+				for date, zoom, tileId, blobId, length in cursor:
+					if blobId is not None:
+						refs[blobId] -= 1
+						if refs[blobId] > 0:
+							length = 0
+					yield date, zoom, tileId, length + self.ROW_SIZE
+			finally:
+				cursor.close()
+
+	def deleteTiles(self, ids):
+		'''Delete tiles by id (see iterLRU), then compact the database'''
+		if not ids:
+			return
+		with self.transaction() as db:
+			db.executemany('DELETE FROM gpkg_tiles WHERE id=?', [(tileId,) for tileId in ids])
+		self.compact()
+
+	def evict(self, nbBytes):
+		'''
+		Delete least recently used tiles until nbBytes are released (see iterLRU), then compact the database
+		Return the number of deleted tiles
+		'''
+		ids, size = [], 0
+		tiles = self.iterLRU()
+		for date, zoom, tileId, length in tiles:
+			if size >= nbBytes:
+				break
+			ids.append(tileId)
+			size += length
+		tiles.close()
+		self.deleteTiles(ids)
+		return len(ids)
+
+	def compact(self, pages=None):
+		'''
+		Release at most pages (default COMPACT_PAGES) free pages to the file system
+		Databases created by a previous version have no incremental vacuum, their free pages are only reused
+		by new tiles until they're rebuilt by vacuum()
+		'''
+		if pages is None:
+			pages = self.COMPACT_PAGES
+		with self.pool.connect() as db:
+			if db.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+				#executescript step the pragma until done, execute would only release one page
+				db.executescript('PRAGMA incremental_vacuum({});'.format(int(pages)))
+			db.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchall()
+
+	def vacuum(self):
+		'''
+		Rebuild the database to release all its free pages, and enable incremental vacuum if it was created by a previous version
+		This is slow on big caches, the database is locked meanwhile and up to twice its size of free disk space is needed
+		'''
+		with self.pool.connect() as db:
+			db.execute('PRAGMA auto_vacuum = INCREMENTAL')
+			db.execute('VACUUM')
+			db.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchall()
 
-		result = db.execute(query, lst).fetchall()
-		db.close()
 
+	def putMissingTiles(self, tiles):
+		"""tiles = list of (x,y,z) tuple
+		record tiles the map service doesn't have"""
+		query = 'INSERT OR REPLACE INTO gpkg_tiles_missing (tile_column, tile_row, zoom_level) VALUES (?,?,?)'
+		with self.transaction() as db:
+			db.executemany(query, tiles)
+
+	def listMissingTiles(self, days):
+		"""return list of (x,y,z,date) tuple of the tiles recorded as missing in the last days
+		older records are deleted"""
+		date = datetime.datetime.now() - datetime.timedelta(days=days)
+		date = date.strftime('%Y-%m-%d %H:%M:%S')
+		with self.transaction() as db:
+			db.execute('DELETE FROM gpkg_tiles_missing WHERE last_modified < ?', (date,))
+			return db.execute('SELECT tile_column, tile_row, zoom_level, last_modified FROM gpkg_tiles_missing').fetchall()
+
+
+	def iterTiles(self, tiles, chunkSize=256, fields=('tile_data',), where=None, params=()):
+		"""tiles = list of (x,y,z) tuple
+		generator that yield lists of at most chunkSize (x,y,z,data) tuples
+		or (x,y,z,*fields) tuples for others gpkg_tiles fields, optionally filtered by a where clause on 't' table
+		Requested keys are loaded in a temporary table and joined on the unique (z,x,y) index,
+		so only exact matches are read and the number of requested tiles is not bounded by sqlite variables limit"""
+		with self.pool.connect() as db:
+			db.execute("""CREATE TEMP TABLE IF NOT EXISTS tiles_request (
+						zoom_level INTEGER NOT NULL,
+						tile_column INTEGER NOT NULL,
+						tile_row INTEGER NOT NULL,
+						PRIMARY KEY (zoom_level, tile_column, tile_row)) WITHOUT ROWID""")
+			db.execute('BEGIN')
+			db.execute('DELETE FROM tiles_request')
+			db.executemany('INSERT OR IGNORE INTO tiles_request VALUES (?,?,?)', [(z, x, y) for x, y, z in tiles])
+			db.execute('COMMIT')
+			#CROSS JOIN force sqlite to loop over requested keys and seek gpkg_tiles unique index
+			columns = ['t.tile_column', 't.tile_row', 't.zoom_level'] + ['t.' + f for f in fields]
+			query = "SELECT " + ', '.join(columns) + """
+					FROM tiles_request AS r CROSS JOIN gpkg_tiles AS t
+					ON t.zoom_level = r.zoom_level AND t.tile_column = r.tile_column AND t.tile_row = r.tile_row"""
+			if where is not None:
+				query += ' WHERE ' + where
+			cursor = db.execute(query, params)
+			try:
+				while True:
+					rows = cursor.fetchmany(chunkSize)
+					if not rows:
+						break
+					yield rows
+			finally:
+				cursor.close()
+				db.execute('DELETE FROM tiles_request')
+
+	def getTiles(self, tiles, stale=None):
+		"""tiles = list of (x,y,z) tuple
+		return list of (x,y,z,data) tuple
+		if a stale list is given, (x,y,z,etag,lastModified) tuples of the stale tiles are appended to it (see isStale)"""
+		if stale is None:
+			result = []
+			for rows in self.iterTiles(tiles):
+				result.extend(rows)
+			return result
+		result = []
+		staleDate = self.staleDate
+		for rows in self.iterTiles(tiles, fields=('tile_data', 'last_modified', 'etag', 'http_last_modified')):
+			for x, y, z, data, date, etag, lastModified in rows:
+				result.append( (x, y, z, data) )
+				if self.isStale(date, staleDate):
+					stale.append( (x, y, z, etag, lastModified) )
+		return result
+
+	def listTiles(self, tiles):
+		"""tiles = list of (x,y,z) tuple
+		return the set of (x,y,z) tuple already stored, tiles data are not read"""
+		result = set()
+		for rows in self.iterTiles(tiles, fields=()):
+			result.update(rows)
 		return result
 
 
 	def putTiles(self, tiles):
-		"""tiles = list of (x,y,z,data) tuple"""
-		db = sqlite3.connect(self.dbPath)
+		"""tiles = list of (x,y,z,data) or (x,y,z,data,etag,lastModified) tuple
+		all tiles are written in a single transaction"""
 		query = """INSERT OR REPLACE INTO gpkg_tiles
-		(tile_column, tile_row, zoom_level, tile_data) VALUES (?,?,?,?)"""
-		db.executemany(query, tiles)
-		db.commit()
-		db.close()
+		(tile_column, tile_row, zoom_level, tile_data, etag, http_last_modified) VALUES (?,?,?,?,?,?)"""
+		tiles = [tuple(t) + (None, None) if len(t) == 4 else t for t in tiles]
+		if self.isDedup:
+			self.putDedupTiles(tiles)
+			return
+		with self.transaction() as db:
+			db.executemany(query, tiles)
+
+	def putDedupTiles(self, tiles):
+		"""
+		Write (x,y,z,data,etag,lastModified) tiles in a deduplicated database, bypassing the gpkg_tiles view triggers
+		so that the content hash of each tile is computed once. A tile whose content has not changed only has
+		its attributes updated, neither its blob nor its index row are rewritten.
+		"""
+		with self.transaction() as db:
+			for x, y, z, data, etag, lastModified in tiles:
+				h = self.tileHash(data)
+				row = db.execute('''SELECT t.id, b.hash FROM gpkg_tiles_index AS t JOIN gpkg_tiles_blobs AS b ON b.id = t.blob_id
+					WHERE t.zoom_level=? AND t.tile_column=? AND t.tile_row=?''', (z, x, y)).fetchone()
+				if row is not None and row[1] == h:
+					db.execute('''UPDATE gpkg_tiles_index SET last_modified = datetime('now','localtime'),
+						etag = ?, http_last_modified = ? WHERE id = ?''', (etag, lastModified, row[0]))
+					continue
+				if row is not None:
+					#the blob is dropped by gpkg_tiles_index_delete trigger if no more referenced
+					db.execute('DELETE FROM gpkg_tiles_index WHERE id = ?', (row[0],))
+				db.execute('INSERT OR IGNORE INTO gpkg_tiles_blobs (hash, tile_data) VALUES (?,?)', (h, data))
+				db.execute('''INSERT INTO gpkg_tiles_index (zoom_level, tile_column, tile_row, blob_id, etag, http_last_modified)
+					VALUES (?,?,?,(SELECT id FROM gpkg_tiles_blobs WHERE hash = ?),?,?)''', (z, x, y, h, etag, lastModified))
 
 
 
@@ -396,6 +900,11 @@ class TileMatrix():
 	def globalbbox(self):
 		return self.xmin, self.ymin, self.xmax, self.ymax
 
+	@property
+	def isQuadTree(self):
+		'''Flag if each tile is split in 4 tiles at next zoom level'''
+		return not hasattr(self, 'resolutions') and self.resFactor == 2
+
 
 	def geoToProj(self, long, lat):
 		"""convert longitude latitude un decimal degrees to grid crs"""
@@ -519,6 +1028,30 @@ class TileMatrix():
 		ymin = ymax - (self.tileSize * self.getRes(zoom))
 		return xmin, ymin, xmax, ymax
 
+	def getTilesRange(self, bbox, zoom, margin=0):
+		"""
+		Return the (cols, rows) ranges of tiles covering a bbox in grid crs
+		margin >> number of extra tiles added around the bbox
+		Tiles out of the matrix bounds are ignored
+		"""
+		xmin, ymin, xmax, ymax = bbox
+		col1, row1 = self.getTileNumber(xmin, ymax, zoom)
+		col2, row2 = self.getTileNumber(xmax, ymin, zoom)
+		colMin, colMax = min(col1, col2) - margin, max(col1, col2) + margin
+		rowMin, rowMax = min(row1, row2) - margin, max(row1, row2) + margin
+		#matrix size at this zoom level
+		geoTileSize = self.tileSize * self.getRes(zoom)
+		w = math.ceil( (self.xmax - self.xmin) / geoTileSize )
+		h = math.ceil( (self.ymax - self.ymin) / geoTileSize )
+		cols = range(max(colMin, 0), min(colMax, w-1) + 1)
+		rows = range(max(rowMin, 0), min(rowMax, h-1) + 1)
+		return cols, rows
+
+	def getTilesList(self, bbox, zoom, margin=0):
+		"""Return the list of (col, row, zoom) tiles covering a bbox in grid crs (see getTilesRange)"""
+		cols, rows = self.getTilesRange(bbox, zoom, margin)
+		return [(c, r, zoom) for c in cols for r in rows]
+
 
 
 
@@ -613,6 +1146,1098 @@ class GeoImage():
 		return (math.floor(xPx), math.floor(yPx))
 
 
+###################
+
+class HTTPConnectionPool():
+	'''
+	Pool of persistent http.client connections grouped by host, shared by all download workers
+	Connections are kept alive between requests so that each tile does not pay again the TCP and TLS setup
+		poolSize >> max number of idle connections kept open per host
+		maxPerHost >> max number of concurrent requests per host
+		timeout >> socket timeout in seconds
+	'''
+
+	MAX_REDIRECTS = 3
+
+	def __init__(self, poolSize=10, maxPerHost=10, timeout=3):
+		self.timeout = timeout
+		self.idle = {} #host key >> list of idle connections
+		self.lock = threading.Lock()
+		self.configure(poolSize, maxPerHost)
+		#stats
+		self.nbRequests = 0
+		self.nbConnections = 0
+
+	def configure(self, poolSize, maxPerHost):
+		with self.lock:
+			self.poolSize = poolSize
+			self.maxPerHost = maxPerHost
+			#requests in progress keep their semaphore, the new cap apply to the next ones
+			self.semaphores = {}
+
+	def getSemaphore(self, hostKey):
+		with self.lock:
+			sem = self.semaphores.get(hostKey)
+			if sem is None:
+				sem = threading.BoundedSemaphore(self.maxPerHost)
+				self.semaphores[hostKey] = sem
+			return sem
+
+	def acquire(self, hostKey):
+		'''Return a (connection, reused) tuple for this host'''
+		with self.lock:
+			conns = self.idle.get(hostKey)
+			if conns:
+				return conns.pop(), True
+			self.nbConnections += 1
+		scheme, host = hostKey
+		if scheme == 'https':
+			conn = http.client.HTTPSConnection(host, timeout=self.timeout)
+		else:
+			conn = http.client.HTTPConnection(host, timeout=self.timeout)
+		return conn, False
+
+	def release(self, hostKey, conn):
+		with self.lock:
+			conns = self.idle.setdefault(hostKey, [])
+			if len(conns) < self.poolSize:
+				conns.append(conn)
+				return
+		conn.close()
+
+	def close(self):
+		with self.lock:
+			for conns in self.idle.values():
+				for conn in conns:
+					conn.close()
+			self.idle = {}
+
+	def isProxied(self, scheme, host):
+		proxies = urllib.request.getproxies()
+		return scheme in proxies and not urllib.request.proxy_bypass(host)
+
+	def request(self, url, headers={}, redirects=0):
+		'''
+		Perform a GET request and return a (status, headers, body) tuple
+		Raise an exception if the server cannot be reached
+		'''
+		with self.lock:
+			self.nbRequests += 1
+		scheme, host, path, query, fragment = urllib.parse.urlsplit(url)
+		if query:
+			path += '?' + query
+
+		hostKey = (scheme, host)
+		if self.isProxied(scheme, host):
+			#http.client does not handle proxies, let urllib do the job, with the same per host cap
+			req = urllib.request.Request(url, None, headers)
+			with self.getSemaphore(hostKey):
+				try:
+					handle = urllib.request.urlopen(req, timeout=self.timeout)
+				except urllib.error.HTTPError as e:
+					return e.code, e.headers, e.read()
+				with handle:
+					return handle.status, handle.headers, self.decode(handle.headers, handle.read())
+
+		with self.getSemaphore(hostKey):
+			for attempt in range(2):
+				conn, reused = self.acquire(hostKey)
+				try:
+					conn.request('GET', path or '/', headers=headers)
+					resp = conn.getresponse()
+					body = resp.read()
+				except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+					conn.close()
+					#the server may have silently closed an idle keep-alive connection, retry once with a new one
+					if reused and attempt == 0:
+						continue
+					raise
+				except:
+					conn.close()
+					raise
+				if resp.will_close:
+					conn.close()
+				else:
+					self.release(hostKey, conn)
+				break
+
+		if resp.status in (301, 302, 303, 307, 308) and redirects < self.MAX_REDIRECTS:
+			location = resp.getheader('Location')
+			if location is not None:
+				return self.request(urllib.parse.urljoin(url, location), headers, redirects+1)
+
+		return resp.status, resp.headers, self.decode(resp.headers, body)
+
+	def decode(self, headers, body):
+		'''Uncompress the body according to Content-Encoding header'''
+		encoding = headers.get('Content-Encoding', '').lower()
+		if encoding == 'gzip':
+			return gzip.decompress(body)
+		elif encoding == 'deflate':
+			try:
+				return zlib.decompress(body)
+			except zlib.error: #raw deflate stream without zlib header
+				return zlib.decompress(body, -zlib.MAX_WBITS)
+		return body
+
+
+###################
+
+class AsyncTileFetcher():
+	'''
+	Tiles fetch engine based on an asyncio event loop running in a background thread
+	This is an alternative to the threads started by MapService.getTiles : thousands of requests
+	can be in flight with a bounded concurrency, each request has its own timeout and a fetch job
+	is cancelled as soon as the map service stop running
+		maxConcurrency >> max number of requests processed at the same time
+		maxPerHost >> max number of simultaneous http connections to the same host
+		timeout >> timeout in seconds of each request (waiting for a free slot is not included)
+	'''
+
+	def __init__(self, maxConcurrency=64, maxPerHost=10, timeout=10):
+		self.maxConcurrency = maxConcurrency
+		self.maxPerHost = maxPerHost
+		self.timeout = timeout
+		self.loop = None
+		self.lock = threading.Lock()
+
+	def start(self):
+		'''Start the event loop thread if it's not already running'''
+		with self.lock:
+			if self.loop is None:
+				self.loop = asyncio.new_event_loop()
+				#asyncio primitives are lazily built inside the loop
+				self.semaphore = None
+				self.semaphores = {}
+				self.idle = {} #host key >> list of idle (reader, writer) connections
+				self.inflight = {} #tile key >> (download task, waiting jobs)
+				t = threading.Thread(target=self.loop.run_forever)
+				t.setDaemon(True)
+				t.start()
+
+	def stop(self):
+		with self.lock:
+			if self.loop is not None:
+				self.loop.call_soon_threadsafe(self.loop.stop)
+				self.loop = None
+
+	def configure(self, maxConcurrency, maxPerHost):
+		self.maxConcurrency = maxConcurrency
+		self.maxPerHost = maxPerHost
+		if self.loop is not None:
+			#requests in progress keep their semaphore, the new limits apply to the next ones
+			self.loop.call_soon_threadsafe(self.resetSemaphores)
+
+	def resetSemaphores(self):
+		self.semaphore = None
+		self.semaphores = {}
+
+	def getSemaphore(self, hostKey=None):
+		if hostKey is None:
+			if self.semaphore is None:
+				self.semaphore = asyncio.Semaphore(self.maxConcurrency)
+			return self.semaphore
+		sem = self.semaphores.get(hostKey)
+		if sem is None:
+			sem = asyncio.Semaphore(self.maxPerHost)
+			self.semaphores[hostKey] = sem
+		return sem
+
+
+	def fetch(self, srv, laykey, tiles, cpt=True, cancel=None, callback=None):
+		'''
+		Fetch source tiles through the event loop and wait for the result, without using the cache
+		(reprojected tiles are built by MapService.buildDstTiles, which fetch their source tiles with this engine)
+		input: [(x,y,z)] >> output: [(x,y,z,data)] (same contract as MapService.getTiles workers)
+		If the map service stop running or start a new generation (or the optional cancel event is set) the job is cancelled
+		and tiles already fetched are returned
+		The optional callback receive each tile as soon as it's fetched, it runs in the calling thread
+		'''
+		self.start()
+		generation = srv.generation
+		tilesData = []
+		results = queue.Queue()
+		job = asyncio.run_coroutine_threadsafe(self.fetchAll(srv, laykey, tiles, results, cpt, generation, cancel), self.loop)
+
+		def receive(tile):
+			tilesData.append(tile)
+			if callback is not None:
+				callback(*tile)
+
+		while True:
+			if not srv.isAlive(generation, cancel):
+				job.cancel()
+				break
+			try:
+				receive(results.get(timeout=0.1))
+			except queue.Empty:
+				if job.done():
+					#tiles may have been queued between the timeout and this check
+					while True:
+						try:
+							receive(results.get_nowait())
+						except queue.Empty:
+							break
+					break
+		#propagate errors raised inside the loop
+		if job.done() and not job.cancelled():
+			job.result()
+		return tilesData
+
+	async def fetchAll(self, srv, laykey, tiles, results, cpt, generation=None, cancel=None):
+
+		async def fetchOne(col, row, zoom):
+			data = await self.fetchTile(srv, laykey, col, row, zoom, generation, cancel)
+			results.put( (col, row, zoom, data) )
+			if cpt:
+				srv.cptTiles += 1
+
+		await asyncio.gather(*[fetchOne(col, row, zoom) for col, row, zoom in tiles])
+
+	async def fetchTile(self, srv, laykey, col, row, zoom, generation=None, cancel=None):
+		'''Return bytes data of requested source tile or None if unable to get valid data'''
+		if generation is None:
+			generation = srv.generation
+		#concurrent requests of the same source tile share one download
+		key = srv.getMemKey(laykey, col, row, zoom, False)
+		flight = self.inflight.get(key)
+		srv.singleFlight.count(coalesced = flight is not None)
+		if flight is None:
+			waiters = [] #(generation, cancel) of the fetch jobs waiting for this download
+			alive = lambda: any(srv.isAlive(*waiter) for waiter in waiters)
+			task = self.loop.create_task(self.download(srv, laykey, col, row, zoom, alive))
+			flight = self.inflight[key] = (task, waiters)
+			task.add_done_callback(lambda t: self.inflight.pop(key, None))
+		task, waiters = flight
+		waiter = (generation, cancel)
+		waiters.append(waiter)
+		try:
+			#shield the download, cancelling a job must not cancel a download shared with other jobs
+			return await asyncio.shield(task)
+		finally:
+			waiters.remove(waiter)
+			#nobody wait for this download anymore, release its place in the queue or its connection
+			if not waiters and not task.done():
+				task.cancel()
+
+	async def download(self, srv, laykey, col, row, zoom, alive=lambda: True):
+		'''
+		Download a source tile, alive is a function that tell if the tile is still wanted
+		it's checked before and after waiting for a free slot, so that queued requests of a cancelled job don't hold the slots
+		'''
+		#coverage and cache database calls may block, keep them out of the event loop
+		if await self.loop.run_in_executor(None, srv.isMissing, laykey, col, row, zoom):
+			return srv.getEmptyTile()
+
+		if not alive():
+			return None
+		async with self.getSemaphore():
+			if not alive():
+				return None
+
+			url = srv.buildUrl(laykey, col, row, zoom)
+			scheme, host = urllib.parse.urlsplit(url)[:2]
+			if srv.httpPool.isProxied(scheme, host):
+				#proxies are not supported by the async client, fallback to the blocking one
+				return await self.loop.run_in_executor(None, srv.downloadTile, laykey, col, row, zoom)
+
+			if not alive():
+				return None
+			async with self.getSemaphore( (scheme, host) ):
+				if not alive():
+					return None
+				#checked once a slot is acquired, so that queued requests see the failures of the previous ones
+				if not srv.canRequest(url):
+					return None
+				try:
+					try:
+						status, headers, data = await asyncio.wait_for(self.get(url, srv.headers), self.timeout)
+					except asyncio.CancelledError:
+						srv.cancelRequest(url)
+						raise
+					except Exception as e:
+						srv.reportRequest(url, e)
+						raise
+					srv.reportRequest(url)
+					if status != 200:
+						raise urllib.error.HTTPError(url, status, 'Unexpected http status', headers, None)
+					data = srv.httpPool.decode(headers, data)
+					srv.keepValidators(laykey, col, row, zoom, headers.get('ETag'), headers.get('Last-Modified'))
+				except asyncio.CancelledError:
+					raise
+				except Exception as e:
+					print("Can't download tile x"+str(col)+" y"+str(row)+" - "+str(e))
+					print(url)
+					return await self.loop.run_in_executor(None, srv.missed, laykey, col, row, zoom, getattr(e, 'code', None), None)
+
+		#Make sure the stream is correct
+		if imghdr.what(None, data) is None:
+			return await self.loop.run_in_executor(None, srv.missed, laykey, col, row, zoom, status, data)
+		return data
+
+
+	async def get(self, url, headers, redirects=0):
+		'''Perform an http GET request and return a (status, headers, body) tuple'''
+		scheme, host, path, query, fragment = urllib.parse.urlsplit(url)
+		if query:
+			path += '?' + query
+		hostKey = (scheme, host)
+
+		for attempt in range(2):
+			conns = self.idle.get(hostKey)
+			if conns:
+				reader, writer = conns.pop()
+				reused = True
+			else:
+				reader, writer = await self.connect(scheme, host)
+				reused = False
+			try:
+				status, respHeaders, body, keepAlive = await self.exchange(reader, writer, host, path or '/', headers)
+			except (ConnectionError, asyncio.IncompleteReadError):
+				writer.close()
+				#the server may have silently closed an idle keep-alive connection, retry once with a new one
+				if reused and attempt == 0:
+					continue
+				raise
+			except:
+				writer.close()
+				raise
+			conns = self.idle.setdefault(hostKey, [])
+			if keepAlive and len(conns) < self.maxPerHost:
+				conns.append( (reader, writer) )
+			else:
+				writer.close()
+			break
+
+		if status in (301, 302, 303, 307, 308) and redirects < HTTPConnectionPool.MAX_REDIRECTS:
+			location = respHeaders.get('Location')
+			if location is not None:
+				return await self.get(urllib.parse.urljoin(url, location), headers, redirects+1)
+
+		return status, respHeaders, body
+
+	async def connect(self, scheme, host):
+		hostname, _, port = host.partition(':')
+		if scheme == 'https':
+			return await asyncio.open_connection(hostname, int(port or 443), ssl=ssl.create_default_context(), server_hostname=hostname)
+		else:
+			return await asyncio.open_connection(hostname, int(port or 80))
+
+	async def exchange(self, reader, writer, host, path, headers):
+		'''Send an http/1.1 GET request on an opened connection and read the response'''
+		lines = ['GET ' + path + ' HTTP/1.1', 'Host: ' + host]
+		lines.extend( [k + ': ' + str(v) for k, v in headers.items()] )
+		writer.write( ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') )
+		await writer.drain()
+
+		#status line
+		line = await reader.readline()
+		if not line:
+			raise ConnectionResetError('Connection closed by server')
+		version, status = line.decode('latin-1').split(None, 2)[:2]
+		status = int(status)
+
+		#headers
+		lines = []
+		while True:
+			line = await reader.readline()
+			if line in (b'\r\n', b'\n', b''):
+				break
+			lines.append(line.decode('latin-1'))
+		respHeaders = email.parser.Parser(_class=http.client.HTTPMessage).parsestr(''.join(lines))
+
+		#keep-alive is the default with http/1.1
+		connection = respHeaders.get('Connection', '').lower()
+		if version == 'HTTP/1.1':
+			keepAlive = connection != 'close'
+		else:
+			keepAlive = connection == 'keep-alive'
+
+		#body (bodiless responses are checked first, whatever their headers)
+		if status in (204, 304) or 100 <= status < 200:
+			body = b''
+		elif respHeaders.get('Transfer-Encoding', '').lower() == 'chunked':
+			chunks = []
+			while True:
+				size = int((await reader.readline()).split(b';')[0], 16)
+				if size == 0:
+					#skip trailers
+					while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+						pass
+					break
+				chunks.append(await reader.readexactly(size))
+				await reader.readexactly(2) #CRLF
+			body = b''.join(chunks)
+		elif respHeaders.get('Content-Length') is not None:
+			body = await reader.readexactly(int(respHeaders.get('Content-Length')))
+		else:
+			body = await reader.read()
+			keepAlive = False
+
+		return status, respHeaders, body, keepAlive
+
+
+###################
+
+class SingleFlight():
+	'''
+	Coalesce concurrent calls sharing the same key : the first caller run the function
+	and the others wait for its result instead of doing the same work again
+	'''
+
+	def __init__(self):
+		self.flights = {} #key >> dict with an event and the result
+		self.lock = threading.Lock()
+		self.nbCalls = 0
+		self.nbCoalesced = 0
+
+	def count(self, coalesced):
+		with self.lock:
+			self.nbCalls += 1
+			if coalesced:
+				self.nbCoalesced += 1
+
+	def do(self, key, func, *args):
+		with self.lock:
+			self.nbCalls += 1
+			flight = self.flights.get(key)
+			if flight is not None:
+				self.nbCoalesced += 1
+				leader = False
+			else:
+				flight = {'done': threading.Event(), 'result': None, 'error': None}
+				self.flights[key] = flight
+				leader = True
+
+		if not leader:
+			flight['done'].wait()
+			if flight['error'] is not None:
+				raise flight['error']
+			return flight['result']
+
+		try:
+			flight['result'] = func(*args)
+		except Exception as e:
+			flight['error'] = e
+			raise
+		finally:
+			with self.lock:
+				del self.flights[key]
+			flight['done'].set()
+		return flight['result']
+
+
+###################
+
+class WorkerPool():
+	'''
+	Long lived bounded pool of threads shared by all map services for downloads, decodes and reprojections
+	Work is submitted by batches with map() and the calling thread also processes the items of its batch.
+	So a batch submitted from a worker (for example the source tiles of a reprojected metatile) can't
+	deadlock and the number of threads stays flat whatever the load.
+	Batches are scheduled by priority : a worker processing a batch yields as soon as a batch with a higher
+	priority is waiting, so that prefetch jobs never delay the tiles that are visible.
+		size >> number of worker threads, they are started at first use
+	'''
+
+	#batches priorities, lower first
+	VISIBLE = 0
+	PREFETCH = 1
+
+	def __init__(self, size=16):
+		self.size = size
+		self.jobs = queue.PriorityQueue() #(priority, seq, batch) waiting for a free worker
+		self.seq = 0
+		self.batches = set() #batches in progress
+		self.threads = []
+		self.lock = threading.Lock()
+		self.local = threading.local()
+
+	def start(self):
+		with self.lock:
+			while len(self.threads) < self.size:
+				t = threading.Thread(target=self.work)
+				t.setDaemon(True)
+				t.start()
+				self.threads.append(t)
+
+	def stop(self):
+		'''Stop worker threads once they have finished their current job, and release their reprojection datasets'''
+		with self.lock:
+			for t in self.threads:
+				self.seq += 1
+				self.jobs.put( (float('inf'), self.seq, None) )
+			self.threads = []
+		ReprojContext.releaseDatasets()
+
+	def put(self, batch):
+		with self.lock:
+			self.seq += 1
+			self.jobs.put( (batch.priority, self.seq, batch) )
+
+	@property
+	def inWorker(self):
+		'''Flag if the calling thread is a worker of this pool'''
+		return getattr(self.local, 'worker', False)
+
+	def isPreempted(self, priority):
+		'''Check if a batch with a higher priority is waiting for a worker'''
+		with self.jobs.mutex:
+			return len(self.jobs.queue) > 0 and self.jobs.queue[0][0] < priority
+
+	def work(self):
+		self.local.worker = True
+		while True:
+			priority, seq, batch = self.jobs.get()
+			if batch is None:
+				ReprojContext.releaseDatasets(threading.get_ident())
+				return
+			batch.process(worker=True)
+
+	def map(self, func, items, nbThread=None, alive=None, priority=None, key=None):
+		'''
+		Call func(*item) for each item of the list and wait until all are done
+		At most nbThread items are processed at the same time (pool size if None)
+		The optional alive function is checked before each item, when it return False
+		the remaining items are dropped (drained) and map() returns as soon as running items are done
+		Items are processed by ascending value of the optional key function, see reprioritize()
+		A batch submitted without priority inherits the priority of the batch that submit it (VISIBLE by default)
+		'''
+		if priority is None:
+			priority = getattr(self.local, 'priority', None)
+		if priority is None:
+			priority = self.VISIBLE
+		batch = WorkerBatch(self, func, items, alive, priority, key)
+		nbThread = min(nbThread or self.size, self.size + 1, len(items))
+		with self.lock:
+			self.batches.add(batch)
+		try:
+			if nbThread > 1:
+				self.start()
+				#the calling thread is one of the nbThread
+				for i in range(nbThread - 1):
+					self.put(batch)
+			batch.process()
+			batch.wait()
+		finally:
+			with self.lock:
+				self.batches.discard(batch)
+		return batch.nbDone
+
+	def reprioritize(self):
+		'''Sort again the remaining items of the batches in progress, for example when the view center has moved'''
+		with self.lock:
+			batches = list(self.batches)
+		for batch in batches:
+			batch.reprioritize()
+
+
+class WorkerBatch():
+	'''A list of items processed by any number of threads, see WorkerPool.map()'''
+
+	def __init__(self, pool, func, items, alive=None, priority=0, key=None):
+		self.pool = pool
+		self.func = func
+		self.items = list(items)
+		self.alive = alive
+		self.priority = priority
+		self.key = key
+		if key is not None:
+			self.items.sort(key=key)
+		self.next = 0 #index of the next item to process
+		self.running = 0
+		self.nbDone = 0
+		self.lock = threading.Lock()
+		self.done = threading.Event()
+		if not self.items:
+			self.done.set()
+
+	def process(self, worker=False):
+		'''Process items until the batch is exhausted, no more alive, or preempted (workers only)'''
+		local = self.pool.local
+		previous = getattr(local, 'priority', None)
+		local.priority = self.priority
+		try:
+			while True:
+				if worker and self.pool.isPreempted(self.priority):
+					with self.lock:
+						if self.next < len(self.items):
+							#give back the worker, the batch will be resumed later
+							self.pool.put(self)
+							return
+				with self.lock:
+					if self.next < len(self.items) and self.alive is not None and not self.alive():
+						#drain
+						self.next = len(self.items)
+					if self.next == len(self.items):
+						if self.running == 0:
+							self.done.set()
+						return
+					item = self.items[self.next]
+					self.next += 1
+					self.running += 1
+				try:
+					self.func(*item)
+				except Exception as e:
+					print('Worker job failed - ' + str(e))
+				with self.lock:
+					self.running -= 1
+					self.nbDone += 1
+		finally:
+			local.priority = previous
+
+	def reprioritize(self):
+		if self.key is None:
+			return
+		with self.lock:
+			self.items[self.next:] = sorted(self.items[self.next:], key=self.key)
+
+	def wait(self):
+		self.done.wait()
+
+
+###################
+
+class RateLimiter():
+	'''
+	Thread safe token bucket limiting the rate of requests
+	rate >> max number of requests per second (0 = unlimited)
+	burst >> number of requests allowed at once after an idle time
+	'''
+
+	def __init__(self, rate=0, burst=1):
+		self.rate = rate
+		self.burst = max(burst, 1)
+		self.tokens = self.burst
+		self.last = time.monotonic()
+		self.lock = threading.Lock()
+
+	def wait(self):
+		'''Block until a request is allowed'''
+		if self.rate <= 0:
+			return
+		with self.lock:
+			now = time.monotonic()
+			self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+			self.last = now
+			#reserve a token, a negative balance is the delay before it will be available
+			self.tokens -= 1
+			delay = -self.tokens / self.rate
+		if delay > 0:
+			time.sleep(delay)
+
+
+###################
+
+class CircuitBreaker():
+	'''
+	Thread safe tracking of unreachable hosts
+	Without network each request would wait for the full socket timeout, so after THRESHOLD consecutive
+	connection failures a host is considered unreachable and no more requested for a cooldown period.
+	Then a single probe request is allowed, its success close the circuit, its failure open it again
+	for a doubled cooldown (up to MAX_COOLDOWN seconds)
+	'''
+
+	THRESHOLD = 3
+	COOLDOWN = 15
+	MAX_COOLDOWN = 300
+
+	def __init__(self):
+		self.hosts = {} #host >> [nb consecutive failures, open until, cooldown, probe in progress]
+		self.lock = threading.Lock()
+
+	def allow(self, host):
+		'''Check if a request to this host can be sent'''
+		with self.lock:
+			state = self.hosts.get(host)
+			if state is None or state[0] < self.THRESHOLD:
+				return True
+			if state[3] or time.monotonic() < state[1]:
+				return False
+			#half open, let one probe request go
+			state[3] = True
+			return True
+
+	def success(self, host):
+		with self.lock:
+			self.hosts.pop(host, None)
+
+	def release(self, host):
+		'''A request allowed by allow() has been cancelled without outcome, let another probe go'''
+		with self.lock:
+			state = self.hosts.get(host)
+			if state is not None:
+				state[3] = False
+
+	def failure(self, host):
+		with self.lock:
+			state = self.hosts.setdefault(host, [0, 0, 0, False])
+			state[0] += 1
+			if state[0] >= self.THRESHOLD:
+				state[2] = min(max(state[2] * 2, self.COOLDOWN), self.MAX_COOLDOWN)
+				state[1] = time.monotonic() + state[2]
+				state[3] = False
+
+	@property
+	def nbOpen(self):
+		'''Number of hosts currently considered unreachable'''
+		with self.lock:
+			return len([state for state in self.hosts.values() if state[0] >= self.THRESHOLD])
+
+
+###################
+
+class LRUCache():
+	'''
+	A thread safe in memory key/value store bounded by the total size of its values
+	Least recently used items are evicted when the size limit is exceeded
+		maxSize >> limit in the unit returned by the sizeof function (bytes by default)
+		sizeof >> function that return the size of a value
+	'''
+
+	def __init__(self, maxSize, sizeof=len):
+		self.maxSize = maxSize
+		self.sizeof = sizeof
+		self.items = OrderedDict()
+		self.size = 0
+		self.hits = 0
+		self.misses = 0
+		self.lock = threading.Lock()
+
+	def __len__(self):
+		return len(self.items)
+
+	def __contains__(self, key):
+		return key in self.items
+
+	def get(self, key):
+		'''Return the value of this key or None'''
+		with self.lock:
+			value = self.items.get(key)
+			if value is None:
+				self.misses += 1
+			else:
+				self.hits += 1
+				self.items.move_to_end(key)
+			return value
+
+	def put(self, key, value):
+		size = self.sizeof(value)
+		with self.lock:
+			old = self.items.pop(key, None)
+			if old is not None:
+				self.size -= self.sizeof(old)
+			if size > self.maxSize:
+				return
+			self.items[key] = value
+			self.size += size
+			self.evict()
+
+	def pop(self, key):
+		with self.lock:
+			value = self.items.pop(key, None)
+			if value is not None:
+				self.size -= self.sizeof(value)
+			return value
+
+	def evict(self):
+		'''Remove least recently used items until cache size fit the limit (lock must be held)'''
+		while self.size > self.maxSize and self.items:
+			key, value = self.items.popitem(last=False)
+			self.size -= self.sizeof(value)
+
+	def resize(self, maxSize):
+		with self.lock:
+			self.maxSize = maxSize
+			self.evict()
+
+	def clear(self):
+		with self.lock:
+			self.items.clear()
+			self.size = 0
+
+	@property
+	def hitRatio(self):
+		n = self.hits + self.misses
+		if n == 0:
+			return 0
+		return self.hits / n
+
+
+###################
+
+class TileRevalidator():
+	'''
+	Revalidate stale cache tiles in a background thread
+	Stale tiles are served as is, then they are checked against the map service with conditional requests :
+	if a tile has not changed (304) only its timestamp is updated, otherwise the new data replace it
+	in cache database and in memory caches. Reprojected tiles have no http validators, they are rebuilt.
+	'''
+
+	def __init__(self):
+		self.jobs = queue.Queue()
+		self.pending = set() #keys of the tiles waiting for revalidation
+		self.lock = threading.Lock()
+		self.thread = None
+		self.services = {} #(srckey, cacheFolder, grdkey) >> map service, see getService
+		#stats
+		self.nbNotModified = 0
+		self.nbUpdated = 0
+
+	def submit(self, srv, laykey, toDstGrid, tiles):
+		'''tiles = list of (x,y,z,etag,lastModified) tuple of stale tiles as returned by GeoPackage.getTiles'''
+		if srv.OFFLINE:
+			return
+		with self.lock:
+			tiles = [t for t in tiles if srv.getMemKey(laykey, t[0], t[1], t[2], toDstGrid) not in self.pending]
+			if not tiles:
+				return
+			self.pending.update( [srv.getMemKey(laykey, t[0], t[1], t[2], toDstGrid) for t in tiles] )
+			if self.thread is None:
+				self.thread = threading.Thread(target=self.run)
+				self.thread.setDaemon(True)
+				self.thread.start()
+		grdkey = srv.dstGridKey if toDstGrid else None
+		self.jobs.put( (srv.srckey, srv.cacheFolder, grdkey, laykey, tiles) )
+
+	def run(self):
+		while True:
+			srckey, cacheFolder, grdkey, laykey, tiles = self.jobs.get()
+			srv = self.getService(srckey, cacheFolder, grdkey)
+			toDstGrid = grdkey is not None
+			try:
+				self.revalidate(srv, laykey, toDstGrid, tiles)
+			except Exception as e:
+				print("Can't revalidate tiles - " + str(e))
+			finally:
+				with self.lock:
+					self.pending.difference_update( [srv.getMemKey(laykey, t[0], t[1], t[2], toDstGrid) for t in tiles] )
+
+	def getService(self, srckey, cacheFolder, grdkey):
+		'''
+		Return the map service used to revalidate tiles of a source, it's built once and kept
+		A dedicated map service is needed since the one of the map viewer can be stopped at any time
+		'''
+		key = (srckey, cacheFolder, grdkey)
+		srv = self.services.get(key)
+		if srv is None:
+			srv = self.services[key] = MapService(srckey, cacheFolder, grdkey)
+			srv.running = True
+		return srv
+
+	def revalidate(self, srv, laykey, toDstGrid, tiles):
+		cache = srv.getCache(laykey, toDstGrid)
+		notModified, updated = [], []
+
+		if toDstGrid:
+			#rebuilds must not delay the tiles the map viewer is waiting for
+			updated = [t for t in srv.buildDstTiles(laykey, [t[:3] for t in tiles], cpt=False, priority=WorkerPool.PREFETCH)
+				if t[3] is not None]
+		else:
+			for col, row, zoom, etag, lastModified in tiles:
+				status, data, etag, lastModified = srv.requestTile(laykey, col, row, zoom, etag, lastModified)
+				if status == 304:
+					notModified.append( (col, row, zoom) )
+				elif data is not None:
+					updated.append( (col, row, zoom, data, etag, lastModified) )
+				#else keep the stale tile, it will be revalidated next time it's requested
+
+		cache.touchTiles(notModified)
+		cache.putTiles(updated)
+		for t in updated:
+			key = srv.getMemKey(laykey, t[0], t[1], t[2], toDstGrid)
+			srv.memCache.put(key, t[3])
+			srv.imgCache.pop(key)
+
+		self.nbNotModified += len(notModified)
+		self.nbUpdated += len(updated)
+
+
+###################
+
+class CacheJanitor():
+	'''
+	Keep the cache folder under its size quotas in a background thread
+	Least recently used tiles are evicted from each cache database exceeding the per cache quota,
+	then if the whole folder still exceeds the global quota, the least recently used tiles of all caches are evicted.
+	Caches are reduced to TARGET ratio of the quota, so eviction doesn't run again for each new tile
+	Long maintenance tasks (see GeoPackage.vacuum) are only run on user request (see maintain)
+	The thread only runs while a quota is set or a maintenance task is pending
+	'''
+
+	INTERVAL = 300 #seconds between two checks
+	TARGET = 0.9
+
+	#default quotas in MB (0 = unlimited)
+	CACHE_QUOTA = 0
+	FOLDER_QUOTA = 0
+
+	def __init__(self):
+		self.folder = None
+		self.cacheQuota = self.CACHE_QUOTA
+		self.folderQuota = self.FOLDER_QUOTA
+		self.wakeup = threading.Event()
+		self.lock = threading.Lock()
+		self.thread = None
+		self.nbEvicted = 0
+		self.dedupRatio = 1 #tiles data size / stored size of deduplicated caches
+		self.tasks = [] #GeoPackage methods names to run on every cache, see maintain
+		self.task = None #maintenance task in progress
+
+	def configure(self, folder, cacheQuota, folderQuota):
+		'''
+		Set cache folder and quotas (MB), then check them right now
+		The thread is only started if a quota is set, it stops by itself once quotas are back to unlimited
+		'''
+		self.folder = folder
+		self.cacheQuota = cacheQuota
+		self.folderQuota = folderQuota
+		if self.isNeeded():
+			self.start()
+		self.wakeup.set()
+
+	def isNeeded(self):
+		'''Tell if the thread has something to do'''
+		return bool(self.cacheQuota or self.folderQuota or self.tasks)
+
+	def start(self):
+		with self.lock:
+			if self.thread is None:
+				self.thread = threading.Thread(target=self.run)
+				self.thread.setDaemon(True)
+				self.thread.start()
+
+	def maintain(self, folder, task):
+		'''Run a GeoPackage method (like 'vacuum') on every cache of a folder in the background thread'''
+		self.folder = folder
+		if task not in self.tasks:
+			self.tasks.append(task)
+		self.start()
+		self.wakeup.set()
+
+	def run(self):
+		while True:
+			self.wakeup.wait(self.INTERVAL)
+			self.wakeup.clear()
+			while self.tasks:
+				self.task = self.tasks.pop(0)
+				try:
+					for gpkg in self.listCaches():
+						getattr(gpkg, self.task)()
+				except Exception as e:
+					print("Can't " + self.task + " cache folder - " + str(e))
+				self.task = None
+			try:
+				self.clean()
+			except Exception as e:
+				print("Can't clean cache folder - " + str(e))
+			with self.lock:
+				if not self.isNeeded():
+					self.thread = None
+					return
+
+	def listCaches(self):
+		'''Return geopackage objects of the cache folder'''
+		caches = []
+		if self.folder is None or not os.path.isdir(self.folder):
+			return caches
+		for name in os.listdir(self.folder):
+			if not name.endswith('.gpkg'):
+				continue
+			gpkg = GeoPackage(os.path.join(self.folder, name))
+			if gpkg.isGPKG():
+				gpkg.upgrade()
+				caches.append(gpkg)
+		return caches
+
+	def clean(self):
+		GeoPackage.flushAccessed()
+		caches = self.listCaches()
+
+		if self.cacheQuota:
+			quota = self.cacheQuota * 1024**2
+			for gpkg in caches:
+				size = gpkg.size
+				if size > quota:
+					self.nbEvicted += gpkg.evict(size - quota * self.TARGET)
+
+		if self.folderQuota:
+			quota = self.folderQuota * 1024**2
+			total = sum([gpkg.size for gpkg in caches])
+			if total > quota:
+				self.nbEvicted += self.evict(caches, total - quota * self.TARGET)
+
+		stats = [gpkg.dedupStats() for gpkg in caches if gpkg.isDedup]
+		size, stored = sum([s[0] for s in stats]), sum([s[1] for s in stats])
+		self.dedupRatio = size / stored if stored else 1
+
+	def evict(self, caches, nbBytes):
+		'''
+		Delete the least recently used tiles of all caches until nbBytes are released (see GeoPackage.iterLRU)
+		Return the number of deleted tiles
+		'''
+		lrus = [gpkg.iterLRU() for gpkg in caches]
+		#tag the tiles with their cache index and merge them in a single least recently used order
+		tiles = heapq.merge(*[zip(lru, itertools.repeat(i)) for i, lru in enumerate(lrus)],
+			key=lambda t: (t[0][0] or '', -t[0][1]))
+		ids, size = [[] for gpkg in caches], 0
+		for (date, zoom, tileId, length), i in tiles:
+			if size >= nbBytes:
+				break
+			ids[i].append(tileId)
+			size += length
+		for lru in lrus:
+			lru.close()
+		for gpkg, gpkgIds in zip(caches, ids):
+			gpkg.deleteTiles(gpkgIds)
+		return sum([len(gpkgIds) for gpkgIds in ids])
+
+
+###################
+
+
+class CoverageTree():
+	'''
+	In memory index of the tiles known to be missing from a map service layer
+	On a quadtree grid, a missing tile implies its whole subtree is missing, so a lookup only has to
+	walk up the ancestors of the requested tile.
+	Each entry expires after a ttl (seconds), then the tiles will be requested again.
+	Expired entries are pruned at most every PRUNE_DELAY seconds when new misses are added
+	'''
+
+	PRUNE_DELAY = 60
+
+	def __init__(self, quadTree, ttl):
+		self.quadTree = quadTree
+		self.ttl = ttl
+		self.nodes = {} #(zoom, col, row) : expiry time
+		self.nextPrune = 0
+		self.lock = threading.Lock()
+
+	def __len__(self):
+		return len(self.nodes)
+
+	def add(self, col, row, zoom, t=None):
+		'''Flag a missing tile, t is the time the miss was observed (now if None)'''
+		now = time.time()
+		expiry = (t or now) + self.ttl
+		with self.lock:
+			self.nodes[(zoom, col, row)] = expiry
+			if now >= self.nextPrune:
+				self.nextPrune = now + self.PRUNE_DELAY
+				self.nodes = {k:v for k, v in self.nodes.items() if v >= now}
+
+	def isMissing(self, col, row, zoom):
+		'''Return True if the tile or one of its ancestors is known to be missing'''
+		now = time.time()
+		levels = range(zoom + 1) if self.quadTree else [0]
+		for k in levels:
+			expiry = self.nodes.get((zoom-k, col >> k, row >> k))
+			if expiry is not None and expiry >= now:
+				return True
+		return False
+
+
 ###################
 
 
@@ -638,6 +2263,66 @@ class MapService():
 		referer
 	"""
 
+	#Process wide memory cache of encoded tiles, shared by all instances
+	#keys are (srckey, laykey, grdkey, zoom, col, row), values are bytes data
+	MEM_CACHE_SIZE = 128 #MB
+	memCache = LRUCache(MEM_CACHE_SIZE * 1024**2)
+
+	#Process wide pool of keep-alive http connections
+	HTTP_POOL_SIZE = 10
+	HTTP_MAX_PER_HOST = 10
+	httpPool = HTTPConnectionPool(HTTP_POOL_SIZE, HTTP_MAX_PER_HOST)
+
+	#Alternative fetch engine based on asyncio ('THREADS' or 'ASYNC')
+	FETCH_ENGINE = 'THREADS'
+	ASYNC_CONCURRENCY = 64
+	asyncFetcher = AsyncTileFetcher(ASYNC_CONCURRENCY, HTTP_MAX_PER_HOST)
+
+	#Reprojected tiles are built by metatiles of n x n tiles,
+	#with an overlap of n source pixels around each metatile
+	METATILE_SIZE = 8
+	METATILE_OVERLAP = 4
+
+	#Progressive mosaic, partial mosaic is reported every n tiles or every n seconds
+	PROGRESSIVE_TILES = 8
+	PROGRESSIVE_DELAY = 0.2
+
+	#Missing tiles are first displayed by upsampling their cached ancestors up to n zoom levels above
+	PLACEHOLDER_LEVELS = 4
+
+	#Process wide coalescing of concurrent downloads and decodes of the same tile
+	singleFlight = SingleFlight()
+
+	#Process wide pool of threads used to download, decode and reproject tiles
+	NB_WORKERS = 16
+	workers = WorkerPool(NB_WORKERS)
+
+	#Process wide cache of decoded tiles (RGBA PIL images) with the same keys
+	IMG_CACHE_SIZE = 256 #MB
+	imgCache = LRUCache(IMG_CACHE_SIZE * 1024**2, sizeof=lambda img: img.size[0] * img.size[1] * 4)
+
+	#Http validators (etag, last-modified) of downloaded source tiles not yet written in cache database
+	validators = LRUCache(4096, sizeof=lambda v: 1)
+
+	#Background revalidation of stale cache tiles
+	revalidator = TileRevalidator()
+
+	#Background eviction of least recently used tiles when the cache folder exceeds its quotas
+	janitor = CacheJanitor()
+
+	#Negative cache, tiles the service doesn't have are remembered for MISS_TTL days
+	#and replaced by an empty tile without request
+	MISS_TTL = 7
+	MISS_STATUS = (204, 404)
+	coverages = {} #CoverageTree by (cacheFolder, srckey, laykey)
+	coveragesLock = threading.Lock()
+	emptyTiles = {} #encoded transparent tile by tile size
+
+	#Cache only mode, no request is sent and mosaics are built from cached tiles only
+	OFFLINE = False
+	#Hosts that fail to respond are no more requested for a while
+	breaker = CircuitBreaker()
+
 	def __init__(self, srckey, cacheFolder, dstGridKey=None):
 
 
@@ -674,11 +2359,20 @@ class MapService():
 			'Accept-Charset' : 'ISO-8859-1,utf-8;q=0.7,*;q=0.7' ,
 			'Accept-Encoding' : 'gzip,deflate' ,
 			'Accept-Language' : 'fr,en-us,en;q=0.5' ,
-			'Keep-Alive': 115 ,
-			'Proxy-Connection' : 'keep-alive' ,
+			'Connection' : 'keep-alive' ,
 			'User-Agent' : 'Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:45.0) Gecko/20100101 Firefox/45.0',
 			'Referer' : self.referer}
 
+		#Fetch engine used to download missing tiles
+		self.fetchEngine = self.FETCH_ENGINE
+		#Optional RateLimiter applied to downloads of this service
+		self.rateLimiter = None
+
+		#Requests submitted before the last call to newGeneration() are cancelled
+		self.generation = 0
+		#Pending tiles are requested from the nearest to this point (x,y in requested grid crs)
+		self.viewCenter = None
+
 		#Downloading progress
 		self.running = False
 		self.nbTiles = 0
@@ -686,6 +2380,36 @@ class MapService():
 		self.report = None
 
 
+	def newGeneration(self):
+		'''Cancel the requests in progress, their remaining tiles are dropped from the workers queue'''
+		self.generation += 1
+		self.nbTiles, self.cptTiles = 0, 0
+		return self.generation
+
+	def isAlive(self, generation, cancel=None):
+		'''Check if a request of this generation is still wanted'''
+		return self.running and generation == self.generation and (cancel is None or not cancel.is_set())
+
+	def setViewCenter(self, x, y):
+		'''Update the view center and reorder the tiles still waiting to be requested'''
+		self.viewCenter = (x, y)
+		self.workers.reprioritize()
+
+	def getCenterKey(self, toDstGrid):
+		'''Return a function that sort tiles (x,y,z,...) by distance from the view center, or None if not applicable'''
+		if self.dstGridKey is not None and not toDstGrid:
+			#view center is expressed in destination grid crs, keep the requested order
+			return None
+		tm = self.dstTms if toDstGrid else self.srcTms
+		def key(tile):
+			if self.viewCenter is None:
+				return 0
+			col, row, zoom = tile[:3]
+			xmin, ymin, xmax, ymax = tm.getTileBbox(col, row, zoom)
+			cx, cy = self.viewCenter
+			return ((xmin + xmax) / 2 - cx)**2 + ((ymin + ymax) / 2 - cy)**2
+		return key
+
 	def setDstGrid(self, grdkey):
 		'''Set destination tile matrix'''
 		if grdkey is not None and grdkey != self.srcGridKey:
@@ -717,6 +2441,14 @@ class MapService():
 		else:
 			return cache
 
+	def getMemKey(self, laykey, col, row, zoom, useDstGrid):
+		'''Return the key identifying a tile in the memory cache'''
+		if useDstGrid:
+			grdkey = self.dstGridKey
+		else:
+			grdkey = self.srcGridKey
+		return (self.srckey, laykey, grdkey, zoom, col, row)
+
 
 	def buildUrl(self, laykey, col, row, zoom):
 		"""
@@ -793,6 +2525,8 @@ class MapService():
 		"""
 		Download bytes data of requested tile in source tile matrix space
 		Return None if unable to download a valid stream
+		Return an empty tile if the map service doesn't have this tile (see missed())
+		Http validators of the tile are kept until the tile is written in cache database
 
 		Notes:
 		bytes object can be converted to bytesio (stream buffer) and opened with PIL
@@ -800,31 +2534,150 @@ class MapService():
 		PIL image can be converted to numpy array [y,x,b]
 			a = np.asarray(img)
 		"""
+		if self.isMissing(laykey, col, row, zoom):
+			return self.getEmptyTile()
+		status, data, etag, lastModified = self.requestTile(laykey, col, row, zoom)
+		if data is None:
+			return self.missed(laykey, col, row, zoom, status, data)
+		self.keepValidators(laykey, col, row, zoom, etag, lastModified)
+		return data
+
+	def requestTile(self, laykey, col, row, zoom, etag=None, lastModified=None):
+		"""
+		Request a tile in source tile matrix space, conditionally if validators of a cached version are given
+		Return a (status, data, etag, lastModified) tuple, data is None if the tile has not changed (status 304)
+		or if unable to download a valid stream (status is None if the request failed or returned an invalid stream)
+		"""
 
 		url = self.buildUrl(laykey, col, row, zoom)
 		#print(url)
 
+		if not self.canRequest(url):
+			return None, None, None, None
+
+		headers = self.headers
+		if etag is not None or lastModified is not None:
+			headers = dict(headers)
+			if etag is not None:
+				headers['If-None-Match'] = etag
+			if lastModified is not None:
+				headers['If-Modified-Since'] = lastModified
+
+		if self.rateLimiter is not None:
+			self.rateLimiter.wait()
+
 		try:
-			#make request
-			req = urllib.request.Request(url, None, self.headers)
-			handle = urllib.request.urlopen(req, timeout=3)
-			#open image stream
-			data = handle.read()
-			handle.close()
-		except:
-			print("Can't download tile x"+str(col)+" y"+str(row))
+			#make request through a pooled keep-alive connection
+			try:
+				status, respHeaders, data = self.httpPool.request(url, headers)
+			except Exception as e:
+				self.reportRequest(url, e)
+				raise
+			self.reportRequest(url)
+			if status == 304:
+				return status, None, etag, lastModified
+			if status != 200:
+				raise urllib.error.HTTPError(url, status, 'Unexpected http status', respHeaders, None)
+		except Exception as e:
+			print("Can't download tile x"+str(col)+" y"+str(row)+" - "+str(e))
 			print(url)
-			data = None
+			return getattr(e, 'code', None), None, None, None
+
+		#Make sure the stream is correct
+		format = imghdr.what(None, data)
+		if format is None:
+			#an empty body means the service has no tile here, anything else is a broken response (see missed())
+			return (None if data else status), None, None, None
+
+		return status, data, respHeaders.get('ETag'), respHeaders.get('Last-Modified')
+
+	def keepValidators(self, laykey, col, row, zoom, etag, lastModified):
+		'''Keep http validators of a downloaded source tile until it's written in cache database'''
+		if etag is not None or lastModified is not None:
+			self.validators.put(self.getMemKey(laykey, col, row, zoom, False), (etag, lastModified))
+
+	def canRequest(self, url):
+		'''Check if a request can be sent, ie not in cache only mode and host not known as unreachable'''
+		return not self.OFFLINE and self.breaker.allow(urllib.parse.urlsplit(url)[1])
+
+	def cancelRequest(self, url):
+		'''A request allowed by canRequest has been cancelled, if it was a circuit breaker probe another one can be sent'''
+		self.breaker.release(urllib.parse.urlsplit(url)[1])
+
+	def reportRequest(self, url, error=None):
+		'''Feed the circuit breaker with the outcome of a request, http errors prove the host is reachable'''
+		host = urllib.parse.urlsplit(url)[1]
+		if isinstance(error, (OSError, asyncio.TimeoutError)) and getattr(error, 'code', None) is None:
+			self.breaker.failure(host)
+		else:
+			self.breaker.success(host)
+
+	def getCoverage(self, laykey):
+		'''Return the CoverageTree of missing tiles of a layer, loaded from cache database at first call'''
+		key = (self.cacheFolder, self.srckey, laykey)
+		with self.coveragesLock:
+			tree = self.coverages.get(key)
+			if tree is None:
+				tree = CoverageTree(self.srcTms.isQuadTree, self.MISS_TTL * 86400)
+				for col, row, zoom, date in self.getCache(laykey, False).listMissingTiles(self.MISS_TTL):
+					if isinstance(date, str):
+						date = datetime.datetime.strptime(date, '%Y-%m-%d %H:%M:%S')
+					tree.add(col, row, zoom, time.mktime(date.timetuple()))
+				self.coverages[key] = tree
+		return tree
+
+	def isMissing(self, laykey, col, row, zoom):
+		'''Check if a source tile is known to be missing from the map service'''
+		return self.getCoverage(laykey).isMissing(col, row, zoom)
+
+	def missed(self, laykey, col, row, zoom, status, data):
+		"""
+		Handle a source tile request that returned no valid data
+		If the service reports it doesn't have the tile (no content, not found or empty body) the tile is remembered
+		as missing and an empty tile is returned, otherwise it's just a failure and None is returned
+		Misses below the layer min zoom are not recorded because on a quadtree they would hide the whole layer
+		"""
+		if status not in self.MISS_STATUS and not (status == 200 and not data):
+			return None
+		if zoom < self.layers[laykey].zmin:
+			return None
+		self.getCoverage(laykey).add(col, row, zoom)
+		self.getCache(laykey, False).putMissingTiles([(col, row, zoom)])
+		return self.getEmptyTile()
+
+	def getEmptyTile(self):
+		'''Return an encoded transparent tile used in place of missing tiles'''
+		size = self.srcTms.tileSize
+		data = self.emptyTiles.get(size)
+		if data is None:
+			b = io.BytesIO()
+			Image.new('RGBA', (size, size), (0, 0, 0, 0)).save(b, format='PNG')
+			data = self.emptyTiles[size] = b.getvalue()
+		return data
+
+	def isEmptyTile(self, data):
+		'''Empty tiles are not stored in caches, so a missing tile will be requested again once its miss expire'''
+		return data is not None and data == self.emptyTiles.get(self.srcTms.tileSize)
 
-		#Make sure the stream is correct
-		if data is not None:
-			format = imghdr.what(None, data)
-			if format is None:
-				data = None
+	def withValidators(self, laykey, tiles, toDstGrid):
+		'''Return (x,y,z,data,etag,lastModified) tuples from (x,y,z,data) tuples'''
+		if toDstGrid:
+			#reprojected tiles are built from several source tiles, they have no validators
+			return tiles
+		return [t + (self.validators.pop(self.getMemKey(laykey, t[0], t[1], t[2], False)) or (None, None)) for t in tiles]
 
-		return data
 
 
+	def storeTiles(self, cache, laykey, tiles, toDstGrid):
+		'''
+		Write downloaded tiles in cache database
+		A failure (for example the database is locked by a maintenance task) is only logged, the tiles stay in memory cache
+		'''
+		tiles = self.withValidators(laykey, tiles, toDstGrid)
+		try:
+			cache.putTiles(tiles)
+		except sqlite3.Error as e:
+			print("Can't write tiles in cache database - " + str(e))
 
 	def getTile(self, laykey, col, row, zoom, toDstGrid=True, useCache=True):
 		"""
@@ -850,94 +2703,265 @@ class MapService():
 			return None
 
 		if useCache:
-			#check if tile already exists in cache
+			#check if tile already exists in memory cache
 			cache = self.getCache(laykey, toDstGrid)
-			data = cache.getTile(col, row, zoom)
+			memKey = self.getMemKey(laykey, col, row, zoom, toDstGrid)
+			data = self.memCache.get(memKey)
+			if data is not None:
+				cache.markAccessed([(col, row, zoom)])
+				return data
+
+			#check if tile already exists in cache
+			stale = []
+			data = cache.getTile(col, row, zoom, stale)
 
 			#if so check if its a valid image
 			if data is not None:
 				format = imghdr.what(None, data)
 				if format is not None:
+					self.memCache.put(memKey, data)
+					cache.markAccessed([(col, row, zoom)])
+					#serve stale tile right now and revalidate it in background
+					if stale:
+						self.revalidator.submit(self, laykey, toDstGrid, stale)
 					return data
 
 		#if tile does not exists in cache or is corrupted, try to download it from map service
 		if not toDstGrid:
 
-			data = self.downloadTile(laykey, col, row, zoom)
+			#concurrent requests of the same tile (for example from neighbouring reprojected tiles) share one download
+			key = ('download',) + self.getMemKey(laykey, col, row, zoom, False)
+			data = self.singleFlight.do(key, self.downloadTile, laykey, col, row, zoom)
 
 		else: # build a reprojected tile
 
-			#get tile bbox
-			bbox = self.dstTms.getTileBbox(col, row, zoom)
+			#nothing is built if the service is not running
+			tiles = self.buildDstTiles(laykey, [(col, row, zoom)], cpt=False)
+			data = tiles[0][3] if tiles else None
+
+		#put the tile in memory and cache database
+		if useCache and data is not None and not self.isEmptyTile(data):
+			self.memCache.put(memKey, data)
+			self.storeTiles(cache, laykey, [(col, row, zoom, data)], toDstGrid)
+
+		return data
+
+
+
+	def getSrcZoom(self, zoom):
+		'''Return the source grid zoom level whose resolution is the closest to this destination grid zoom level'''
+		res = self.dstTms.getRes(zoom)
+		if self.dstTms.units == 'degrees' and self.srcTms.units == 'meters':
+			res2 = dd2meters(res)
+		elif self.srcTms.units == 'degrees' and self.dstTms.units == 'meters':
+			res2 = meters2dd(res)
+		else:
+			res2 = res
+		return self.srcTms.getNearestZoom(res2)
+
+
+	def buildDstTiles(self, laykey, tiles, cpt=True, cancel=None, callback=None, size=None, priority=None):
+		"""
+		Build reprojected tiles in destination tile matrix space
+		input: [(x,y,z)] >> output: [(x,y,z,data)]
+		Tiles are grouped by metatiles of at most size x size tiles. For each metatile a single source mosaic
+		is fetched and reprojected, then cut into destination tiles. So GDAL setup, source reads and edges overlap
+		are paid once per metatile instead of once per tile. Metatiles are processed by the workers pool.
+		"""
+		if size is None:
+			size = self.METATILE_SIZE
+		tm = self.dstTms
+		tileSize = tm.tileSize
+		crs1, crs2 = self.srcTms.CRS, self.dstTms.CRS
+
+		#group tiles by metatiles
+		metatiles = OrderedDict()
+		for col, row, zoom in tiles:
+			metatiles.setdefault( (zoom, col // size, row // size), []).append( (col, row, zoom) )
+
+		tilesData = []
+		generation = self.generation
+
+		def build(zoom, group):
+			'''Build the tiles of a metatile, run by the workers pool'''
+			cols = [t[0] for t in group]
+			rows = [t[1] for t in group]
+			colMin, colMax, rowMin, rowMax = min(cols), max(cols), min(rows), max(rows)
+
+			#metatile bbox (with a SW origin, first row is at the bottom)
+			xmin1, ymin1, xmax1, ymax1 = tm.getTileBbox(colMin, rowMin, zoom)
+			xmin2, ymin2, xmax2, ymax2 = tm.getTileBbox(colMax, rowMax, zoom)
+			bbox = (min(xmin1, xmin2), min(ymin1, ymin2), max(xmax1, xmax2), max(ymax1, ymax2))
 			xmin, ymin, xmax, ymax = bbox
+			res = tm.getRes(zoom)
+			w, h = (colMax - colMin + 1) * tileSize, (rowMax - rowMin + 1) * tileSize
 
 			#get closest zoom level
-			res = self.dstTms.getRes(zoom)
-			if self.dstTms.units == 'degrees' and self.srcTms.units == 'meters':
-				res2 = dd2meters(res)
-			elif self.srcTms.units == 'degrees' and self.dstTms.units == 'meters':
-				res2 = meters2dd(res)
-			else:
-				res2 = res
-			_zoom = self.srcTms.getNearestZoom(res2)
+			_zoom = self.getSrcZoom(zoom)
 			_res = self.srcTms.getRes(_zoom)
 
-			#reproj bbox
-			crs1, crs2 = self.srcTms.CRS, self.dstTms.CRS
+			#reproj bbox and add some overlap for the resampling kernel
 			try:
-				_bbox = reprojBbox(crs2, crs1, bbox)
+				_xmin, _ymin, _xmax, _ymax = reprojBbox(crs2, crs1, bbox)
 			except Exception as e:
 				print('WARN : cannot reproj tile bbox - ' + str(e))
-				return None
-
-			#list, download and merge the tiles required to build this one (recursive call)
-			mosaic = self.getImage(laykey, _bbox, _zoom, toDstGrid=False, useCache=False, nbThread=4, cpt=False, allowEmptyTile=False)
+				mosaic = None
+			else:
+				m = self.METATILE_OVERLAP * _res
+				_bbox = (_xmin - m, _ymin - m, _xmax + m, _ymax + m)
+				#intersect with the source grid extent (minus half a pixel to absorb rounding errors)
+				#so that no out of grid tile is requested at the world edges
+				gxmin, gymin, gxmax, gymax = self.srcTms.globalbbox
+				_bbox = (max(_bbox[0], gxmin + _res / 2), max(_bbox[1], gymin + _res / 2),
+					min(_bbox[2], gxmax - _res / 2), min(_bbox[3], gymax - _res / 2))
+
+				if _bbox[0] >= _bbox[2] or _bbox[1] >= _bbox[3]:
+					mosaic = None
+				else:
+					#list, download and merge the tiles required to build this metatile (recursive call)
+					mosaic = self.getImage(laykey, _bbox, _zoom, toDstGrid=False, useCache=False, cpt=False, allowEmptyTile=False)
 
 			if mosaic is None:
-				return None
-
-			tileSize = self.dstTms.tileSize
-
-			img = reprojImg(crs1, crs2, mosaic, out_ul=(xmin,ymax), out_size=(tileSize,tileSize), out_res=res)
-
-			#Get BLOB
-			b = io.BytesIO()
-			img.save(b, format='PNG')
-			data = b.getvalue() #convert bytesio to bytes
+				if len(group) > 1:
+					#a source tile is missing, fallback to tile by tile so that only the concerned tiles fail
+					result = self.buildDstTiles(laykey, group, cpt, cancel, callback, size=1)
+				else:
+					result = [ (col, row, zoom, None) for col, row, zoom in group ]
+			else:
+				img = reprojImg(crs1, crs2, mosaic, out_ul=(xmin,ymax), out_size=(w,h), out_res=res)
+				result = []
+				for col, row, zoom in group:
+					#cut the tile
+					posx = (col - colMin) * tileSize
+					if tm.originLoc == "NW":
+						posy = (row - rowMin) * tileSize
+					else:
+						posy = (rowMax - row) * tileSize
+					tile = img.img.crop( (posx, posy, posx + tileSize, posy + tileSize) )
+					#Get BLOB
+					b = io.BytesIO()
+					tile.save(b, format='PNG')
+					data = b.getvalue() #convert bytesio to bytes
+					result.append( (col, row, zoom, data) )
+					if callback is not None:
+						callback(col, row, zoom, data)
+					if cpt:
+						self.cptTiles += 1
 
-		#put the tile in cache database
-		if useCache and data is not None:
-			cache.putTile(col, row, self.zoom, data)
+			tilesData.extend(result)
 
-		return data
+		#metatiles are built in parallel, each one fetch its source tiles through the same workers
+		jobs = [ (zoom, group) for (zoom, _, _), group in metatiles.items() ]
+		centerKey = self.getCenterKey(True)
+		self.workers.map(build, jobs, alive=lambda: self.isAlive(generation, cancel), priority=priority,
+			key=lambda job: centerKey(job[1][len(job[1]) // 2]))
 
+		return tilesData
 
 
-	def getTiles(self, laykey, tiles, tilesData = [], toDstGrid=True, useCache=True, nbThread=10, cpt=True):
+	def getPlaceholders(self, laykey, tiles, toDstGrid=True, levels=None):
+		"""
+		Build temporary images of tiles by upsampling the portion of their ancestor at zoom z-1 ... z-levels
+		already available in memory or cache database, no request is sent
+		input: [(x,y,z)] >> output: {(x,y,z):PIL image}, tiles without cached ancestor are not in the output
+		"""
+		if levels is None:
+			levels = self.PLACEHOLDER_LEVELS
+		tm = self.dstTms if toDstGrid else self.srcTms
+		tileSize = tm.tileSize
+		cache = self.getCache(laykey, toDstGrid)
+		ancestors = {} #(x,y,z) >> decoded image or None if not available
+		placeholders = {}
+
+		todo = list(tiles)
+		for k in range(1, levels + 1):
+			#find the ancestor of each tile at this level
+			parents = {}
+			for col, row, zoom in todo:
+				if zoom - k < 0:
+					continue
+				xmin, ymin, xmax, ymax = tm.getTileBbox(col, row, zoom)
+				pcol, prow = tm.getTileNumber((xmin + xmax) / 2, (ymin + ymax) / 2, zoom - k)
+				parents[(col, row, zoom)] = (pcol, prow, zoom - k)
+			if not parents:
+				break
+
+			#look up the ancestors in memory then in cache database
+			unknown = []
+			for parent in set(parents.values()):
+				if parent in ancestors:
+					continue
+				memKey = self.getMemKey(laykey, parent[0], parent[1], parent[2], toDstGrid)
+				img = self.imgCache.get(memKey)
+				if img is None:
+					data = self.memCache.get(memKey)
+					if data is not None:
+						try:
+							img = self.decodeTile(data)
+						except:
+							pass
+				if img is None:
+					unknown.append(parent)
+				else:
+					ancestors[parent] = img
+			if unknown:
+				for parent in unknown:
+					ancestors[parent] = None
+				for col, row, zoom, data in cache.getTiles(unknown):
+					try:
+						ancestors[(col, row, zoom)] = self.decodeTile(data)
+					except:
+						pass
+
+			#crop and upsample the ancestors
+			todo = []
+			for tile, parent in parents.items():
+				img = ancestors[parent]
+				if img is None:
+					todo.append(tile)
+					continue
+				col, row, zoom = tile
+				xmin, ymin, xmax, ymax = tm.getTileBbox(col, row, zoom)
+				pxmin, pymin, pxmax, pymax = tm.getTileBbox(parent[0], parent[1], parent[2])
+				pres = tm.getRes(parent[2])
+				left, top = (xmin - pxmin) / pres, (pymax - ymax) / pres
+				size = tileSize * tm.getRes(zoom) / pres
+				if size < 1:
+					continue
+				box = (int(round(left)), int(round(top)), int(round(left + size)), int(round(top + size)))
+				placeholders[tile] = img.crop(box).resize((tileSize, tileSize), Image.BILINEAR)
+
+		return placeholders
+
+
+	def decodeTile(self, data):
+		'''Decode bytes data to a RGBA PIL image, convert() force PIL to decode the stream now'''
+		return Image.open(io.BytesIO(data)).convert('RGBA')
+
+
+	def getTiles(self, laykey, tiles, tilesData = [], toDstGrid=True, useCache=True, nbThread=10, cpt=True, cancel=None, callback=None, priority=None):
 		"""
 		Return bytes data of requested tiles
 		input: [(x,y,z)] >> output: [(x,y,z,data)]
 		Tiles are downloaded from map service or directly pick up from cache database.
-		Downloads are performed through thread to speed up
+		Downloads are performed by at most nbThread threads of the workers pool to speed up
 		Possibility to pass a list 'tilesData' as argument to seed it
+		Downloads stop if the service stop running or if the optional 'cancel' event is set
+		The optional callback function receive (x,y,z,data) of each tile as soon as it's available
+		Downloads are scheduled with the given workers pool priority (WorkerPool.VISIBLE or PREFETCH),
+		from the nearest to the view center if any
 		"""
 
-		def downloading(laykey, tilesQueue, tilesData, toDstGrid):
-			'''Worker that process the queue and seed tilesData array [(x,y,z,data)]'''
-			#infinite loop that processes items into the queue
-			while not tilesQueue.empty():
-				#cancel thread if requested
-				if not self.running:
-					break
-				#Get a job into the queue
-				col, row, zoom = tilesQueue.get()
-				#do the job
-				data = self.getTile(laykey, col, row, zoom, toDstGrid, useCache=False)
-				tilesData.append( (col, row, zoom, data) )
-				if cpt:
-					self.cptTiles += 1
-				#flag it's done
-				tilesQueue.task_done()
+		generation = self.generation
+
+		def downloading(col, row, zoom):
+			'''Worker job that seed tilesData array [(x,y,z,data)]'''
+			data = self.getTile(laykey, col, row, zoom, toDstGrid, useCache=False)
+			tilesData.append( (col, row, zoom, data) )
+			if callback is not None:
+				callback(col, row, zoom, data)
+			if cpt:
+				self.cptTiles += 1
 
 		if cpt:
 			#init cpt progress
@@ -945,41 +2969,62 @@ class MapService():
 			self.cptTiles = 0
 
 		if useCache:
+			#first pick up the tiles available in memory cache
+			result, missing = [], []
+			for col, row, zoom in tiles:
+				data = self.memCache.get(self.getMemKey(laykey, col, row, zoom, toDstGrid))
+				if data is not None:
+					result.append( (col, row, zoom, data) )
+				else:
+					missing.append( (col, row, zoom) )
+			#then look up the others in cache database
 			cache = self.getCache(laykey, toDstGrid)
-			result = cache.getTiles(tiles) #return [(x,y,z,data)]
-			existing = set([ r[:-1] for r in result])
-			missing = [t for t in tiles if t not in existing]
+			if len(missing) > 0:
+				stale = []
+				stored = cache.getTiles(missing, stale) #return [(x,y,z,data)]
+				for col, row, zoom, data in stored:
+					self.memCache.put(self.getMemKey(laykey, col, row, zoom, toDstGrid), data)
+				result.extend(stored)
+				existing = set([ r[:-1] for r in stored])
+				missing = [t for t in missing if t not in existing]
+				#stale tiles are served as is and revalidated in background
+				if stale:
+					self.revalidator.submit(self, laykey, toDstGrid, stale)
+			#last access of cached tiles is used to evict least recently used ones
+			cache.markAccessed([t[:3] for t in result])
 			if cpt:
 				self.cptTiles += len(result)
+			if callback is not None:
+				for tile in result:
+					callback(*tile)
 		else:
 			missing = tiles
 
-		if len(missing) > 0:
+		if len(missing) > 0 and toDstGrid:
 
-			#Seed the queue
-			jobs = queue.Queue()
-			for tile in missing:
-				jobs.put(tile)
+			#reprojected tiles are built by metatiles, source tiles are fetched with the selected engine
+			tilesData.extend(self.buildDstTiles(laykey, missing, cpt, cancel, callback, priority=priority))
 
-			#Launch threads
-			threads = []
-			for i in range(nbThread):
-				t = threading.Thread(target=downloading, args=(laykey, jobs, tilesData, toDstGrid))
-				t.setDaemon(True)
-				threads.append(t)
-				t.start()
+		elif len(missing) > 0 and self.fetchEngine == 'ASYNC':
+
+			tilesData.extend(self.asyncFetcher.fetch(self, laykey, missing, cpt, cancel, callback))
+
+		elif len(missing) > 0:
 
-			#Wait for all threads to complete (queue empty)
-			#jobs.join()
-			for t in threads:
-				t.join()
+			#Queue the jobs and wait for all of them to complete, remaining jobs are dropped if cancelled
+			self.workers.map(downloading, missing, nbThread, alive=lambda: self.isAlive(generation, cancel),
+				priority=priority, key=self.getCenterKey(toDstGrid))
 
-			#Put all missing tiles in cache
+		if len(missing) > 0:
+			#Put all missing tiles in memory and cache database
 			if useCache:
-				cache.putTiles( [t for t in tilesData if t[3] is not None] )
+				downloaded = [t for t in tilesData if t[3] is not None and not self.isEmptyTile(t[3])]
+				for col, row, zoom, data in downloaded:
+					self.memCache.put(self.getMemKey(laykey, col, row, zoom, toDstGrid), data)
+				self.storeTiles(cache, laykey, downloaded, toDstGrid)
 
-		#Reinit cpt progress
-		if cpt:
+		#Reinit cpt progress, unless a newer request already use it
+		if cpt and generation == self.generation:
 			self.nbTiles, self.cptTiles = 0, 0
 
 		#Add existing tiles to final list
@@ -990,10 +3035,21 @@ class MapService():
 
 
 
-	def getImage(self, laykey, bbox, zoom, toDstGrid=True, useCache=True, nbThread=10, cpt=True, outCRS=None, allowEmptyTile=True):
+	def getImage(self, laykey, bbox, zoom, toDstGrid=True, useCache=True, nbThread=10, cpt=True, outCRS=None, allowEmptyTile=True, onUpdate=None, base=None, progressive=True):
 		"""
 		Build a mosaic of tiles covering the requested bounding box
 		return GeoImage object (PIL image + georef infos)
+		Tiles are requested center first. If an onUpdate function is submited, tiles are pasted as soon as
+		they arrive and the function receive the partial mosaic (GeoImage) at a throttled rate.
+		Partial mosaics are not reported if the final mosaic must be reprojected to outCRS
+		Tiles to fetch are first filled with their upsampled ancestors if cached (see getPlaceholders),
+		and those that can't be fetched keep this placeholder
+		If progressive is False, onUpdate only receive a first frame made of the already available tiles and
+		the placeholders, then the tiles are pasted once all fetched
+		The optional base is a previous mosaic built by this function at the same zoom level and without outCRS,
+		its tiles are shifted in the new mosaic and only the newly exposed ones are requested. If it covers
+		exactly the same tiles, base itself is returned.
+		Return None if the service stop running or start a new generation before the mosaic is complete
 		"""
 
 		#Select tile matrix set
@@ -1007,6 +3063,7 @@ class MapService():
 
 		tileSize = tm.tileSize
 		res = tm.getRes(zoom)
+		generation = self.generation
 
 		xmin, ymin, xmax, ymax = bbox
 
@@ -1030,43 +3087,134 @@ class MapService():
 		#Create PIL image in memory
 		img_w, img_h = len(cols) * tileSize, len(rows) * tileSize
 		mosaic = Image.new("RGBA", (img_w , img_h), None)
+		geoimg = GeoImage(mosaic, (xmin, ymax), res)
 
-		#Get tiles from www or cache
-		tiles = [ (c, r, zoom) for c in cols for r in rows]
-
-		tiles = self.getTiles(laykey, tiles, [], toDstGrid, useCache, nbThread, cpt)
-
-		for tile in tiles:
-
-			if not self.running:
-				return None
+		#Partial mosaics can only be reported in grid crs
+		if outCRS is not None and outCRS != tm.CRS:
+			onUpdate = None
 
-			col, row, z, data = tile
+		#Get tiles from www or cache, center first
+		tiles = [ (c, r, zoom) for c in cols for r in rows]
+		cx, cy = (cols[0] + cols[-1]) / 2, (rows[0] + rows[-1]) / 2
+		tiles.sort(key=lambda t: (t[0] - cx)**2 + (t[1] - cy)**2)
+
+		lock = threading.Lock()
+		progress = {'nb':0, 'time':time.time(), 'failed':False}
+		#tiles replaced by a placeholder, a mosaic reusing this one as base will request them again
+		geoimg.failed = set()
+		#upsampled ancestors displayed until the tiles arrive
+		placeholders = {}
+
+		#Shift the tiles of the previous mosaic
+		if base is not None and base.res == res and (outCRS is None or outCRS == tm.CRS):
+			bx, by = base.ul
+			baseCol, baseRow = tm.getTileNumber(bx + tileSize * res / 2, by - tileSize * res / 2, zoom)
+			baseCols = range(baseCol, baseCol + base.img.size[0] // tileSize)
+			if tm.originLoc == "NW":
+				baseRows = [baseRow + i for i in range(base.img.size[1] // tileSize)]
+			else:
+				baseRows = [baseRow - i for i in range(base.img.size[1] // tileSize)]
+			failed = getattr(base, 'failed', set())
+			reused = set( (c, r) for c in baseCols for r in baseRows if (c, r) not in failed )
+			missing = [t for t in tiles if (t[0], t[1]) not in reused]
+			if not missing and (baseCol, baseRow) == (firstCol, firstRow) and base.img.size == mosaic.size:
+				#nothing changed
+				return base
+			if len(missing) < len(tiles):
+				dy = baseRow - firstRow if tm.originLoc == "NW" else firstRow - baseRow
+				mosaic.paste(base.img, ((baseCol - firstCol) * tileSize, dy * tileSize))
+				tiles = missing
+				if onUpdate is not None and progressive:
+					onUpdate(geoimg)
+
+		def paste(col, row, z, data):
+			'''Decode a tile and paste it in the mosaic, may be called from worker threads'''
 			if data is None:
-				#create an empty tile
+				#keep the placeholder or create an empty tile
 				if allowEmptyTile:
-					img = Image.new("RGBA", (tileSize , tileSize), "lightgrey")
+					img = placeholders.get( (col, row, z) )
+					if img is None:
+						img = Image.new("RGBA", (tileSize , tileSize), "lightgrey")
+					geoimg.failed.add( (col, row) )
 				else:
-					return None
+					progress['failed'] = True
+					return
 			else:
 				try:
-					img = Image.open(io.BytesIO(data))
+					#concurrent mosaics requesting the same tile share one decode
+					key = ('decode',) + self.getMemKey(laykey, col, row, z, toDstGrid)
+					img = self.singleFlight.do(key, self.decodeTile, data)
 				except:
 					if allowEmptyTile:
 						#create an empty tile if we are unable to get a valid stream
 						img = Image.new("RGBA", (tileSize , tileSize), "pink")
+						geoimg.failed.add( (col, row) )
 					else:
-						return None
+						progress['failed'] = True
+						return
+				else:
+					if useCache:
+						self.imgCache.put(self.getMemKey(laykey, col, row, z, toDstGrid), img)
 			posx = (col - firstCol) * tileSize
 			posy = abs((row - firstRow)) * tileSize
-			mosaic.paste(img, (posx, posy))
+			with lock:
+				mosaic.paste(img, (posx, posy))
+				#report partial mosaic at a throttled rate
+				if onUpdate is not None:
+					progress['nb'] += 1
+					now = time.time()
+					if progress['nb'] >= self.PROGRESSIVE_TILES or now - progress['time'] >= self.PROGRESSIVE_DELAY:
+						progress['nb'], progress['time'] = 0, now
+						onUpdate(geoimg)
+
+		#Tiles already decoded are directly pasted, only the others need to be fetched and decoded
+		if useCache:
+			missing = []
+			for tile in tiles:
+				col, row, z = tile
+				img = self.imgCache.get(self.getMemKey(laykey, col, row, z, toDstGrid))
+				if img is None:
+					missing.append(tile)
+				else:
+					posx = (col - firstCol) * tileSize
+					posy = abs((row - firstRow)) * tileSize
+					mosaic.paste(img, (posx, posy))
+			if onUpdate is not None and progressive and len(missing) < len(tiles):
+				onUpdate(geoimg)
+			tiles = missing
+
+		#Display the tiles to fetch with their lower zoom ancestors, they will be replaced as soon as they arrive
+		if useCache and allowEmptyTile and tiles and self.PLACEHOLDER_LEVELS > 0:
+			placeholders.update(self.getPlaceholders(laykey, tiles, toDstGrid))
+			for (col, row, z), img in placeholders.items():
+				mosaic.paste(img, ((col - firstCol) * tileSize, abs(row - firstRow) * tileSize))
+			if onUpdate is not None and progressive and placeholders:
+				onUpdate(geoimg)
+
+		if onUpdate is not None and not progressive:
+			if placeholders or len(tiles) < len(cols) * len(rows):
+				onUpdate(geoimg)
+			onUpdate = None
+
+		if onUpdate is not None:
+			#progressive mode, tiles are pasted as soon as they arrive
+			self.getTiles(laykey, tiles, [], toDstGrid, useCache, nbThread, cpt, callback=paste)
+		else:
+			tiles = self.getTiles(laykey, tiles, [], toDstGrid, useCache, nbThread, cpt)
+			for tile in tiles:
+				if not self.isAlive(generation):
+					return None
+				paste(*tile)
+				if progress['failed']:
+					return None
 
-		geoimg = GeoImage(mosaic, (xmin, ymax), res)
+		if progress['failed'] or not self.isAlive(generation):
+			return None
 
 		if outCRS is not None and outCRS != tm.CRS:
 			geoimg = reprojImg(tm.CRS, outCRS, geoimg)
 
-		if self.running:
+		if self.isAlive(generation):
 			return geoimg
 		else:
 			return None
@@ -1074,9 +3222,278 @@ class MapService():
 
 
 
+class ReprojContext():
+	'''
+	Keep the GDAL objects needed to reproject images from crs1 to crs2
+	Spatial references are built once for each CRS pair and MEM datasets of at most MAX_CACHED_PIXELS
+	are reused between calls of a thread as long as the image size does not change
+	Use ReprojContext.get(crs1, crs2) to share the context of a given CRS pair
+	Datasets kept by a thread are released when it ends (see releaseDatasets)
+	'''
+
+	contexts = {}
+	contextsLock = threading.Lock()
+
+	#GDAL resampling algorithms by RESAMP_ALG key
+	ALGS = {'NN':'GRA_NearestNeighbour', 'BL':'GRA_Bilinear', 'CB':'GRA_Cubic', 'CBS':'GRA_CubicSpline', 'LCZ':'GRA_Lanczos'}
+	WARP_ALGS = {'NN':'near', 'BL':'bilinear', 'CB':'cubic', 'CBS':'cubicspline', 'LCZ':'lanczos'}
+
+	# Working memory limit in MB (0 = gdal default)
+	MEM_LIMIT = 0
+	# Error in pixels (0 will use the exact transformer)
+	THRESHOLD = 0.25
+	# Use gdal.Warp (gdal >= 2.1) and split the warp between all cpus
+	USE_WARP = True
+	MULTITHREAD = True
+	# Bigger datasets are not kept between calls
+	MAX_CACHED_PIXELS = 1024 * 1024
+
+	@classmethod
+	def get(cls, crs1, crs2):
+		key = (crs1, crs2)
+		with cls.contextsLock:
+			ctx = cls.contexts.get(key)
+			if ctx is None:
+				ctx = cls.contexts[key] = cls(crs1, crs2)
+		return ctx
+
+	def __init__(self, crs1, crs2):
+		if not GDAL:
+			raise NotImplementedError
+		self.crs1 = crs1
+		self.crs2 = crs2
+		self.wkt1 = CRS(crs1).getOgrSpatialRef().ExportToWkt()
+		self.wkt2 = CRS(crs2).getOgrSpatialRef().ExportToWkt()
+		self.driver = gdal.GetDriverByName('MEM')
+		#gdal datasets can't be shared between threads, so each thread keep its own
+		self.datasets = {} #thread ident >> {slot : ((w, h, nbBands), dataset)}
+		self.lock = threading.Lock()
+		self.warpOptions = {} #settings key >> gdal.WarpOptions, see getWarpOptions
+
+	@property
+	def alg(self):
+		return getattr(gdal, self.ALGS.get(RESAMP_ALG, 'GRA_NearestNeighbour'))
+
+	def getWarpOptions(self):
+		'''
+		Return gdal.Warp options, they are only rebuilt when a setting changed
+		The map service workers pool already run one warp per worker, so a warp called from a worker use a single thread
+		instead of splitting itself between all cpus (that would start pool size x cpus threads)
+		'''
+		multithread = self.MULTITHREAD and not MapService.workers.inWorker
+		key = (RESAMP_ALG, self.THRESHOLD, self.MEM_LIMIT, multithread)
+		opts = self.warpOptions.get(key)
+		if opts is not None:
+			return opts
+		opts = gdal.WarpOptions(
+			resampleAlg = self.WARP_ALGS.get(RESAMP_ALG, 'near'),
+			errorThreshold = self.THRESHOLD,
+			warpMemoryLimit = self.MEM_LIMIT or None, #MB
+			multithread = multithread,
+			warpOptions = ['NUM_THREADS=ALL_CPUS'] if multithread else None
+			)
+		self.warpOptions[key] = opts
+		return opts
+
+	@classmethod
+	def releaseDatasets(cls, thread=None):
+		'''Release the datasets kept by a thread (ident) or by all threads if None'''
+		with cls.contextsLock:
+			contexts = list(cls.contexts.values())
+		for ctx in contexts:
+			with ctx.lock:
+				if thread is None:
+					ctx.datasets = {}
+				else:
+					ctx.datasets.pop(thread, None)
+
+	def getDataset(self, slot, w, h, nbBands, wkt):
+		'''Return the thread's MEM dataset for this slot, it's only recreated if its size changed'''
+		if w * h > self.MAX_CACHED_PIXELS:
+			ds = self.driver.Create('', w, h, nbBands, gdal.GDT_Byte)
+			ds.SetProjection(wkt)
+			return ds
+		with self.lock:
+			slots = self.datasets.get(threading.get_ident())
+			if slots is None:
+				#new thread, forget the datasets of the threads that have ended
+				alive = set([t.ident for t in threading.enumerate()])
+				self.datasets = {k:v for k, v in self.datasets.items() if k in alive}
+				slots = self.datasets[threading.get_ident()] = {}
+		cached = slots.get(slot)
+		if cached is not None and cached[0] == (w, h, nbBands):
+			return cached[1]
+		ds = self.driver.Create('', w, h, nbBands, gdal.GDT_Byte)
+		ds.SetProjection(wkt)
+		slots[slot] = ((w, h, nbBands), ds)
+		return ds
+
+	def warp(self, img, src_ul, src_res, dst_ul, dst_size, dst_res):
+		'''
+		Reproject a PIL image and return the warped PIL image
+		Pixels are exchanged with gdal in a single pixel interleaved buffer for all bands
+		'''
+		if img.mode not in ('RGBA', 'RGB', 'L'):
+			img = img.convert('RGBA')
+		nbBands = len(img.getbands())
+		bands = list(range(1, nbBands+1))
+
+		img_w, img_h = img.size
+		ds1 = self.getDataset('src', img_w, img_h, nbBands, self.wkt1)
+		ds1.SetGeoTransform( (src_ul[0], src_res, 0, src_ul[1], 0, -src_res) )
+		ds1.WriteRaster(0, 0, img_w, img_h, img.tobytes(), img_w, img_h, gdal.GDT_Byte, bands,
+			buf_pixel_space=nbBands, buf_line_space=img_w*nbBands, buf_band_space=1)
+
+		img_w, img_h = dst_size
+		ds2 = self.getDataset('dst', img_w, img_h, nbBands, self.wkt2)
+		ds2.SetGeoTransform( (dst_ul[0], dst_res, 0, dst_ul[1], 0, -dst_res) )
+		#the dataset may be reused, clear previous data outside the source footprint
+		for b in bands:
+			ds2.GetRasterBand(b).Fill(0)
+
+		if self.USE_WARP and hasattr(gdal, 'Warp'):
+			gdal.Warp(ds2, ds1, options=self.getWarpOptions())
+		else:
+			gdal.ReprojectImage(ds1, ds2, self.wkt1, self.wkt2, self.alg, self.MEM_LIMIT * 1024**2, self.THRESHOLD)
+
+		data = ds2.ReadRaster(0, 0, img_w, img_h, img_w, img_h, gdal.GDT_Byte, bands,
+			buf_pixel_space=nbBands, buf_line_space=img_w*nbBands, buf_band_space=1)
+		return Image.frombuffer(img.mode, (img_w, img_h), data, 'raw', img.mode, 0, 1)
+
+
+class NumpyWarper():
+	'''
+	Pure numpy raster warper between Web Mercator and WGS84, used when GDAL isn't available
+	The inverse transformation gives for each destination pixel its position in the source image,
+	it can be computed exactly or on a coarse grid then linearly interpolated. Source image is
+	then sampled with nearest, bilinear or cubic kernel according to RESAMP_ALG setting
+	'''
+
+	# step in pixels of the coarse grid where exact transformation is computed (0 = every pixels)
+	GRID_STEP = 16
+	# number of destination rows processed at once, limits temporary arrays memory
+	CHUNK_ROWS = 256
+
+	@staticmethod
+	def supports(crs1, crs2):
+		crs1, crs2 = CRS(crs1), CRS(crs2)
+		return all(crs.isWM or crs.isWGS84 for crs in (crs1, crs2))
+
+	def __init__(self, crs1, crs2):
+		if not self.supports(crs1, crs2):
+			raise NotImplementedError
+		self.crs1 = CRS(crs1)
+		self.crs2 = CRS(crs2)
+
+	def transform(self, xs, ys):
+		'''Inverse transformation : destination crs coords arrays >> source crs coords arrays'''
+		k = GRS80.perimeter / 360
+		if self.crs2.isWGS84 and self.crs1.isWM:
+			lat = np.clip(ys, -85.05112878, 85.05112878)
+			return xs * k, np.degrees(np.log(np.tan(np.radians(90 + lat) / 2))) * k
+		elif self.crs2.isWM and self.crs1.isWGS84:
+			return xs / k, np.degrees(2 * np.arctan(np.exp(np.radians(ys / k))) - np.pi / 2)
+		return xs, ys
+
+	def srcPixels(self, cols, rows, dst_ul, dst_res, src_ul, src_res):
+		'''Return the (fractional) source pixel coords of destination pixels centers at these cols and rows'''
+		xs = dst_ul[0] + (cols + 0.5) * dst_res
+		ys = dst_ul[1] - (rows + 0.5) * dst_res
+		xs, ys = self.transform(*np.meshgrid(xs, ys))
+		return (xs - src_ul[0]) / src_res - 0.5, (src_ul[1] - ys) / src_res - 0.5
+
+	def coarsePixels(self, cols, rows, dst_ul, dst_res, src_ul, src_res):
+		'''Same as srcPixels but only compute the transformation on a coarse grid and interpolate between its nodes'''
+		step = self.GRID_STEP
+		#grid nodes can be outside the image, they just have to surround all pixels
+		gx = np.arange(cols[0] - cols[0] % step, cols[-1] + step, step)
+		gy = np.arange(rows[0] - rows[0] % step, rows[-1] + step, step)
+		if len(gx) < 2 or len(gy) < 2:
+			return self.srcPixels(cols, rows, dst_ul, dst_res, src_ul, src_res)
+		#exact transformation at grid nodes
+		px, py = self.srcPixels(gx, gy, dst_ul, dst_res, src_ul, src_res)
+		#bilinear interpolation of grid nodes values
+		i = np.clip(np.searchsorted(gx, cols, 'right') - 1, 0, len(gx)-2)
+		j = np.clip(np.searchsorted(gy, rows, 'right') - 1, 0, len(gy)-2)
+		fx = ((cols - gx[i]) / (gx[i+1] - gx[i]))[np.newaxis, :]
+		fy = ((rows - gy[j]) / (gy[j+1] - gy[j]))[:, np.newaxis]
+		def interp(grid):
+			#interpolate along grid rows first, so only this small array is upsampled along y
+			grid = grid[:, i] * (1 - fx) + grid[:, i+1] * fx
+			return grid[j] * (1 - fy) + grid[j+1] * fy
+		return interp(px), interp(py)
+
+	@staticmethod
+	def cubicWeights(t):
+		'''Keys cubic convolution kernel (a=-0.5) weights of the 4 neighbors for fractional offsets t'''
+		t2, t3 = t * t, t * t * t
+		return [
+			-0.5*t3 + t2 - 0.5*t,
+			1.5*t3 - 2.5*t2 + 1,
+			-1.5*t3 + 2*t2 + 0.5*t,
+			0.5*t3 - 0.5*t2
+			]
+
+	def sample(self, data, px, py):
+		'''Resample source array (h, w, bands) at fractional pixel coords px, py'''
+		src_h, src_w, nbBands = data.shape
+		inside = (px >= -0.5) & (px <= src_w - 0.5) & (py >= -0.5) & (py <= src_h - 0.5)
+		#gather pixels with flat indices, it's faster than 2d fancy indexing
+		flat = data.reshape(-1, nbBands)
+
+		if RESAMP_ALG == 'NN':
+			ix = np.clip(np.floor(px + 0.5).astype(np.intp), 0, src_w-1)
+			iy = np.clip(np.floor(py + 0.5).astype(np.intp), 0, src_h-1)
+			out = flat.take(iy * src_w + ix, axis=0)
+
+		else:
+			x0, y0 = np.floor(px), np.floor(py)
+			fx = (px - x0).astype(np.float32)[..., np.newaxis]
+			fy = (py - y0).astype(np.float32)[..., np.newaxis]
+			x0, y0 = x0.astype(np.intp), y0.astype(np.intp)
+			if RESAMP_ALG == 'BL':
+				offsets = [0, 1]
+				wx, wy = [1 - fx, fx], [1 - fy, fy]
+			else: #cubic kernel is also used for cubic spline and lanczos
+				offsets = [-1, 0, 1, 2]
+				wx, wy = self.cubicWeights(fx), self.cubicWeights(fy)
+			out = np.zeros(px.shape + (nbBands,), dtype=np.float32)
+			for n, dy in enumerate(offsets):
+				iy = np.clip(y0 + dy, 0, src_h-1) * src_w
+				for m, dx in enumerate(offsets):
+					ix = np.clip(x0 + dx, 0, src_w-1)
+					out += flat.take(iy + ix, axis=0) * (wx[m] * wy[n])
+			out = np.clip(out + 0.5, 0, 255).astype(np.uint8)
+
+		out[~inside] = 0
+		return out
+
+	def warp(self, img, src_ul, src_res, dst_ul, dst_size, dst_res):
+		'''Reproject a PIL image and return the warped PIL image'''
+		if img.mode not in ('RGBA', 'RGB', 'L'):
+			img = img.convert('RGBA')
+		data = np.asarray(img)
+		if data.ndim == 2:
+			data = data[..., np.newaxis]
+		w, h = dst_size
+		out = np.empty((h, w, data.shape[2]), dtype=np.uint8)
+		cols = np.arange(w)
+		for r in range(0, h, self.CHUNK_ROWS):
+			rows = np.arange(r, min(r + self.CHUNK_ROWS, h))
+			if self.GRID_STEP > 1:
+				px, py = self.coarsePixels(cols, rows, dst_ul, dst_res, src_ul, src_res)
+			else:
+				px, py = self.srcPixels(cols, rows, dst_ul, dst_res, src_ul, src_res)
+			out[rows[0]:rows[-1]+1] = self.sample(data, px, py)
+		if img.mode == 'L':
+			out = out[..., 0]
+		return Image.fromarray(out, img.mode)
+
+
 def reprojImg(crs1, crs2, geoimg, out_ul=None, out_size=None, out_res=None):
 	'''
 	Use GDAL Python binding to reproject an image
+	(or a numpy warper if GDAL isn't available, only between Web Mercator and WGS84)
 	crs1, crs2 >> epsg code
 	geoimg >> input GeoImage object (PIL image + georef infos)
 	out_ul >> output raster top left coords (same as input if None)
@@ -1084,38 +3501,19 @@ def reprojImg(crs1, crs2, geoimg, out_ul=None, out_size=None, out_res=None):
 	out_res >> output raster resolution (same as input if None)
 	'''
 
-	if not GDAL:
-		raise NotImplementedError
-
-	#Create an in memory gdal raster and write data to it (PIL > Numpy > GDAL)
-	data = np.asarray(geoimg.img)
-	img_h, img_w, nbBands = data.shape
-	ds1 = gdal.GetDriverByName('MEM').Create('', img_w, img_h, nbBands, gdal.GDT_Byte)
-	for bandIdx in range(nbBands):
-		bandArray = data[:,:,bandIdx]
-		ds1.GetRasterBand(bandIdx+1).WriteArray(bandArray)
-	"""
-	# Alternative : Use a virtual memory file to create gdal dataset from buffer
-	buff = io.BytesIO()
-	geoimg.img.save(buff, format='PNG')
-	vsipath = '/vsimem/mosaic'
-	gdal.FileFromMemBuffer(vsipath, buff.getvalue())
-	ds1 = gdal.Open(vsipath)
-	img_h, img_w = ds1.RasterXSize, ds1.RasterYSize
-	nbBands = ds1.RasterCount
-	"""
+	if GDAL:
+		#Spatial refs and gdal datasets are cached by the context of this crs pair
+		ctx = ReprojContext.get(crs1, crs2)
+	else:
+		ctx = NumpyWarper(crs1, crs2) #raise NotImplementedError if crs are not supported
 
-	#Assign georef infos
+	#Source georef infos
 	xmin, ymax = geoimg.ul
 	res = geoimg.res
-	geoTrans = (xmin, res, 0, ymax, 0, -res)
-	ds1.SetGeoTransform(geoTrans)
-	prj1 = CRS(crs1).getOgrSpatialRef()
-	wkt1 = prj1.ExportToWkt()
-	ds1.SetProjection(wkt1)
-
-	#Build destination dataset
-	# ds2 will be a template empty raster to reproject the data into
+	img_w, img_h = geoimg.img.size
+
+	#Compute destination georef
+	# the destination raster is a template empty raster to reproject the data into
 	# we can directly set its size, res and top left coord as expected
 	# reproject funtion will match the template (clip and resampling)
 
@@ -1150,41 +3548,118 @@ def reprojImg(crs1, crs2, geoimg, out_ul=None, out_size=None, out_res=None):
 		px_diag = math.sqrt(img_w**2 + img_h**2)
 		res = dst_diag / px_diag
 
-	ds2 = gdal.GetDriverByName('MEM').Create('', img_w, img_h, nbBands, gdal.GDT_Byte)
-	geoTrans = (xmin, res, 0, ymax, 0, -res)
-	ds2.SetGeoTransform(geoTrans)
-	prj2 = CRS(crs2).getOgrSpatialRef()
-	wkt2 = prj2.ExportToWkt()
-	ds2.SetProjection(wkt2)
-
 	#Perform the projection/resampling
-	# Resample algo
-	if RESAMP_ALG == 'NN' : alg = gdal.GRA_NearestNeighbour
-	elif RESAMP_ALG == 'BL' : alg = gdal.GRA_Bilinear
-	elif RESAMP_ALG == 'CB' : alg = gdal.GRA_Cubic
-	elif RESAMP_ALG == 'CBS' : alg = gdal.GRA_CubicSpline
-	elif RESAMP_ALG == 'LCZ' : alg = gdal.GRA_Lanczos
-	# Memory limit (0 = no limit)
-	memLimit = 0
-	# Error in pixels (0 will use the exact transformer)
-	threshold = 0.25
-	# Warp options (http://www.gdal.org/structGDALWarpOptions.html)
-	opt = ['NUM_THREADS=ALL_CPUS, SAMPLE_GRID=YES']
-	gdal.ReprojectImage( ds1, ds2, wkt1, wkt2, alg, memLimit, threshold)#, options=opt) #option parameter start with gdal 2.1
+	img = ctx.warp(geoimg.img, geoimg.ul, geoimg.res, (xmin, ymax), (img_w, img_h), res)
+
+	return GeoImage(img, (xmin, ymax), res)
 
-	#Convert to PIL image
-	data = ds2.ReadAsArray()
-	data = np.rollaxis(data, 0, 3) # because first axis is band index
-	img = Image.fromarray(data, 'RGBA')
 
-	#Close gdal datasets
-	ds1 = None
-	ds2 = None
 
-	return GeoImage(img, (xmin, ymax), res)
+####################
+
+class SeedReport():
+	'''Counters and throughput of a cache seeding run'''
+
+	def __init__(self):
+		self.nbTiles = 0 #tiles covering the area
+		self.nbCached = 0 #tiles skipped because already in cache
+		self.nbSeeded = 0 #tiles downloaded and stored
+		self.nbFailed = 0 #tiles that can't be downloaded
+		self.nbEmpty = 0 #tiles the map service doesn't have
+		self.nbBytes = 0
+		self.t0 = time.perf_counter()
+		self.t1 = None
+
+	@property
+	def nbDone(self):
+		return self.nbCached + self.nbSeeded + self.nbFailed + self.nbEmpty
+
+	@property
+	def elapsed(self):
+		t1 = self.t1 if self.t1 is not None else time.perf_counter()
+		return t1 - self.t0
+
+	@property
+	def tilesRate(self):
+		'''Downloaded tiles per second'''
+		return self.nbSeeded / self.elapsed if self.elapsed > 0 else 0
 
+	def __str__(self):
+		return '{}/{} tiles ({} cached, {} downloaded, {} empty, {} failed) - {:.1f} tiles/s, {:.1f} MB in {:.0f}s'.format(
+			self.nbDone, self.nbTiles, self.nbCached, self.nbSeeded, self.nbEmpty, self.nbFailed,
+			self.tilesRate, self.nbBytes / 1024**2, self.elapsed)
 
 
+def seedCache(cacheFolder, srckey, laykey, bbox, zmin, zmax, grdkey=None, bboxCRS=None, nbThread=8, rate=0, batchSize=1024, cancel=None, onProgress=None):
+	'''
+	Pre-populate the geopackage cache of a layer for an area and a range of zoom levels
+	Can be used without Blender ui, for example before going offline or before a render farm run
+	bbox >> (xmin, ymin, xmax, ymax) in bboxCRS (tile matrix crs if None)
+	grdkey >> tile matrix of the cache, source grid if None (tiles will be reprojected otherwise)
+	nbThread >> max number of concurrent downloads
+	rate >> max number of tiles requests per second (0 = unlimited)
+	batchSize >> number of tiles written in each transaction
+	Tiles already in cache are skipped, so an interrupted seeding just have to be restarted
+	Seeding stop if the optional cancel event is set, onProgress function receive the SeedReport after each batch
+	Return a SeedReport
+	'''
+	srv = MapService(srckey, cacheFolder, grdkey)
+	toDstGrid = srv.dstGridKey is not None
+	tm = srv.dstTms if toDstGrid else srv.srcTms
+	if bboxCRS is not None and CRS(bboxCRS).SRID != CRS(tm.CRS).SRID:
+		bbox = reprojBbox(bboxCRS, tm.CRS, bbox)
+	lay = srv.layers[laykey]
+	zmin, zmax = max(zmin, lay.zmin), min(zmax, lay.zmax)
+	cache = srv.getCache(laykey, toDstGrid)
+
+	#bounded concurrency through the threads engine, rate limited downloads
+	srv.fetchEngine = 'THREADS'
+	srv.rateLimiter = RateLimiter(rate)
+
+	report = SeedReport()
+	ranges = [(z, tm.getTilesRange(bbox, z)) for z in range(zmin, zmax+1)]
+	report.nbTiles = sum(len(cols) * len(rows) for z, (cols, rows) in ranges)
+
+	def batches():
+		'''Enumerate tiles by batches without building the full list'''
+		for z, (cols, rows) in ranges:
+			batch = []
+			for col in cols:
+				for row in rows:
+					batch.append( (col, row, z) )
+					if len(batch) == batchSize:
+						yield batch
+						batch = []
+			if batch:
+				yield batch
+
+	srv.running = True
+	try:
+		for batch in batches():
+			if cancel is not None and cancel.is_set():
+				break
+			existing = cache.listTiles(batch)
+			missing = [t for t in batch if t not in existing]
+			report.nbCached += len(existing)
+			if missing:
+				tiles = srv.getTiles(laykey, missing, [], toDstGrid, useCache=False, nbThread=nbThread, cpt=False, cancel=cancel, priority=WorkerPool.PREFETCH)
+				tiles = [t for t in tiles if t[3] is not None]
+				empty = [t for t in tiles if srv.isEmptyTile(t[3])]
+				tiles = [t for t in tiles if not srv.isEmptyTile(t[3])]
+				#one transaction per batch
+				cache.putTiles(srv.withValidators(laykey, tiles, toDstGrid))
+				report.nbSeeded += len(tiles)
+				report.nbEmpty += len(empty)
+				report.nbBytes += sum(len(t[3]) for t in tiles)
+				if cancel is None or not cancel.is_set():
+					report.nbFailed += len(missing) - len(tiles) - len(empty)
+			if onProgress is not None:
+				onProgress(report)
+	finally:
+		srv.running = False
+		report.t1 = time.perf_counter()
+
+	return report
 
 
 
@@ -1211,9 +3686,32 @@ class BaseMap(GeoScene):
 		#Get resampling algo preference and set the constant
 		global RESAMP_ALG
 		RESAMP_ALG = prefs.resamplAlg
+		ReprojContext.THRESHOLD = prefs.warpThreshold
+		ReprojContext.MEM_LIMIT = prefs.warpMemLimit
+		ReprojContext.MULTITHREAD = prefs.warpMultithread
+
+		#Set memory cache budget
+		MapService.memCache.resize(prefs.memCacheSize * 1024**2)
+		MapService.imgCache.resize(prefs.imgCacheSize * 1024**2)
+		MapService.httpPool.configure(prefs.httpPoolSize, prefs.httpMaxPerHost)
+		MapService.asyncFetcher.configure(prefs.asyncConcurrency, prefs.httpMaxPerHost)
+		MapService.janitor.configure(folder, prefs.cacheQuota, prefs.folderQuota)
+		GeoPackage.DEDUP = prefs.dedupCache
+		MapService.OFFLINE = prefs.offline
+
+		#Progressive display of the mosaic while tiles are downloading
+		self.progressive = prefs.progressive
+		#last mosaic not yet displayed (generation, GeoImage, final), set by request threads and consumed by refresh()
+		self.preview = None
+		self.previewLock = threading.Lock()
+
+		#Prefetch options
+		self.prefetchRing = prefs.prefetchRing
+		self.prefetchZoom = prefs.prefetchZoom
 
 		#Init MapService class
 		self.srv = MapService(srckey, folder)
+		self.srv.fetchEngine = prefs.fetchEngine
 
 		#Set destination tile matrix
 		if grdkey is None:
@@ -1237,6 +3735,11 @@ class BaseMap(GeoScene):
 
 		#Set path to tiles mosaic used as background image in Blender
 		self.imgPath = folder + srckey + '_' + laykey + '_' + grdkey + ".png"
+		#or directly push the mosaic pixels to a generated image
+		self.saveMosaic = prefs.saveMosaic
+		self.imgName = srckey + '_' + laykey + '_' + grdkey
+		self.mosaic = None #GeoImage currently displayed
+		self.pushedMosaic = None #last mosaic pushed to bpy image
 
 		#Get layer def obj
 		self.layer = self.srv.layers[laykey]
@@ -1248,41 +3751,144 @@ class BaseMap(GeoScene):
 
 		#Thread attributes
 		self.thread = None
+		self.prefetchCancel = None #event used to cancel the prefetch thread
 		#Background image attributes
 		self.img = None #bpy image
+		self.pixels = None #float32 buffer of mosaic pixels, see pushPixels
 		self.bkg = None #bpy background
 		self.viewDstZ = None #view 3d z distance
 		#Store previous request
-		#TODO
+		self.lastRequest = None #(bbox, zoom, toDstGrid)
+		#Last complete mosaic in grid crs, its tiles are reused by next request at the same zoom level
+		self.lastMosaic = None #((zoom, toDstGrid), GeoImage)
 
 
 	def get(self):
 		'''Launch run() function in a new thread'''
 		self.stop()
 		self.srv.running = True
-		self.thread = threading.Thread(target=self.run)
+		self.thread = threading.Thread(target=self.run, args=(self.srv.generation,))
+		self.thread.setDaemon(True)
 		self.thread.start()
 
 	def stop(self):
-		'''Stop actual thread'''
-		if self.srv.running:
-			self.srv.running = False
-			self.thread.join()
+		'''
+		Cancel actual request without waiting for its thread, so the ui never wait for the network
+		Jobs of the request still queued are dropped and tiles in flight are ignored when they arrive
+		'''
+		self.cancelPrefetch()
+		self.srv.newGeneration()
+		self.srv.running = False
+		with self.previewLock:
+			self.preview = None
 
-	def run(self):
-		"""thread method"""
-		self.mosaic = self.request()
-		if self.srv.running and self.mosaic is not None:
+	def isCurrent(self, generation):
+		'''Check if a request is still the current one'''
+		return self.srv.isAlive(generation)
+
+	def run(self, generation):
+		"""
+		thread method
+		The final mosaic is not placed here but handed to refresh(), so bpy is only updated from Blender main thread
+		"""
+		mosaic = self.request(generation)
+		if not self.isCurrent(generation):
+			#a newer request has been launched or the map has been stopped
+			return
+		if mosaic is not None and self.saveMosaic and mosaic is not self.mosaic:
 			#save image
+			mosaic.save(self.imgPath)
+		with self.previewLock:
+			if not self.isCurrent(generation):
+				return
+			#replace any partial mosaic still pending
+			self.preview = (generation, mosaic, True)
+		#Warm the cache with the tiles likely to be requested next
+		self.prefetch()
+
+	def prefetch(self):
+		'''Launch prefetchRun() in a new low priority thread, it will be cancelled by the next request'''
+		if self.lastRequest is None or (self.prefetchRing == 0 and not self.prefetchZoom):
+			return
+		self.cancelPrefetch()
+		self.prefetchCancel = threading.Event()
+		t = threading.Thread(target=self.prefetchRun, args=(self.prefetchCancel,))
+		t.setDaemon(True)
+		t.start()
+
+	def cancelPrefetch(self):
+		if self.prefetchCancel is not None:
+			self.prefetchCancel.set()
+			self.prefetchCancel = None
+
+	def prefetchRun(self, cancel, delay=0.5, nbThread=2):
+		"""
+		thread method, fetch the tiles around the last request and at adjacent zoom levels
+		Tiles are only put in memory and cache database, nothing is displayed
+		"""
+		#wait the viewer to be idle
+		if cancel.wait(delay):
+			return
+		bbox, zoom, toDstGrid = self.lastRequest
+		tm = self.tm
+		zmin = max(self.layer.zmin, 0)
+		zmax = min(self.layer.zmax, tm.nbLevels - 1)
+
+		#ring of tiles around the viewport
+		jobs = []
+		if self.prefetchRing > 0:
+			visible = set(tm.getTilesList(bbox, zoom))
+			jobs.append( [t for t in tm.getTilesList(bbox, zoom, margin=self.prefetchRing) if t not in visible] )
+		#same viewport at previous and next zoom levels
+		if self.prefetchZoom:
+			if zoom - 1 >= zmin:
+				jobs.append( tm.getTilesList(bbox, zoom - 1) )
+			if zoom + 1 <= zmax:
+				jobs.append( tm.getTilesList(bbox, zoom + 1) )
+
+		for tiles in jobs:
+			if cancel.is_set():
+				return
+			if tiles:
+				self.srv.getTiles(self.laykey, tiles, [], toDstGrid, useCache=True, nbThread=nbThread, cpt=False, cancel=cancel, priority=WorkerPool.PREFETCH)
+
+	def update(self, geoimg, generation):
+		'''Receive a partial mosaic from a request (called from worker threads)'''
+		if not self.isCurrent(generation):
+			return
+		geoimg = GeoImage(geoimg.img.copy(), geoimg.ul, geoimg.res)
+		with self.previewLock:
+			#a late partial must never overwrite the final mosaic of its request
+			if self.isCurrent(generation) and (self.preview is None or not self.preview[2]):
+				self.preview = (generation, geoimg, False)
+
+	def refresh(self):
+		'''Display the last partial or final mosaic if any, must be called from Blender main thread'''
+		with self.previewLock:
+			preview, self.preview = self.preview, None
+		if preview is None or not self.isCurrent(preview[0]):
+			return
+		generation, mosaic, final = preview
+		if mosaic is None:
+			return
+		self.mosaic = mosaic
+		if self.saveMosaic and not final:
 			self.mosaic.save(self.imgPath)
-		if self.srv.running:
-			#Place background image
-			self.place()
+		self.place()
 
 	def progress(self):
 		'''Report thread download progress'''
 		return self.srv.cptTiles, self.srv.nbTiles
 
+	def getViewCenter(self):
+		'''Return view3d center coords in map grid crs'''
+		dx, dy, dz = self.reg3d.view_location
+		x = self.crsx + (dx * self.scale)
+		y = self.crsy + (dy * self.scale)
+		if self.crs != self.tm.CRS:
+			x, y = reprojPt(self.crs, self.tm.CRS, x, y)
+		return x, y
+
 	def view3dToProj(self, dx, dy):
 		'''Convert view3d coords to crs coords'''
 		x = self.crsx + dx
@@ -1297,7 +3903,7 @@ class BaseMap(GeoScene):
 				obj.location.x -= dx
 				obj.location.y -= dy
 
-	def request(self):
+	def request(self, generation):
 		'''Request map service to build a mosaic of required tiles to cover view3d area'''
 		#Get area dimension
 		#w, h = self.area.width, self.area.height
@@ -1318,15 +3924,33 @@ class BaseMap(GeoScene):
 		if self.crs != self.tm.CRS:
 			bbox = reprojBbox(self.crs, self.tm.CRS, bbox)
 
-		#Stop thread if the request is same as previous
-		#TODO
+		#tiles are requested center first
+		self.srv.setViewCenter(*self.getViewCenter())
 
 		if self.srv.srcGridKey == self.grdkey:
 			toDstGrid = False
 		else:
 			toDstGrid = True
 
-		mosaic = self.srv.getImage(self.laykey, bbox, self.zoom, toDstGrid, outCRS=self.crs)
+		self.lastRequest = (bbox, self.zoom, toDstGrid)
+
+		#without progressive display, only a first frame with the cached tiles and placeholders is shown
+		onUpdate = lambda geoimg: self.update(geoimg, generation)
+
+		#On pan at the same zoom level the previous mosaic is shifted and only the new tiles are requested,
+		#if the view still cover the same tiles the previous mosaic is returned as is
+		#(not available if the mosaic must be reprojected to scene crs)
+		key = (self.zoom, toDstGrid)
+		base = None
+		if self.lastMosaic is not None and self.lastMosaic[0] == key:
+			base = self.lastMosaic[1]
+
+		if self.crs == self.tm.CRS:
+			mosaic = self.srv.getImage(self.laykey, bbox, self.zoom, toDstGrid, onUpdate=onUpdate, base=base, progressive=self.progressive)
+			if mosaic is not None:
+				self.lastMosaic = (key, mosaic)
+		else:
+			mosaic = self.srv.getImage(self.laykey, bbox, self.zoom, toDstGrid, outCRS=self.crs, onUpdate=onUpdate, progressive=self.progressive)
 
 		return mosaic
 
@@ -1334,11 +3958,15 @@ class BaseMap(GeoScene):
 	def place(self):
 		'''Set map as background image'''
 
-		#Get or load bpy image
-		try:
-			self.img = [img for img in bpy.data.images if img.filepath == self.imgPath][0]
-		except:
-			self.img = bpy.data.images.load(self.imgPath)
+		if self.saveMosaic:
+			#Get or load bpy image
+			try:
+				self.img = [img for img in bpy.data.images if img.filepath == self.imgPath][0]
+			except:
+				self.img = bpy.data.images.load(self.imgPath)
+		else:
+			#Get or create bpy image and directly push mosaic pixels
+			self.pushPixels()
 
 		#Activate view3d background
 		self.view3d.show_background_images = True
@@ -1350,7 +3978,7 @@ class BaseMap(GeoScene):
 		#Get or load background image
 		bkgs = [bkg for bkg in self.view3d.background_images if bkg.image is not None]
 		try:
-			self.bkg = [bkg for bkg in bkgs if bkg.image.filepath == self.imgPath][0]
+			self.bkg = [bkg for bkg in bkgs if bkg.image == self.img][0]
 		except:
 			self.bkg = self.view3d.background_images.new()
 			self.bkg.image = self.img
@@ -1386,7 +4014,42 @@ class BaseMap(GeoScene):
 		self.viewDstZ = dst
 
 		#Update image drawing
-		self.bkg.image.reload()
+		if self.saveMosaic:
+			self.bkg.image.reload()
+
+
+	def pushPixels(self):
+		'''
+		Copy the mosaic to a generated bpy image without png encoding nor disk round trip
+		Pixels are converted in a preallocated float32 buffer and then pushed to the image in a single foreach_set call
+		Must be called from Blender main thread only (see refresh())
+		'''
+		if self.mosaic is self.pushedMosaic:
+			return
+		img = self.mosaic.img
+		if img.mode != 'RGBA':
+			img = img.convert('RGBA')
+		w, h = img.size
+
+		#Get or create bpy image
+		self.img = bpy.data.images.get(self.imgName)
+		if self.img is None:
+			self.img = bpy.data.images.new(self.imgName, w, h, alpha=True)
+		elif tuple(self.img.size) != (w, h):
+			self.img.scale(w, h)
+
+		#The buffer is reused until the mosaic size changes, it's safe since only the main thread use it
+		if self.pixels is None or self.pixels.shape != (h, w, 4):
+			self.pixels = np.empty((h, w, 4), dtype=np.float32)
+		#Blender image rows start from bottom
+		np.multiply(np.asarray(img)[::-1], 1/255, out=self.pixels)
+		pixels = self.pixels.ravel()
+		try:
+			self.img.pixels.foreach_set(pixels)
+		except AttributeError: #foreach_set is not available on bpy arrays with older Blender versions
+			self.img.pixels[:] = pixels
+		self.img.update()
+		self.pushedMosaic = self.mosaic
 
 
 
@@ -1430,6 +4093,12 @@ def drawInfosText(self, context):
 	blf.position(font_id, cx-45, 90, 0)
 	if self.nbTotal > 0:
 		blf.draw(font_id, '(Downloading... ' + str(self.nb)+'/'+str(self.nbTotal) + ')')
+	# network status
+	blf.position(font_id, cx-45, 110, 0)
+	if MapService.OFFLINE:
+		blf.draw(font_id, 'Cache only (C to go online)')
+	elif MapService.breaker.nbOpen > 0:
+		blf.draw(font_id, 'Network unreachable, cache only')
 	# zoom and scale values
 	blf.position(font_id, cx-50, 50, 0)
 	blf.draw(font_id, "Zoom " + str(zoom) + " - Scale 1:" + str(int(scale)))
@@ -1576,8 +4245,7 @@ class MAP_START(bpy.types.Operator):
 			layout.prop(self, 'lay', text='Layer')
 			col = layout.column()
 			if not GDAL:
-				col.enabled = False
-				col.label('(No raster reprojection support)')
+				col.label('(Only Web Mercator / WGS84 reprojection without GDAL)')
 			col.prop(self, 'grd', text='Tile matrix set')
 
 			#srcCRS = GRIDS[SOURCES[self.src]['grid']]['CRS']
@@ -1634,9 +4302,14 @@ class MAP_START(bpy.types.Operator):
 			#if not geoscn.hasCRS:
 				#geoscn.crs = grdCRS
 			#Check if raster reproj is needed
-			if geoscn.hasCRS and geoscn.crs != grdCRS and not GDAL:
-				self.report({'ERROR'}, "Please install gdal to enable raster reprojection support")
-				return {'FINISHED'}
+			srcCRS = GRIDS[SOURCES[self.src]['grid']]['CRS']
+			if not GDAL:
+				crs = [srcCRS]
+				if geoscn.hasCRS:
+					crs.append(geoscn.crs)
+				if any(c != grdCRS and not NumpyWarper.supports(c, grdCRS) for c in crs):
+					self.report({'ERROR'}, "Please install gdal to enable raster reprojection support")
+					return {'FINISHED'}
 
 		#Move scene origin to the researched place
 		if self.dialog == 'SEARCH':
@@ -1744,6 +4417,9 @@ class MAP_VIEWER(bpy.types.Operator):
 		if event.type == 'TIMER':
 			#report thread progression
 			self.nb, self.nbTotal = self.map.progress()
+			#display partial or final mosaic
+			if not self.inMove:
+				self.map.refresh()
 			return {'PASS_THROUGH'}
 
 
@@ -1884,6 +4560,8 @@ class MAP_VIEWER(bpy.types.Operator):
 				if event.ctrl or self.prefs.lockOrigin:
 					x, y, z = self.viewLoc
 					context.region_data.view_location = (dx+x, dy+y, z)
+					#the request is still running, follow the view with its pending tiles
+					self.map.srv.setViewCenter(*self.map.getViewCenter())
 				else:
 					ratio = self.map.img.size[0] / self.map.img.size[1]
 					self.map.bkg.offset_x = self.offset_x - dx
@@ -2060,6 +4738,13 @@ class MAP_VIEWER(bpy.types.Operator):
 			self.dialog = 'OPTIONS'
 			return {'FINISHED'}
 
+		#CACHE ONLY
+		if event.type == 'C' and event.value == 'PRESS':
+			prefs = context.user_preferences.addons[__package__].preferences
+			prefs.offline = MapService.OFFLINE = not MapService.OFFLINE
+			#going online again fill the tiles missing from cache
+			self.map.get()
+
 		#ZOOM BOX
 		if event.type == 'B' and event.value == 'PRESS':
 			self.map.stop()
@@ -2118,6 +4803,156 @@ class MAP_SEARCH(bpy.types.Operator):
 		return {'FINISHED'}
 
 
+####################################
+
+class MAP_SEED(bpy.types.Operator):
+
+	bl_idname = "view3d.map_seed"
+	bl_description = 'Download map tiles of an area into the cache database (ESC to cancel)'
+	bl_label = "Seed cache"
+	bl_options = {'REGISTER'}
+
+	check = MAP_START.check
+
+	src = EnumProperty(name = "Map", description = "Choose map service source", items = MAP_START.listSources)
+
+	grd = EnumProperty(name = "Grid", description = "Choose cache tiles matrix", items = MAP_START.listGrids)
+
+	lay = EnumProperty(name = "Layer", description = "Choose layer", items = MAP_START.listLayers)
+
+	extent = EnumProperty(
+			name = "Area",
+			description = "Area to seed",
+			items = [ ('OBJECTS', 'Selected objects', 'Bounding box of selected objects in scene crs'), ('BBOX', 'Bounding box', 'Custom bounding box') ]
+			)
+
+	xmin = FloatProperty(name="xmin")
+	ymin = FloatProperty(name="ymin")
+	xmax = FloatProperty(name="xmax")
+	ymax = FloatProperty(name="ymax")
+	bboxCRS = StringProperty(name="CRS", description="Crs of the bounding box coordinates", default='EPSG:4326')
+
+	zmin = IntProperty(name='Min zoom', min=0, max=25, default=0)
+	zmax = IntProperty(name='Max zoom', min=0, max=25, default=15)
+
+	nbThread = IntProperty(name='Threads', description='Max number of concurrent downloads', min=1, default=8)
+	rate = FloatProperty(name='Rate limit', description='Max number of tiles requests per second (0 = unlimited)', min=0, default=0)
+
+	def draw(self, context):
+		layout = self.layout
+		layout.prop(self, 'src', text='Source')
+		layout.prop(self, 'lay', text='Layer')
+		layout.prop(self, 'grd', text='Tile matrix set')
+		layout.prop(self, 'extent')
+		if self.extent == 'BBOX':
+			row = layout.row()
+			row.prop(self, 'xmin')
+			row.prop(self, 'ymin')
+			row = layout.row()
+			row.prop(self, 'xmax')
+			row.prop(self, 'ymax')
+			layout.prop(self, 'bboxCRS')
+		row = layout.row()
+		row.prop(self, 'zmin')
+		row.prop(self, 'zmax')
+		row = layout.row()
+		row.prop(self, 'nbThread')
+		row.prop(self, 'rate')
+
+	def invoke(self, context, event):
+		return context.window_manager.invoke_props_dialog(self)
+
+	def execute(self, context):
+		prefs = context.user_preferences.addons[__package__].preferences
+
+		#check cache folder
+		folder = prefs.cacheFolder
+		if folder == "" or not os.path.exists(folder):
+			self.report({'ERROR'}, "Please define a valid cache folder path")
+			return {'CANCELLED'}
+
+		if self.extent == 'OBJECTS':
+			geoscn = GeoScene(context.scene)
+			if not geoscn.isGeoref:
+				self.report({'ERROR'}, "Scene isn't georef")
+				return {'CANCELLED'}
+			pts = [obj.matrix_world * Vector(corner) for obj in context.selected_objects for corner in obj.bound_box]
+			if not pts:
+				self.report({'ERROR'}, "No selected objects")
+				return {'CANCELLED'}
+			#view3d coords to crs coords
+			xs = [geoscn.crsx + pt.x * geoscn.scale for pt in pts]
+			ys = [geoscn.crsy + pt.y * geoscn.scale for pt in pts]
+			bbox = (min(xs), min(ys), max(xs), max(ys))
+			bboxCRS = geoscn.crs
+		else:
+			bbox = (self.xmin, self.ymin, self.xmax, self.ymax)
+			bboxCRS = self.bboxCRS
+
+		#seed in a background thread, the modal loop report progress and listen ESC key
+		self.cancel = threading.Event()
+		self.progress = None
+		def onProgress(report):
+			self.progress = report
+		args = (folder, self.src, self.lay, bbox, self.zmin, self.zmax, self.grd, bboxCRS, self.nbThread, self.rate)
+		kwargs = {'cancel':self.cancel, 'onProgress':onProgress}
+		self.result = None
+		def seed():
+			self.result = seedCache(*args, **kwargs)
+		self.thread = threading.Thread(target=seed)
+		self.thread.setDaemon(True)
+		self.thread.start()
+
+		context.window_manager.modal_handler_add(self)
+		self.timer = context.window_manager.event_timer_add(0.5, context.window)
+		return {'RUNNING_MODAL'}
+
+	def modal(self, context, event):
+		if event.type == 'ESC':
+			self.cancel.set()
+
+		if event.type == 'TIMER':
+			if self.progress is not None:
+				context.area.header_text_set('Seeding ' + str(self.progress))
+			if not self.thread.is_alive():
+				context.window_manager.event_timer_remove(self.timer)
+				context.area.header_text_set()
+				if self.result is None:
+					self.report({'ERROR'}, "Seeding failed, check the console")
+					return {'CANCELLED'}
+				self.report({'INFO'}, 'Seeding done : ' + str(self.result))
+				print('Seeding done : ' + str(self.result))
+				return {'FINISHED'}
+
+		return {'PASS_THROUGH'}
+
+
+####################################
+
+class MAP_CACHE_MAINTAIN(bpy.types.Operator):
+
+	bl_idname = "view3d.map_cache_maintain"
+	bl_description = 'Run a maintenance task on every cache database of the cache folder, in background'
+	bl_label = "Cache maintenance"
+	bl_options = {'INTERNAL'}
+
+	task = EnumProperty(
+			name = "Task",
+			items = [ ('vacuum', 'Compact', 'Rebuild the databases to release their free space, slow on big caches'),
+			('dedup', 'Deduplicate', 'Convert the databases to the deduplicated layout, slow on big caches') ]
+			)
+
+	def execute(self, context):
+		prefs = context.user_preferences.addons[__package__].preferences
+		folder = prefs.cacheFolder
+		if folder == "" or not os.path.exists(folder):
+			self.report({'ERROR'}, "Please define a valid cache folder path")
+			return {'CANCELLED'}
+		MapService.janitor.maintain(folder, self.task)
+		self.report({'INFO'}, "Cache maintenance started in background")
+		return {'FINISHED'}
+
+
 ####################################
 
 class MAP_PREFS(AddonPreferences):
@@ -2146,14 +4981,119 @@ class MAP_PREFS(AddonPreferences):
 
 	resamplAlg = EnumProperty(
 		name = "Resampling method",
-		description = "Choose GDAL's resampling method used for reprojection",
+		description = "Choose the resampling method used for reprojection (without GDAL, cubic is also used for cubic spline and lanczos)",
 		items = [ ('NN', 'Nearest Neighboor', ''), ('BL', 'Bilinear', ''), ('CB', 'Cubic', ''), ('CBS', 'Cubic Spline', ''), ('LCZ', 'Lanczos', '') ]
 		)
 
+	warpThreshold = FloatProperty(
+		name = "Warp error threshold",
+		description = "Error threshold in pixels of the approximate reprojection transformer (0 to use the exact transformer)",
+		default = ReprojContext.THRESHOLD,
+		min = 0,
+		precision = 3
+		)
+
+	warpMemLimit = IntProperty(
+		name = "Warp memory (MB)",
+		description = "Working memory used by GDAL to warp a chunk of image (0 to use GDAL default)",
+		default = ReprojContext.MEM_LIMIT,
+		min = 0
+		)
+
+	warpMultithread = BoolProperty(name="Multithreaded warp", description='Split reprojection between all cpus', default=ReprojContext.MULTITHREAD)
+
+	cacheQuota = IntProperty(
+		name = "Cache quota (MB)",
+		description = "Max size of each cache database, least recently used tiles are evicted beyond (0 for unlimited)",
+		default = CacheJanitor.CACHE_QUOTA,
+		min = 0
+		)
+
+	folderQuota = IntProperty(
+		name = "Folder quota (MB)",
+		description = "Max size of the whole cache folder, least recently used tiles are evicted beyond (0 for unlimited)",
+		default = CacheJanitor.FOLDER_QUOTA,
+		min = 0
+		)
+
+	dedupCache = BoolProperty(name="Deduplicate tiles", description='New caches store identical tiles (ocean, no data...) only once', default=GeoPackage.DEDUP)
+
+	offline = BoolProperty(name="Cache only", description='Work offline, build maps from cached tiles only (toggle with C key in map viewer)', default=MapService.OFFLINE)
+
+	memCacheSize = IntProperty(
+		name = "Memory cache (MB)",
+		description = "Memory budget of the in memory tiles cache shared by all map services",
+		default = MapService.MEM_CACHE_SIZE,
+		min = 0
+		)
+
+	imgCacheSize = IntProperty(
+		name = "Decoded cache (MB)",
+		description = "Memory budget of the decoded tiles cache used to build mosaics",
+		default = MapService.IMG_CACHE_SIZE,
+		min = 0
+		)
+
+	httpPoolSize = IntProperty(
+		name = "Keep-alive connections",
+		description = "Max number of idle http connections kept open per host",
+		default = MapService.HTTP_POOL_SIZE,
+		min = 0
+		)
+
+	httpMaxPerHost = IntProperty(
+		name = "Max requests per host",
+		description = "Max number of concurrent http requests to the same host",
+		default = MapService.HTTP_MAX_PER_HOST,
+		min = 1
+		)
+
+	fetchEngine = EnumProperty(
+		name = "Fetch engine",
+		description = "Choose how missing tiles are downloaded",
+		items = [ ('THREADS', 'Threads', 'A shared pool of persistent worker threads'), ('ASYNC', 'Asyncio', 'A background asyncio event loop') ],
+		default = MapService.FETCH_ENGINE
+		)
+
+	saveMosaic = BoolProperty(name="Save mosaic", description='Write each mosaic as png in cache folder and load it from disk, instead of directly pushing pixels to Blender', default=False)
+
+	progressive = BoolProperty(name="Progressive display", description='Refresh the map while tiles are downloading', default=True)
+
+	prefetchRing = IntProperty(
+		name = "Prefetch ring",
+		description = "Number of tiles around the viewport to fetch in background when the map viewer is idle (0 to disable)",
+		default = 1,
+		min = 0,
+		max = 5
+		)
+
+	prefetchZoom = BoolProperty(name="Prefetch zoom levels", description='Fetch in background the viewport at previous and next zoom levels when the map viewer is idle', default=True)
+
+	asyncConcurrency = IntProperty(
+		name = "Async concurrency",
+		description = "Max number of tiles requests processed at the same time by the asyncio engine",
+		default = MapService.ASYNC_CONCURRENCY,
+		min = 1
+		)
+
 
 	def draw(self, context):
 		layout = self.layout
 		layout.prop(self, "cacheFolder")
+		row = layout.row()
+		row.prop(self, "cacheQuota")
+		row.prop(self, "folderQuota")
+		row.label('{} tiles evicted'.format(MapService.janitor.nbEvicted))
+		if MapService.janitor.task is None:
+			row.operator("view3d.map_cache_maintain", text='Compact caches').task = 'vacuum'
+		else:
+			row.label('Cache maintenance in progress...')
+		row = layout.row()
+		row.prop(self, "dedupCache")
+		row.label('Deduplication ratio {:.1f}'.format(MapService.janitor.dedupRatio))
+		if MapService.janitor.task is None:
+			row.operator("view3d.map_cache_maintain", text='Deduplicate caches').task = 'dedup'
+		row.prop(self, "offline")
 
 
 		row = layout.row()
@@ -2164,6 +5104,33 @@ class MAP_PREFS(AddonPreferences):
 
 		row = layout.row()
 		row.prop(self, "resamplAlg")
+		row.prop(self, "warpThreshold")
+		row.prop(self, "warpMemLimit")
+		row.prop(self, "warpMultithread")
+
+		row = layout.row()
+		row.prop(self, "memCacheSize")
+		row.prop(self, "imgCacheSize")
+		cache = MapService.memCache
+		row.label('{} tiles in memory, {}% hits'.format(len(cache), int(cache.hitRatio * 100)))
+		flights = MapService.singleFlight
+		row.label('{} of {} requests coalesced'.format(flights.nbCoalesced, flights.nbCalls))
+		revalidator = MapService.revalidator
+		row.label('{} stale tiles revalidated, {} updated'.format(revalidator.nbNotModified, revalidator.nbUpdated))
+
+		row = layout.row()
+		row.prop(self, "httpPoolSize")
+		row.prop(self, "httpMaxPerHost")
+
+		row = layout.row()
+		row.prop(self, "fetchEngine")
+		row.prop(self, "asyncConcurrency")
+
+		row = layout.row()
+		row.prop(self, "progressive")
+		row.prop(self, "saveMosaic")
+		row.prop(self, "prefetchRing")
+		row.prop(self, "prefetchZoom")
 
 
 
@@ -2205,3 +5172,4 @@ class MAP_PANEL(Panel):
 		row = layout.row(align=True)
 		row.operator("view3d.map_start")
 		row.operator("view3d.map_pref_show", icon='SCRIPTWIN', text='')
+		layout.operator("view3d.map_seed")
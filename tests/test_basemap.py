@@ -0,0 +1,971 @@
+# -*- coding:utf-8 -*-
+
+'''
+Run the basemaps module outside Blender, bpy and the other Blender modules are replaced by minimal stand-ins
+	python -m pytest tests
+'''
+
+import asyncio
+import io
+import math
+import os
+import sqlite3
+import sys
+import types
+import tempfile
+import threading
+import time
+import unittest
+import urllib.error
+import urllib.parse
+
+from PIL import Image
+import numpy as np
+
+
+class Any():
+	'''Stand-in for any Blender object, every attribute and call return another stand-in'''
+	def __getattr__(self, attr):
+		return Any()
+	def __call__(self, *args, **kwargs):
+		return Any()
+
+def prop(*args, **kwargs):
+	return None
+
+def stubBlender():
+	'''Register stand-ins of the Blender modules imported by the addons'''
+	if 'bpy' in sys.modules:
+		return
+	bpy = types.ModuleType('bpy')
+	bpy.data = bpy.context = bpy.ops = bpy.utils = bpy.app = Any()
+	bpy.types = types.ModuleType('bpy.types')
+	for name in ['Operator', 'Panel', 'AddonPreferences', 'SpaceView3D', 'PropertyGroup']:
+		setattr(bpy.types, name, type(name, (), {}))
+	bpy.props = types.ModuleType('bpy.props')
+	for name in ['StringProperty', 'IntProperty', 'FloatProperty', 'BoolProperty', 'EnumProperty',
+		'FloatVectorProperty', 'PointerProperty', 'CollectionProperty']:
+		setattr(bpy.props, name, prop)
+	bpy_extras = types.ModuleType('bpy_extras')
+	bpy_extras.view3d_utils = types.ModuleType('bpy_extras.view3d_utils')
+	bpy_extras.view3d_utils.region_2d_to_location_3d = prop
+	bpy_extras.view3d_utils.region_2d_to_vector_3d = prop
+	mathutils = types.ModuleType('mathutils')
+	mathutils.Vector = type('Vector', (tuple,), {})
+	modules = {'bpy':bpy, 'bpy.types':bpy.types, 'bpy.props':bpy.props, 'bpy_extras':bpy_extras,
+		'bpy_extras.view3d_utils':bpy_extras.view3d_utils, 'mathutils':mathutils}
+	for name in ['addon_utils', 'bgl', 'blf']:
+		modules[name] = types.ModuleType(name)
+	sys.modules.update(modules)
+
+stubBlender()
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from basemaps import mapviewer, benchmarks
+from basemaps.mapviewer import BaseMap, GeoImage, MapService, CoverageTree, GeoPackage, TileMatrix, CacheJanitor, AsyncTileFetcher, NumpyWarper, LRUCache, RateLimiter, CircuitBreaker, WorkerPool, TileRevalidator, HTTPConnectionPool, ReprojContext
+from basemaps.servicesDefs import GRIDS
+from geoscene.proj import reprojPt
+
+
+class Namespace():
+	def __init__(self, **kwargs):
+		self.__dict__.update(kwargs)
+
+class Scene(dict):
+	'''Blender scene custom properties behave like a dict'''
+	pass
+
+
+def fakeContext(folder):
+	prefs = Namespace(cacheFolder=folder, resamplAlg='BL', warpThreshold=0.125, warpMemLimit=0, warpMultithread=True,
+		memCacheSize=16, imgCacheSize=16, httpPoolSize=2, httpMaxPerHost=2, asyncConcurrency=4,
+		cacheQuota=0, folderQuota=0, dedupCache=False, offline=True, progressive=False,
+		prefetchRing=0, prefetchZoom=False, fetchEngine='THREADS', saveMosaic=False)
+	region = Namespace(type='WINDOW', width=400, height=300)
+	view3d = Namespace(region_3d=Namespace(view_location=(0, 0, 0), view_distance=10))
+	area = Namespace(regions=[region], spaces=Namespace(active=view3d))
+	addons = {mapviewer.__package__: Namespace(preferences=prefs)}
+	return Namespace(scene=Scene(), area=area, user_preferences=Namespace(addons=addons))
+
+
+class TestBaseMap(unittest.TestCase):
+
+	def setUp(self):
+		folder = tempfile.mkdtemp() + os.sep
+		self.map = BaseMap(fakeContext(folder), 'OSM', 'MAPNIK')
+		self.placed = []
+		self.map.place = lambda: self.placed.append(self.map.mosaic)
+		self.mosaic = GeoImage(Image.new('RGBA', (256, 256)), (0, 0), 1)
+		self.map.srv.getImage = lambda *args, **kwargs: self.mosaic
+
+	def tearDown(self):
+		MapService.OFFLINE = False
+
+	def testRunFreshMap(self):
+		'''The first request of a new map must place its mosaic'''
+		self.map.srv.running = True
+		self.map.run(self.map.srv.generation)
+		#nothing is placed until the main thread refresh the map
+		self.assertEqual(self.placed, [])
+		self.map.refresh()
+		self.assertIs(self.map.mosaic, self.mosaic)
+		self.assertEqual(self.placed, [self.mosaic])
+		self.map.refresh()
+		self.assertEqual(self.placed, [self.mosaic])
+
+	def testLatePartialMosaic(self):
+		'''A partial mosaic received after the final one must never be displayed'''
+		self.map.srv.running = True
+		generation = self.map.srv.generation
+		partial = GeoImage(Image.new('RGBA', (256, 256)), (0, 0), 1)
+		self.map.update(partial, generation)
+		self.map.run(generation)
+		self.map.update(partial, generation)
+		self.map.refresh()
+		self.assertEqual(self.placed, [self.mosaic])
+
+	def testRunCancelled(self):
+		'''A request cancelled by a newer one must not place its mosaic'''
+		self.map.srv.running = True
+		generation = self.map.srv.generation
+		self.map.srv.newGeneration()
+		self.map.run(generation)
+		self.map.refresh()
+		self.assertIsNone(self.map.mosaic)
+		self.assertEqual(self.placed, [])
+
+	def testStopWithoutWaiting(self):
+		'''Stopping a request never wait for the network, and its late result is dropped'''
+		network = threading.Event()
+		def getImage(*args, **kwargs):
+			network.wait(5)
+			return self.mosaic
+		self.map.srv.getImage = getImage
+		self.map.get()
+		thread = self.map.thread
+		t0 = time.time()
+		self.map.stop()
+		self.assertLess(time.time() - t0, 0.5)
+		self.assertTrue(thread.is_alive())
+		network.set()
+		thread.join(5)
+		self.map.refresh()
+		self.assertIsNone(self.map.mosaic)
+		self.assertEqual(self.placed, [])
+
+	def testPrefetch(self):
+		'''The ring around the viewport and the adjacent zoom levels are fetched at low priority, until cancelled'''
+		tm = self.map.tm
+		xmin, ymin, xmax, ymax = tm.getTileBbox(3, 3, 3)
+		e = (xmax - xmin) / 100
+		self.map.lastRequest = ((xmin + e, ymin + e, xmax - e, ymax - e), 3, False)
+		self.map.prefetchRing, self.map.prefetchZoom = 1, True
+		jobs = []
+		self.map.srv.getTiles = lambda laykey, tiles, *args, **kwargs: jobs.append( (tiles, kwargs['priority']) )
+		self.map.prefetchRun(threading.Event(), delay=0)
+		self.assertEqual([len(tiles) for tiles, priority in jobs], [8, 1, 4])
+		self.assertNotIn( (3, 3, 3), jobs[0][0])
+		self.assertEqual([tiles[0][2] for tiles, priority in jobs], [3, 2, 4])
+		self.assertEqual(set(priority for tiles, priority in jobs), {WorkerPool.PREFETCH})
+		#a new request cancel the prefetch
+		jobs = []
+		cancel = threading.Event()
+		cancel.set()
+		self.map.prefetchRun(cancel, delay=0)
+		self.assertEqual(jobs, [])
+
+
+def pngTile(color='red'):
+	b = io.BytesIO()
+	Image.new('RGBA', (256, 256), color).save(b, format='PNG')
+	return b.getvalue()
+
+
+class TestMetatiles(unittest.TestCase):
+
+	def setUp(self):
+		self.srv = MapService('OSM', tempfile.mkdtemp() + os.sep)
+		self.srv.running = True
+		data = pngTile()
+		self.srv.requestTile = lambda *args, **kwargs: (200, data, None, None)
+		self.srv.setDstGrid('WGS84')
+
+	def buildAll(self, zoom):
+		tm = self.srv.dstTms
+		tiles = tm.getTilesList(tm.globalbbox, zoom)
+		return set( (col, row) for col, row, z, data in self.srv.getTiles('MAPNIK', tiles, [], True, useCache=False, cpt=False)
+			if data is not None )
+
+	def testOverlapAtWorldEdges(self):
+		'''The metatile overlap must not make the tiles at the edges of the source grid fail'''
+		built = self.buildAll(3)
+		overlap = MapService.METATILE_OVERLAP
+		MapService.METATILE_OVERLAP = 0
+		try:
+			self.assertEqual(built, self.buildAll(3))
+		finally:
+			MapService.METATILE_OVERLAP = overlap
+		self.assertIn( (0, 2), built)
+		self.assertIn( (7, 2), built)
+
+	def testStoppedService(self):
+		'''A reprojected tile requested while the service is not running is missing, not an error'''
+		srv = MapService('OSM', tempfile.mkdtemp() + os.sep, 'WGS84')
+		self.assertIsNone(srv.getTile('MAPNIK', 0, 0, 1, useCache=False))
+
+	def testRevalidate(self):
+		'''Stale reprojected tiles are rebuilt at prefetch priority by a map service kept by the revalidator'''
+		revalidator = TileRevalidator()
+		srv = revalidator.getService('OSM', self.srv.cacheFolder, 'WGS84')
+		self.assertIs(srv, revalidator.getService('OSM', self.srv.cacheFolder, 'WGS84'))
+		srv.requestTile = self.srv.requestTile
+		priorities = []
+		build = srv.buildDstTiles
+		srv.buildDstTiles = lambda *args, **kwargs: priorities.append(kwargs.get('priority')) or build(*args, **kwargs)
+		revalidator.revalidate(srv, 'MAPNIK', True, [(0, 2, 3, None, None)])
+		self.assertEqual(priorities, [WorkerPool.PREFETCH])
+		self.assertEqual(revalidator.nbUpdated, 1)
+
+
+class TestMosaic(unittest.TestCase):
+
+	def setUp(self):
+		MapService.memCache.clear()
+		MapService.imgCache.clear()
+		self.srv = MapService('OSM', tempfile.mkdtemp() + os.sep)
+		self.srv.running = True
+		self.fetched, self.decoded = [], []
+		data = pngTile()
+		def getTiles(laykey, tiles, *args, **kwargs):
+			self.fetched.extend(tiles)
+			return [t + (data,) for t in tiles]
+		self.srv.getTiles = getTiles
+		decodeTile = self.srv.decodeTile
+		self.srv.decodeTile = lambda data: self.decoded.append(data) or decodeTile(data)
+
+	def tearDown(self):
+		MapService.memCache.clear()
+		MapService.imgCache.clear()
+
+	def testDecodedTiles(self):
+		'''Tiles of a previous mosaic are taken decoded from the images cache, they're neither fetched nor decoded again'''
+		bbox = self.srv.srcTms.globalbbox
+		self.srv.getImage('MAPNIK', bbox, 2, toDstGrid=False)
+		self.assertEqual( (len(self.fetched), len(self.decoded)), (16, 16) )
+		geoimg = self.srv.getImage('MAPNIK', bbox, 2, toDstGrid=False)
+		self.assertEqual( (len(self.fetched), len(self.decoded)), (16, 16) )
+		self.assertEqual(geoimg.img.getpixel( (300, 300) ), (255, 0, 0, 255))
+
+
+class TestPlaceholders(unittest.TestCase):
+
+	def setUp(self):
+		self.srv = MapService('OSM', tempfile.mkdtemp() + os.sep)
+		self.srv.running = True
+		#the tile at zoom 0 is cached, the tiles at zoom 1 can't be fetched
+		self.srv.memCache.put(self.srv.getMemKey('MAPNIK', 0, 0, 0, False), pngTile('blue'))
+		self.srv.getTiles = lambda laykey, tiles, *args, **kwargs: [t + (None,) for t in tiles]
+
+	def tearDown(self):
+		MapService.memCache.clear()
+		MapService.imgCache.clear()
+
+	def getImage(self, progressive):
+		frames = []
+		onUpdate = lambda geoimg: frames.append(geoimg.img.getpixel( (10, 10) ))
+		geoimg = self.srv.getImage('MAPNIK', self.srv.srcTms.globalbbox, 1, toDstGrid=False,
+			onUpdate=onUpdate, progressive=progressive)
+		return geoimg, frames
+
+	def testFirstFrame(self):
+		'''Without progressive display the placeholders are still shown in a first frame'''
+		geoimg, frames = self.getImage(False)
+		self.assertEqual(frames, [(0, 0, 255, 255)])
+		#tiles that can't be fetched keep their placeholder
+		self.assertEqual(geoimg.img.getpixel( (300, 300) ), (0, 0, 255, 255))
+		self.assertEqual(len(geoimg.failed), 4)
+
+	def testAncestors(self):
+		'''Placeholders are cropped from the nearest cached ancestor, within the given number of levels'''
+		img = Image.new('RGBA', (256, 256), 'red')
+		img.paste(Image.new('RGBA', (128, 128), 'green'), (128, 0))
+		b = io.BytesIO()
+		img.save(b, format='PNG')
+		self.srv.memCache.put(self.srv.getMemKey('MAPNIK', 0, 0, 0, False), b.getvalue())
+		placeholders = self.srv.getPlaceholders('MAPNIK', [(1, 0, 1), (0, 1, 1), (3, 0, 2), (7, 0, 3)], toDstGrid=False, levels=2)
+		self.assertEqual(sorted(placeholders), [(0, 1, 1), (1, 0, 1), (3, 0, 2)])
+		self.assertEqual(placeholders[(1, 0, 1)].getpixel( (128, 128) ), (0, 128, 0, 255))
+		self.assertEqual(placeholders[(3, 0, 2)].getpixel( (128, 128) ), (0, 128, 0, 255))
+		self.assertEqual(placeholders[(0, 1, 1)].getpixel( (128, 128) ), (255, 0, 0, 255))
+		self.assertEqual(placeholders[(1, 0, 1)].size, (256, 256))
+
+
+class TestCoverageTree(unittest.TestCase):
+
+	def testDescendants(self):
+		'''On a quadtree the descendants of a missing tile are missing, not its siblings nor its ancestors'''
+		tree = CoverageTree(True, 3600)
+		tree.add(2, 3, 4)
+		self.assertTrue(tree.isMissing(2, 3, 4))
+		self.assertTrue(tree.isMissing(5, 7, 5))
+		self.assertTrue(tree.isMissing(16, 24, 7))
+		self.assertFalse(tree.isMissing(3, 3, 4))
+		self.assertFalse(tree.isMissing(1, 1, 3))
+
+	def testNotQuadTree(self):
+		tree = CoverageTree(False, 3600)
+		tree.add(2, 3, 4)
+		self.assertTrue(tree.isMissing(2, 3, 4))
+		self.assertFalse(tree.isMissing(4, 6, 5))
+
+	def testExpiry(self):
+		'''Expired misses are ignored and pruned when new ones are added'''
+		tree = CoverageTree(True, 3600)
+		tree.add(0, 0, 3, t=time.time() - 7200)
+		self.assertFalse(tree.isMissing(0, 0, 3))
+		tree.nextPrune = 0
+		tree.add(1, 0, 3)
+		self.assertEqual(len(tree), 1)
+		self.assertTrue(tree.isMissing(1, 0, 3))
+
+	def testInvalidBody(self):
+		'''An undecodable tile is a transient failure, only an empty body means the tile is missing'''
+		srv = MapService('OSM', tempfile.mkdtemp() + os.sep)
+		srv.httpPool.request = lambda url, headers: (200, {}, b'<html>Server busy</html>')
+		self.assertIsNone(srv.downloadTile('MAPNIK', 1, 1, 3))
+		self.assertFalse(srv.isMissing('MAPNIK', 1, 1, 3))
+		srv.httpPool.request = lambda url, headers: (200, {}, b'')
+		self.assertTrue(srv.isEmptyTile(srv.downloadTile('MAPNIK', 1, 1, 3)))
+		self.assertTrue(srv.isMissing('MAPNIK', 1, 1, 3))
+
+
+class TestGeoPackage(unittest.TestCase):
+
+	def setUp(self):
+		self.folder = tempfile.mkdtemp() + os.sep
+		self.tm = TileMatrix(GRIDS['WM'])
+
+	def tearDown(self):
+		GeoPackage.closeAll()
+
+	def createCache(self, name, tiles, date):
+		gpkg = GeoPackage(self.folder + name + '.gpkg', self.tm)
+		gpkg.putTiles([(x, y, z, os.urandom(1000)) for x, y, z in tiles])
+		with gpkg.transaction() as db:
+			db.execute('UPDATE gpkg_tiles SET last_access = ?', (date,))
+		return gpkg
+
+	def testConnectionPool(self):
+		'''Connections are opened once in WAL mode and shared by all instances and threads, concurrent writers don't fail'''
+		gpkg = GeoPackage(self.folder + 'pool.gpkg', self.tm)
+		self.assertIs(gpkg.pool, GeoPackage(self.folder + 'pool.gpkg', self.tm).pool)
+		with gpkg.pool.connect() as db:
+			self.assertEqual(db.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+		errors = []
+		def write(x):
+			try:
+				for y in range(16):
+					gpkg.putTiles([(x, y, 4, os.urandom(100))])
+					gpkg.getTile(x, y, 4)
+			except Exception as e:
+				errors.append(e)
+		threads = [threading.Thread(target=write, args=(x,)) for x in range(12)]
+		for t in threads:
+			t.start()
+		for t in threads:
+			t.join()
+		self.assertEqual(errors, [])
+		self.assertEqual(len(gpkg.listTiles([(x, y, 4) for x in range(12) for y in range(16)])), 12 * 16)
+		self.assertLessEqual(len(gpkg.pool.connections), GeoPackage.POOL_SIZE)
+
+	def testExactKeys(self):
+		'''Only the requested tiles are read, where the legacy query read every combination of their cols and rows'''
+		gpkg = self.createCache('keys', [(x, y, 6) for x in range(8) for y in range(8)], None)
+		diagonal = [(i, i, 6) for i in range(8)]
+		self.assertEqual(sorted(t[:3] for t in gpkg.getTiles(diagonal)), diagonal)
+		self.assertEqual(len(benchmarks.legacyGetTiles(gpkg, diagonal)), 64)
+		#more keys than sqlite variables limit
+		tiles = [(x, y, 12) for x in range(64) for y in range(64)] + diagonal
+		self.assertEqual(sorted(t[:3] for t in gpkg.getTiles(tiles)), diagonal)
+
+	def testBenchGetTiles(self):
+		out = io.StringIO()
+		stdout, sys.stdout = sys.stdout, out
+		try:
+			benchmarks.benchGetTiles(sizes=[(4,3), (8,6)], tileBytes=100)
+		finally:
+			sys.stdout = stdout
+		#header + full and ring shapes of each viewport
+		self.assertEqual(len(out.getvalue().splitlines()), 5)
+
+	def testFolderLRU(self):
+		'''The folder quota evict the least recently used tiles of all caches, not a share of each cache'''
+		old = self.createCache('old', [(0, 0, 1), (1, 0, 1)], '2020-01-01 00:00:00')
+		new = self.createCache('new', [(0, 0, 1), (1, 0, 1)], '2021-01-01 00:00:00')
+		janitor = CacheJanitor()
+		janitor.folder = self.folder
+		self.assertEqual(janitor.evict(janitor.listCaches(), 1500), 2)
+		self.assertEqual(old.listTiles([(0, 0, 1), (1, 0, 1)]), set())
+		self.assertEqual(len(new.listTiles([(0, 0, 1), (1, 0, 1)])), 2)
+
+	def testJanitorThread(self):
+		'''The janitor thread only runs while a quota is set'''
+		janitor = CacheJanitor()
+		janitor.configure(self.folder, 0, 0)
+		self.assertIsNone(janitor.thread)
+		janitor.configure(self.folder, 1, 0)
+		thread = janitor.thread
+		self.assertTrue(thread.is_alive())
+		janitor.configure(self.folder, 0, 0)
+		thread.join(5)
+		self.assertFalse(thread.is_alive())
+		self.assertIsNone(janitor.thread)
+
+	def testStaleTiles(self):
+		'''Stale tiles are reported by the same query that read them'''
+		gpkg = self.createCache('stale', [(0, 0, 1), (1, 0, 1)], None)
+		with gpkg.transaction() as db:
+			db.execute("UPDATE gpkg_tiles SET last_modified = '2000-01-01 00:00:00', etag = 'abc' WHERE tile_column = 0")
+		stale = []
+		self.assertEqual(len(gpkg.getTiles([(0, 0, 1), (1, 0, 1), (2, 0, 1)], stale)), 2)
+		self.assertEqual(stale, [(0, 0, 1, 'abc', None)])
+		stale = []
+		self.assertIsNotNone(gpkg.getTile(1, 0, 1, stale))
+		self.assertEqual(stale, [])
+		self.assertIsNotNone(gpkg.getTile(0, 0, 1, stale))
+		self.assertEqual(stale, [(0, 0, 1, 'abc', None)])
+
+	def testCompactLegacy(self):
+		'''A database without incremental vacuum is only rebuilt on request'''
+		path = self.folder + 'legacy.gpkg'
+		db = sqlite3.connect(path)
+		db.execute('CREATE TABLE dummy (id INTEGER)')
+		db.close()
+		gpkg = GeoPackage(path, self.tm)
+		gpkg.putTiles([(x, 0, 4, os.urandom(1000)) for x in range(10)])
+		gpkg.evict(5000)
+		autoVacuum = lambda: sqlite3.connect(path).execute('PRAGMA auto_vacuum').fetchone()[0]
+		self.assertEqual(autoVacuum(), 0)
+		gpkg.vacuum()
+		self.assertEqual(autoVacuum(), 2)
+
+	def testLockedCache(self):
+		'''Tiles are still returned if they can't be written in the cache database'''
+		srv = MapService('OSM', self.folder)
+		srv.running = True
+		data = pngTile()
+		srv.requestTile = lambda *args, **kwargs: (200, data, None, None)
+		def locked(tiles):
+			raise sqlite3.OperationalError('database is locked')
+		srv.getCache('MAPNIK', False).putTiles = locked
+		self.assertEqual(srv.getTile('MAPNIK', 0, 0, 1, toDstGrid=False), data)
+		tiles = srv.getTiles('MAPNIK', [(1, 0, 1)], [], toDstGrid=False, cpt=False)
+		self.assertEqual(tiles, [(1, 0, 1, data)])
+
+
+class TestDedup(unittest.TestCase):
+
+	def setUp(self):
+		self.folder = tempfile.mkdtemp() + os.sep
+		self.tm = TileMatrix(GRIDS['WM'])
+		self.blobs = [os.urandom(1000) for i in range(3)]
+
+	def tearDown(self):
+		GeoPackage.DEDUP = False
+		GeoPackage.closeAll()
+
+	def createCache(self, name, dedup):
+		GeoPackage.DEDUP = dedup
+		gpkg = GeoPackage(self.folder + name + '.gpkg', self.tm)
+		gpkg.putTiles([(x, y, 3, self.blobs[(x + y) % 3]) for x in range(8) for y in range(8)])
+		return gpkg
+
+	def countBlobs(self, gpkg):
+		with gpkg.pool.connect() as db:
+			return db.execute('SELECT COUNT(*) FROM gpkg_tiles_blobs').fetchone()[0]
+
+	def testView(self):
+		'''The gpkg_tiles view store each content once and behave like the regular table'''
+		gpkg = self.createCache('dedup', True)
+		self.assertTrue(gpkg.isDedup)
+		self.assertEqual(self.countBlobs(gpkg), 3)
+		self.assertEqual(gpkg.getTile(1, 2, 3), self.blobs[0])
+		#replace a tile
+		gpkg.putTiles([(1, 2, 3, self.blobs[1], 'abc', None)])
+		self.assertEqual(gpkg.getTile(1, 2, 3), self.blobs[1])
+		self.assertEqual(len(gpkg.getTiles([(x, y, 3) for x in range(8) for y in range(8)])), 64)
+		#update attributes
+		gpkg.touchTiles([(1, 2, 3)])
+		with gpkg.pool.connect() as db:
+			etag = db.execute('SELECT etag FROM gpkg_tiles WHERE tile_column = 1 AND tile_row = 2').fetchone()[0]
+		self.assertEqual(etag, 'abc')
+		#blobs are released with their last tile
+		with gpkg.transaction() as db:
+			db.execute('DELETE FROM gpkg_tiles WHERE (tile_column + tile_row) % 3 = 2')
+		self.assertEqual(self.countBlobs(gpkg), 2)
+		self.assertEqual(gpkg.dedupStats(), (43 * 1000, 2 * 1000))
+
+	def testHashOnce(self):
+		'''Each written tile is hashed once, and rewriting an unchanged tile keeps its row'''
+		gpkg = self.createCache('hash', True)
+		with gpkg.pool.connect() as db:
+			tileId = db.execute('SELECT id FROM gpkg_tiles WHERE tile_column = 1 AND tile_row = 2').fetchone()[0]
+		hashes = []
+		tileHash = GeoPackage.tileHash
+		GeoPackage.tileHash = staticmethod(lambda data: hashes.append(data) or tileHash(data))
+		try:
+			gpkg.putTiles([(1, 2, 3, self.blobs[0], 'abc', None), (2, 2, 3, self.blobs[0])])
+		finally:
+			GeoPackage.tileHash = staticmethod(tileHash)
+		self.assertEqual(len(hashes), 2)
+		with gpkg.pool.connect() as db:
+			row = db.execute('SELECT id, etag FROM gpkg_tiles WHERE tile_column = 1 AND tile_row = 2').fetchone()
+		self.assertEqual(row, (tileId, 'abc'))
+		self.assertEqual(gpkg.getTile(2, 2, 3), self.blobs[0])
+		self.assertEqual(self.countBlobs(gpkg), 3)
+
+	def testConvert(self):
+		'''An existing cache can be converted without losing tiles'''
+		gpkg = self.createCache('plain', False)
+		self.assertFalse(gpkg.isDedup)
+		gpkg.dedup()
+		self.assertTrue(gpkg.isDedup)
+		self.assertEqual(self.countBlobs(gpkg), 3)
+		tiles = gpkg.getTiles([(x, y, 3) for x in range(8) for y in range(8)])
+		self.assertEqual(sorted(tiles), sorted([(x, y, 3, self.blobs[(x + y) % 3]) for x in range(8) for y in range(8)]))
+
+	def testEvictSharedBlobs(self):
+		'''Deleting tiles whose blob is still shared barely release space, but the whole cache must not be evicted'''
+		gpkg = self.createCache('evict', True)
+		nb = gpkg.evict(3000)
+		self.assertGreater(nb, 0)
+		self.assertLess(nb, 64)
+		#a released blob is counted with its data
+		gpkg = self.createCache('evict2', True)
+		gpkg.putTiles([(0, 0, 4, os.urandom(5000))])
+		with gpkg.transaction() as db:
+			db.execute("UPDATE gpkg_tiles SET last_access = '2000-01-01 00:00:00' WHERE zoom_level = 4")
+		self.assertEqual(gpkg.evict(3000), 1)
+
+
+class TestHTTPConnectionPool(unittest.TestCase):
+
+	def testKeepAlive(self):
+		'''Sequential requests to a host reuse one persistent connection'''
+		server = benchmarks.TileServer(latency=0)
+		pool = HTTPConnectionPool()
+		try:
+			for i in range(10):
+				status, headers, body = pool.request(server.url + '/0/0/' + str(i) + '.png')
+				self.assertEqual(status, 200)
+				self.assertTrue(body.startswith(b'\x89PNG'))
+		finally:
+			pool.close()
+			server.shutdown()
+		self.assertEqual( (pool.nbRequests, pool.nbConnections, server.nbConnections), (10, 1, 1) )
+
+	def testProxyPerHost(self):
+		'''Requests through a proxy are capped per host too'''
+		pool = HTTPConnectionPool(maxPerHost=2)
+		pool.isProxied = lambda scheme, host: True
+		lock = threading.Lock()
+		active, peak = [0], [0]
+		class Handle():
+			status, headers = 200, {}
+			def __enter__(self):
+				return self
+			def __exit__(self, *args):
+				with lock:
+					active[0] -= 1
+			def read(self):
+				time.sleep(0.05)
+				return b'tile'
+		def urlopen(req, timeout=None):
+			with lock:
+				active[0] += 1
+				peak[0] = max(peak[0], active[0])
+			return Handle()
+		urlopen0 = mapviewer.urllib.request.urlopen
+		mapviewer.urllib.request.urlopen = urlopen
+		try:
+			threads = [threading.Thread(target=pool.request, args=('http://host/tile.png',)) for i in range(6)]
+			for t in threads:
+				t.start()
+			for t in threads:
+				t.join()
+		finally:
+			mapviewer.urllib.request.urlopen = urlopen0
+		self.assertEqual(peak[0], 2)
+
+
+class TestAsyncFetcher(unittest.TestCase):
+
+	def exchange(self, response):
+		class Writer():
+			def write(self, data):
+				pass
+			async def drain(self):
+				pass
+		loop = asyncio.new_event_loop()
+		try:
+			reader = asyncio.StreamReader(loop=loop)
+			reader.feed_data(response)
+			reader.feed_eof()
+			return loop.run_until_complete(AsyncTileFetcher().exchange(reader, Writer(), 'host', '/', {}))
+		finally:
+			loop.close()
+
+	def testNotModified(self):
+		'''The body of a 304 response is never read, even if a Content-Length is given'''
+		status, headers, body, keepAlive = self.exchange(b'HTTP/1.1 304 Not Modified\r\nContent-Length: 100\r\n\r\n')
+		self.assertEqual( (status, body, keepAlive), (304, b'', True) )
+
+	def testCancelledDownloads(self):
+		'''Downloads no more awaited by any fetch job are cancelled instead of holding their slots'''
+		srv = MapService('OSM', tempfile.mkdtemp() + os.sep)
+		srv.running = True
+		fetcher = AsyncTileFetcher()
+		cancelled = []
+		async def download(srv, laykey, col, row, zoom, alive):
+			try:
+				await asyncio.sleep(10)
+			except asyncio.CancelledError:
+				cancelled.append( (col, row, zoom) )
+				raise
+		fetcher.download = download
+		cancel = threading.Event()
+		threading.Timer(0.2, cancel.set).start()
+		try:
+			t0 = time.time()
+			self.assertEqual(fetcher.fetch(srv, 'MAPNIK', [(0, 0, 1), (1, 0, 1)], cpt=False, cancel=cancel), [])
+			self.assertLess(time.time() - t0, 1)
+			time.sleep(0.1)
+		finally:
+			fetcher.stop()
+		self.assertEqual(sorted(cancelled), [(0, 0, 1), (1, 0, 1)])
+		self.assertEqual(fetcher.inflight, {})
+
+	def testContentLength(self):
+		status, headers, body, keepAlive = self.exchange(b'HTTP/1.1 200 OK\r\nContent-Length: 4\r\n\r\ntile')
+		self.assertEqual( (status, body), (200, b'tile') )
+
+
+class TestSingleFlight(unittest.TestCase):
+
+	def setUp(self):
+		self.srv = MapService('OSM', tempfile.mkdtemp() + os.sep)
+		self.srv.running = True
+		self.downloads = []
+
+	def testThreads(self):
+		'''Concurrent requests of the same source tile share one download'''
+		gate = threading.Event()
+		data = pngTile()
+		def downloadTile(*args):
+			self.downloads.append(args)
+			gate.wait(5)
+			return data
+		self.srv.downloadTile = downloadTile
+		flight = self.srv.singleFlight
+		nbCalls, nbCoalesced = flight.nbCalls, flight.nbCoalesced
+		results = []
+		get = lambda: results.append(self.srv.getTile('MAPNIK', 0, 0, 1, toDstGrid=False, useCache=False))
+		threads = [threading.Thread(target=get) for i in range(5)]
+		for t in threads:
+			t.start()
+		t0 = time.time()
+		while flight.nbCalls - nbCalls < 5 and time.time() - t0 < 5:
+			time.sleep(0.01)
+		gate.set()
+		for t in threads:
+			t.join()
+		self.assertEqual(results, [data] * 5)
+		self.assertEqual(len(self.downloads), 1)
+		self.assertEqual(flight.nbCoalesced - nbCoalesced, 4)
+
+	def testAsync(self):
+		'''Duplicate tiles fetched through the event loop share one download'''
+		fetcher = AsyncTileFetcher()
+		async def download(srv, laykey, col, row, zoom, alive):
+			self.downloads.append( (col, row, zoom) )
+			await asyncio.sleep(0.05)
+			return b'tile'
+		fetcher.download = download
+		try:
+			tiles = fetcher.fetch(self.srv, 'MAPNIK', [(0, 0, 1), (0, 0, 1), (1, 0, 1)], cpt=False)
+		finally:
+			fetcher.stop()
+		self.assertEqual(sorted(tiles), [(0, 0, 1, b'tile'), (0, 0, 1, b'tile'), (1, 0, 1, b'tile')])
+		self.assertEqual(sorted(self.downloads), [(0, 0, 1), (1, 0, 1)])
+
+
+class TestNumpyWarper(unittest.TestCase):
+	'''Compare the warped pixels with the source pixels positions given by reprojPt'''
+
+	def setUp(self):
+		self.alg = mapviewer.RESAMP_ALG
+		#source pixels values are their column and row numbers, so any position is interpolated exactly
+		w, h = 200, 200
+		a = np.zeros((h, w, 4), dtype=np.uint8)
+		a[..., 0] = np.arange(w)[np.newaxis, :]
+		a[..., 1] = np.arange(h)[:, np.newaxis]
+		a[..., 3] = 255
+		self.img = Image.fromarray(a, 'RGBA')
+
+	def tearDown(self):
+		mapviewer.RESAMP_ALG = self.alg
+
+	def check(self, crs1, crs2, src_ul, src_res, dst_ul, dst_res, size=100):
+		for alg, tolerance in [('NN', 1), ('BL', 0.6), ('CB', 0.6)]:
+			mapviewer.RESAMP_ALG = alg
+			out = NumpyWarper(crs1, crs2).warp(self.img, src_ul, src_res, dst_ul, (size, size), dst_res)
+			out = np.asarray(out).astype(float)
+			for col in range(2, size, 7):
+				for row in range(2, size, 11):
+					x, y = reprojPt(crs2, crs1, dst_ul[0] + (col + 0.5) * dst_res, dst_ul[1] - (row + 0.5) * dst_res)
+					px, py = (x - src_ul[0]) / src_res - 0.5, (src_ul[1] - y) / src_res - 0.5
+					if alg == 'NN':
+						px, py = math.floor(px + 0.5), math.floor(py + 0.5)
+					self.assertLessEqual(abs(out[row, col, 0] - px), tolerance, alg)
+					self.assertLessEqual(abs(out[row, col, 1] - py), tolerance, alg)
+					self.assertEqual(out[row, col, 3], 255)
+
+	def testWMToWGS84(self):
+		self.check('EPSG:3857', 'EPSG:4326', (500000, 6000000), 2000, (5, 47), 0.02)
+
+	def testWGS84ToWM(self):
+		self.check('EPSG:4326', 'EPSG:3857', (4, 48), 0.02, (500000, 5900000), 2000)
+
+
+class TestWarpOptions(unittest.TestCase):
+
+	def tearDown(self):
+		ReprojContext.THRESHOLD, ReprojContext.MEM_LIMIT, ReprojContext.MULTITHREAD = 0.25, 0, True
+		MapService.OFFLINE = False
+
+	def testPrefs(self):
+		'''Warp settings are taken from the addon preferences'''
+		context = fakeContext(tempfile.mkdtemp() + os.sep)
+		prefs = context.user_preferences.addons[mapviewer.__package__].preferences
+		prefs.warpThreshold, prefs.warpMemLimit, prefs.warpMultithread = 0.5, 256, False
+		BaseMap(context, 'OSM', 'MAPNIK')
+		self.assertEqual( (ReprojContext.THRESHOLD, ReprojContext.MEM_LIMIT, ReprojContext.MULTITHREAD), (0.5, 256, False) )
+
+	@unittest.skipUnless(mapviewer.GDAL, 'GDAL is not installed')
+	def testWorkerThreads(self):
+		'''A warp called from a pool worker use a single thread, the options of each case are built once'''
+		ctx = ReprojContext.get('EPSG:3857', 'EPSG:4326')
+		ctx.warpOptions = {}
+		ctx.getWarpOptions()
+		MapService.workers.map(lambda i: ctx.getWarpOptions(), [(i,) for i in range(8)], nbThread=4)
+		self.assertEqual(sorted(key[-1] for key in ctx.warpOptions), [False, True])
+
+
+class TestLRUCache(unittest.TestCase):
+
+	def testBudget(self):
+		'''The size of the values is tracked through replacements, pops and resizes'''
+		cache = LRUCache(10)
+		cache.put('a', b'1234')
+		cache.put('b', b'1234')
+		cache.put('a', b'12')
+		self.assertEqual(cache.size, 6)
+		self.assertEqual(cache.pop('b'), b'1234')
+		self.assertEqual(cache.size, 2)
+		#a value bigger than the whole budget is not stored and the previous one is dropped
+		cache.put('a', b'x' * 11)
+		self.assertNotIn('a', cache)
+		self.assertEqual(cache.size, 0)
+
+	def testEvictLeastRecentlyUsed(self):
+		cache = LRUCache(10)
+		for key in 'abc':
+			cache.put(key, b'123')
+		cache.get('a')
+		cache.put('d', b'123')
+		self.assertEqual(sorted(cache.items), ['a', 'c', 'd'])
+		self.assertEqual(cache.size, 9)
+		cache.resize(6)
+		self.assertEqual(sorted(cache.items), ['a', 'd'])
+		self.assertEqual(cache.size, 6)
+		cache.get('z')
+		self.assertEqual(cache.hitRatio, 0.5)
+
+
+class TestRateLimiter(unittest.TestCase):
+
+	def timeRequests(self, limiter, nb):
+		t = time.monotonic()
+		for i in range(nb):
+			limiter.wait()
+		return time.monotonic() - t
+
+	def testUnlimited(self):
+		self.assertLess(self.timeRequests(RateLimiter(0), 1000), 0.1)
+
+	def testRate(self):
+		'''After the burst, requests are spaced by 1/rate seconds'''
+		elapsed = self.timeRequests(RateLimiter(50, burst=5), 10)
+		self.assertGreaterEqual(elapsed, 5 / 50 - 0.01)
+		self.assertLess(elapsed, 0.5)
+
+	def testThreads(self):
+		'''The rate is shared by all threads'''
+		limiter = RateLimiter(50)
+		limiter.wait()
+		t = time.monotonic()
+		threads = [threading.Thread(target=self.timeRequests, args=(limiter, 2)) for i in range(5)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		self.assertGreaterEqual(time.monotonic() - t, 10 / 50 - 0.01)
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+	def setUp(self):
+		self.breaker = CircuitBreaker()
+		self.breaker.COOLDOWN = 0.1
+		self.breaker.MAX_COOLDOWN = 0.2
+
+	def fail(self, nb=1):
+		for i in range(nb):
+			self.breaker.failure('host')
+
+	def testOpen(self):
+		'''A host is no more requested after THRESHOLD consecutive failures'''
+		self.fail(CircuitBreaker.THRESHOLD - 1)
+		self.assertTrue(self.breaker.allow('host'))
+		self.breaker.success('host')
+		self.fail(CircuitBreaker.THRESHOLD - 1)
+		self.assertTrue(self.breaker.allow('host'))
+		self.fail()
+		self.assertFalse(self.breaker.allow('host'))
+		self.assertTrue(self.breaker.allow('other'))
+		self.assertEqual(self.breaker.nbOpen, 1)
+
+	def testProbe(self):
+		'''After the cooldown a single probe is allowed, its failure reopen the circuit for a longer cooldown'''
+		self.fail(CircuitBreaker.THRESHOLD)
+		time.sleep(0.12)
+		self.assertTrue(self.breaker.allow('host'))
+		self.assertFalse(self.breaker.allow('host'))
+		self.fail()
+		time.sleep(0.12)
+		self.assertFalse(self.breaker.allow('host'))
+		time.sleep(0.1)
+		self.assertTrue(self.breaker.allow('host'))
+		self.breaker.success('host')
+		self.assertTrue(self.breaker.allow('host'))
+		self.assertEqual(self.breaker.nbOpen, 0)
+
+	def testReport(self):
+		'''Only connection errors count as failures, an http error proves the host is reachable'''
+		srv = MapService('OSM', tempfile.mkdtemp() + os.sep)
+		srv.breaker = self.breaker
+		url = 'http://host/0/0/0.png'
+		for i in range(CircuitBreaker.THRESHOLD):
+			srv.reportRequest(url, urllib.error.HTTPError(url, 500, 'error', None, None))
+		self.assertTrue(srv.canRequest(url))
+		for i in range(CircuitBreaker.THRESHOLD):
+			srv.reportRequest(url, ConnectionRefusedError())
+		self.assertFalse(srv.canRequest(url))
+
+	def testCancelledProbe(self):
+		'''A cancelled probe request must not keep the host closed forever'''
+		srv = MapService('OSM', tempfile.mkdtemp() + os.sep)
+		srv.breaker = self.breaker
+		host = urllib.parse.urlsplit(srv.buildUrl('MAPNIK', 0, 0, 1))[1]
+		for i in range(CircuitBreaker.THRESHOLD):
+			self.breaker.failure(host)
+		time.sleep(0.12)
+		fetcher = AsyncTileFetcher()
+		fetcher.start()
+		async def get(url, headers):
+			await asyncio.sleep(10)
+		fetcher.get = get
+		try:
+			job = asyncio.run_coroutine_threadsafe(fetcher.download(srv, 'MAPNIK', 0, 0, 1), fetcher.loop)
+			time.sleep(0.2)
+			self.assertFalse(self.breaker.allow(host))
+			job.cancel()
+			time.sleep(0.1)
+		finally:
+			fetcher.stop()
+		self.assertTrue(self.breaker.allow(host))
+
+
+class TestWorkerPool(unittest.TestCase):
+
+	def setUp(self):
+		self.pool = WorkerPool(1)
+
+	def tearDown(self):
+		self.pool.stop()
+
+	def testNested(self):
+		'''A batch submitted from a worker is processed without deadlock, even with a single worker'''
+		done = []
+		def job(i):
+			self.pool.map(lambda j: done.append((i, j)), [(j,) for j in range(3)], nbThread=2)
+		self.assertEqual(self.pool.map(job, [(i,) for i in range(4)], nbThread=2), 4)
+		self.assertEqual(len(done), 12)
+
+	def testPreemption(self):
+		'''A worker busy with prefetch jobs switch to the visible jobs as soon as they are submitted'''
+		log = []
+		def job(name, delay):
+			time.sleep(delay)
+			log.append( (name, self.pool.inWorker) )
+		prefetch = threading.Thread(target=self.pool.map, args=(job, [('prefetch', 0.02)] * 30),
+			kwargs={'nbThread':2, 'priority':WorkerPool.PREFETCH})
+		prefetch.start()
+		time.sleep(0.05)
+		self.pool.map(job, [('visible', 0.02)] * 6, nbThread=2, priority=WorkerPool.VISIBLE)
+		nbPrefetch = len([entry for entry in log if entry[0] == 'prefetch'])
+		prefetch.join()
+		#the worker helped the visible batch, which was done before the prefetch batch
+		self.assertIn( ('visible', True), log)
+		self.assertLess(nbPrefetch, 30)
+
+	def testCenterFirst(self):
+		'''Tiles are requested from the view center, and the remaining ones are sorted again when the view moves'''
+		srv = MapService('OSM', tempfile.mkdtemp() + os.sep)
+		srv.running = True
+		tm = srv.srcTms
+		def center(col, row):
+			xmin, ymin, xmax, ymax = tm.getTileBbox(col, row, 3)
+			return (xmin + xmax) / 2, (ymin + ymax) / 2
+		order = []
+		def downloadTile(laykey, col, row, zoom):
+			order.append( (col, row) )
+			if len(order) == 1:
+				srv.setViewCenter(*center(0, 0))
+			return None
+		srv.downloadTile = downloadTile
+		srv.setViewCenter(*center(5, 5))
+		tiles = [(col, row, 3) for col in range(8) for row in range(8)]
+		srv.getTiles('MAPNIK', tiles, [], toDstGrid=False, useCache=False, nbThread=1, cpt=False)
+		self.assertEqual(len(order), 64)
+		self.assertEqual(order[0], (5, 5))
+		self.assertEqual(order[1], (0, 0))
+		distances = [col**2 + row**2 for col, row in order[1:]]
+		self.assertEqual(distances, sorted(distances))
+
+	def testGeneration(self):
+		'''Remaining jobs of a request are dropped when a new generation starts'''
+		srv = MapService('OSM', tempfile.mkdtemp() + os.sep)
+		srv.running = True
+		generation = srv.generation
+		def job(i):
+			if i == 2:
+				srv.newGeneration()
+		nb = self.pool.map(job, [(i,) for i in range(20)], nbThread=2, alive=lambda: srv.isAlive(generation))
+		self.assertLess(nb, 20)
+		self.assertFalse(srv.isAlive(generation))
+		self.assertTrue(srv.isAlive(srv.generation))
+
+
+if __name__ == '__main__':
+	unittest.main()